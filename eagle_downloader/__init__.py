@@ -0,0 +1,17 @@
+from eagle_downloader.main import (
+    CompletedEvent,
+    DownloadEvent,
+    Downloader,
+    FailedEvent,
+    Job,
+    ProgressEvent,
+)
+
+__all__ = [
+    "CompletedEvent",
+    "DownloadEvent",
+    "Downloader",
+    "FailedEvent",
+    "Job",
+    "ProgressEvent",
+]
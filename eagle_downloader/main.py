@@ -1,33 +1,140 @@
 #!/usr/bin/env python
 import questionary
-from os import makedirs, path
-from sys import stdout
+from os import (
+    close,
+    dup,
+    dup2,
+    fdopen,
+    fstat,
+    getpid,
+    listdir,
+    makedirs,
+    path,
+    remove,
+    replace,
+    scandir,
+)
+from sys import stderr, stdout
+from json import dump, dumps, load, loads
+from bisect import bisect_left
+from collections import deque
+from zlib import crc32
+from shutil import copyfileobj, disk_usage, which
+from hashlib import algorithms_guaranteed, new as new_hash
+from mmap import ACCESS_READ, mmap
+from socket import gethostname
+from weakref import WeakSet
+from sqlite3 import connect as connect_sqlite
+from signal import (
+    SIG_DFL,
+    SIG_IGN,
+    SIGINT,
+    SIGTERM,
+    getsignal,
+    signal as set_signal_handler,
+)
+from threading import (
+    Event as ThreadEvent,
+    Lock as ThreadLock,
+    Thread,
+    current_thread,
+    get_ident,
+)
+from time import localtime, perf_counter, sleep as sleep_thread, time
+from contextlib import contextmanager, nullcontext
 from asyncio import (
     CancelledError,
+    Condition,
     Event,
-    Lock,
+    Queue,
     Semaphore,
+    TimeoutError,
     all_tasks,
+    create_subprocess_exec,
     create_task,
     current_task,
     gather,
     get_event_loop,
+    get_running_loop,
+    open_connection,
     run,
     sleep,
+    wait_for,
 )
+from asyncio.subprocess import DEVNULL, PIPE
+from subprocess import DEVNULL as SUBPROCESS_DEVNULL, PIPE as SUBPROCESS_PIPE, Popen
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import freeze_support, get_context
 from yt_dlp import YoutubeDL
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.dash import DashSegmentsFD
+from yt_dlp.downloader.hls import HlsFD
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import RequestError, TransportError
+from yt_dlp.utils import ContentTooShortError, DownloadCancelled, DownloadError
 from itertools import cycle
+from abc import ABC, abstractmethod
 from uuid import uuid4
 from argparse import ArgumentParser
+from urllib.parse import urljoin, urlparse
 from colorama import init, Fore
 from tqdm import tqdm
 from functools import partial
+from contextvars import ContextVar, copy_context
+from logging import ERROR, INFO, WARNING, getLogger
+
+try:
+    from os import copy_file_range
+except ImportError:  # Linux only
+    copy_file_range = None
+try:
+    from os import sendfile
+except ImportError:  # not available on Windows
+    sendfile = None
 
 
 init(autoreset=True)
 
 __version__ = "v1.0.2.1"
 
+DEFAULT_TRACE_FILE = "eagle-trace.json"
+DEFAULT_SYNC_FILE = "eagle-sync.json"
+DEFAULT_WORKER_CONCURRENCY = 5
+DRAIN_TIMEOUT = 60
+SCHEDULE_INTERVAL = 30
+BANDWIDTH_BURST = 1.0
+EXECUTOR_SPARE_THREADS = 4
+METADATA_RATE = 2.0
+METADATA_BURST = 5
+LOOP_LAG_INTERVAL = 0.05
+PROGRESS_INTERVAL = 0.1
+LOG_LEVELS = {Fore.RED: ERROR, Fore.YELLOW: WARNING}
+
+logger = getLogger("eagle_downloader")
+current_downloader = ContextVar("current_downloader", default=None)
+
+
+def notify(color, message):
+    """Prints a status message in `color`.
+
+    Inside the jobs of a `Downloader` the message is logged to the
+    "eagle_downloader" logger instead, so the host program keeps its stdout.
+    """
+    if current_downloader.get() is None:
+        print(color + message)
+    else:
+        logger.log(LOG_LEVELS.get(color, INFO), message.strip())
+
+
+def context_executor():
+    """Returns the executor of the `Downloader` running the current task.
+
+    None selects the event loop's default executor, which the CLI sizes.
+    """
+    downloader = current_downloader.get()
+    return downloader.executor if downloader is not None else None
+
 
 def brand():
     """
@@ -60,9 +167,266 @@ def parse_arguments():
         version=f"Eagle Downloader {__version__}",
         help="Show the program's version number and exit.",
     )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=DEFAULT_TRACE_FILE,
+        metavar="TRACE_FILE",
+        help="Record a Chrome/Perfetto trace of the download pipeline "
+        f"(default: {DEFAULT_TRACE_FILE}).",
+    )
+    parser.add_argument(
+        "--sync",
+        nargs="?",
+        const=DEFAULT_SYNC_FILE,
+        metavar="STATE_FILE",
+        help="Only download entries uploaded since the last sync of the same URL, "
+        f"tracked in STATE_FILE (default: {DEFAULT_SYNC_FILE}).",
+    )
+    parser.add_argument(
+        "--coordinator",
+        metavar="QUEUE",
+        help="Publish the entries of the URL to a shared work queue instead of "
+        "downloading them (a sqlite file path or BACKEND://LOCATION).",
+    )
+    parser.add_argument(
+        "--worker",
+        metavar="QUEUE",
+        help="Lease and download entries from a shared work queue until it is drained.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_WORKER_CONCURRENCY,
+        help="Concurrent downloads per worker "
+        f"(default: {DEFAULT_WORKER_CONCURRENCY}).",
+    )
+    parser.add_argument(
+        "--metadata-rate",
+        type=float,
+        default=METADATA_RATE,
+        metavar="RPS",
+        help="Extractions per second allowed per host, 0 to disable "
+        f"(default: {METADATA_RATE}).",
+    )
+    parser.add_argument(
+        "--metadata-burst",
+        type=int,
+        default=METADATA_BURST,
+        metavar="N",
+        help="Extractions per host that may start back to back before pacing "
+        f"applies (default: {METADATA_BURST}).",
+    )
+    parser.add_argument(
+        "--schedule",
+        metavar="WINDOWS",
+        help="Change the total rate limit and concurrent downloads by time of "
+        "day while running, e.g. '08:00-18:00=1M/2,22:00-06:00=none/10'.",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=DRAIN_TIMEOUT,
+        metavar="SECONDS",
+        help="On the first interrupt, let downloads in progress finish for up to "
+        f"SECONDS before stopping them (default: {DRAIN_TIMEOUT}).",
+    )
+    parser.add_argument(
+        "--sink",
+        metavar="TARGET",
+        help="Stream downloads to TARGET while they download instead of saving "
+        "them: '-' for stdout, a file or named pipe path, or BACKEND://LOCATION.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Run extraction and downloads in N worker processes instead of "
+        "threads of this process.",
+    )
+    parser.add_argument(
+        "--shard-outputs",
+        action="store_true",
+        help="Spread new files over 256 subdirectories of the output directory, "
+        "picked from the video id.",
+    )
+    parser.add_argument(
+        "--async-transfers",
+        action="store_true",
+        help="Move media bytes on the event loop with non-blocking sockets, so "
+        "many concurrent downloads need only a few threads.",
+    )
+    parser.add_argument(
+        "--sweep-partials",
+        nargs="?",
+        type=float,
+        const=PARTIAL_MAX_AGE / 3600,
+        metavar="HOURS",
+        help="Before downloading, remove partial and fragment files untouched "
+        "for HOURS from the output directories; they can no longer be resumed "
+        f"(default: {PARTIAL_MAX_AGE // 3600}).",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the size and durations of finished files with ffprobe and "
+        "download the ones that fail again.",
+    )
+    parser.add_argument(
+        "--checksum",
+        choices=sorted(algorithms_guaranteed),
+        metavar="ALGORITHM",
+        help="Verify finished files and report their checksum, e.g. sha256.",
+    )
     return parser.parse_args()
 
 
+class Tracer:
+    """Records pipeline spans and counters in the Chrome trace event format.
+
+    Spans on the event loop are recorded as async events so that concurrent
+    downloads do not overlap on one track; work running in executor threads is
+    recorded as complete events on the thread that ran it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.threads = set()
+        self.pending = {}
+        self.origin = perf_counter()
+        self.pid = getpid()
+
+    def enable(self):
+        self.enabled = True
+        self.events = []
+        self.threads = set()
+        self.pending = {}
+        self.origin = perf_counter()
+
+    def now(self):
+        """Returns the trace timestamp in microseconds."""
+        return (perf_counter() - self.origin) * 1e6
+
+    def record(self, event):
+        tid = get_ident()
+        if tid not in self.threads:
+            self.threads.add(tid)
+            self.events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": current_thread().name},
+                }
+            )
+        event.update(pid=self.pid, tid=tid)
+        self.events.append(event)
+
+    def complete(self, name, category, started, **args):
+        """Records a span that started at `started` and ends now."""
+        self.record(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": started,
+                "dur": self.now() - started,
+                "args": args,
+            }
+        )
+
+    def counter(self, name, **values):
+        self.record({"name": name, "ph": "C", "ts": self.now(), "args": values})
+
+    def span(self, name, category="pipeline", **args):
+        """Times a block running on the current thread."""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name, category, args):
+        started = self.now()
+        try:
+            yield
+        finally:
+            self.complete(name, category, started, **args)
+
+    def async_span(self, name, span_id, category="pipeline", **args):
+        """Times a block of a coroutine that may interleave with other coroutines."""
+        if not self.enabled:
+            return nullcontext()
+        return self._async_span(name, span_id, category, args)
+
+    @contextmanager
+    def _async_span(self, name, span_id, category, args):
+        event = {"name": name, "cat": category, "id": str(span_id)}
+        self.record({**event, "ph": "b", "ts": self.now(), "args": args})
+        try:
+            yield
+        finally:
+            self.record({**event, "ph": "e", "ts": self.now()})
+
+    def traced(self, name, func, category="executor"):
+        """Wraps a callable so that its queue wait and run time are recorded."""
+        if not self.enabled:
+            return func
+        submitted = self.now()
+
+        def wrapper(*args, **kwargs):
+            started = self.now()
+            self.complete(f"{name}:queued", category, submitted)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.complete(name, category, started)
+
+        return wrapper
+
+    def hook(self, name, func):
+        """Wraps a yt-dlp hook so that every call is recorded."""
+        if not self.enabled:
+            return func
+
+        def wrapper(d):
+            started = self.now()
+            try:
+                return func(d)
+            finally:
+                self.complete(name, "hook", started, status=d.get("status"))
+
+        return wrapper
+
+    def postprocessor_hook(self, d):
+        """yt-dlp postprocessor hook that records a span per postprocessor."""
+        key = (get_ident(), d.get("postprocessor"))
+        if d["status"] == "started":
+            self.pending[key] = self.now()
+        elif d["status"] == "finished":
+            started = self.pending.pop(key, None)
+            if started is not None:
+                self.complete(d.get("postprocessor"), "postprocessor", started)
+
+    def save(self, trace_file):
+        with open(trace_file, "w") as handle:
+            dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, handle)
+
+
+tracer = Tracer()
+
+
+async def sample_event_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Records how late the event loop wakes up from a sleep, until cancelled."""
+    while True:
+        started = perf_counter()
+        await sleep(interval)
+        lag = perf_counter() - started - interval
+        tracer.counter("event_loop_lag", lag_ms=round(max(lag, 0) * 1000, 3))
+
+
 def create_output_directory(directory_name="downloads"):
     """Creates the output directory if it doesn't exist."""
     output_path = path.abspath(directory_name)
@@ -102,6 +466,13 @@ async def get_video_quality():
     return quality
 
 
+async def get_save_thumbnail():
+    """Asks the user if they want to save a thumbnail for each video."""
+    return await questionary.confirm(
+        "Do you want to save a thumbnail for each video?", default=False
+    ).ask_async()
+
+
 async def get_output_directory():
     """Asks the user to enter the output directory."""
     output_dir = await questionary.text(
@@ -193,11 +564,20 @@ def get_ydl_options(
     video_quality,
     video_output_dir=None,
     cookies_file=None,
+    outputs=None,
 ):
     """Prepares the options for yt-dlp based on user inputs."""
     ydl_opts = initialize_ydl_options(output_path, video_output_dir, cookies_file)
     ydl_opts["format"] = get_format_string(download_type, video_quality)
-    ydl_opts["postprocessors"] = get_postprocessors(download_type, audio_quality)
+    ydl_opts["postprocessors"] = get_postprocessors(
+        download_type, audio_quality, outputs=outputs
+    )
+    ydl_opts["format_planning"] = {
+        "download_type": download_type,
+        "video_quality": video_quality,
+        "audio_quality": audio_quality,
+        "outputs": outputs,
+    }
     if rate_limit:
         ydl_opts["ratelimit"] = rate_limit
     if download_type in ["video", "both"]:
@@ -234,8 +614,45 @@ def get_format_string(download_type, video_quality):
     return "best"
 
 
-def get_postprocessors(download_type, audio_quality):
-    """Configures postprocessors for yt-dlp."""
+MP4_VIDEO_CODECS = ("avc1", "avc3", "h264", "hev1", "hvc1", "h265", "av01")
+MP4_AUDIO_CODECS = ("mp4a", "aac", "mp3", "ac-3", "ec-3")
+LOCAL_POSTPROCESSORS = ("DeriveOutputs",)
+DERIVED_OUTPUTS = {"mp3": ".mp3", "thumbnail": ".jpg"}
+PARTIAL_SUFFIXES = (".part", ".ytdl", ".temp")
+PARTIAL_MAX_AGE = 24 * 60 * 60
+MERGE_HEADROOM = 1.1
+DISK_RECHECK_INTERVAL = 5
+VERIFY_WORKERS = 2
+MAX_VERIFY_ATTEMPTS = 3
+VERIFY_CHUNK_SIZE = 1024 * 1024
+DURATION_TOLERANCE = 2.0
+
+
+def is_mp4_compatible(vcodec, acodec):
+    """Checks whether the codecs can be stored in an mp4 container without re-encoding."""
+    video_ok = vcodec == "none" or (vcodec or "").lower().startswith(MP4_VIDEO_CODECS)
+    audio_ok = acodec == "none" or (acodec or "").lower().startswith(MP4_AUDIO_CODECS)
+    return video_ok and audio_ok
+
+
+def is_single_mp4_compatible(plan):
+    """Checks whether a plan downloads a single file whose codecs fit in mp4."""
+    if not plan or plan.get("merge"):
+        return False
+    return is_mp4_compatible(plan["vcodec"], plan["acodec"])
+
+
+def get_postprocessors(download_type, audio_quality, plan=None, outputs=None):
+    """Configures postprocessors for yt-dlp.
+
+    Merged "both" downloads already come out as mp4 through
+    `merge_output_format`, so the convertor leaves them alone. A planned single
+    file is converted for real when it is not mp4: it is remuxed with a stream
+    copy instead when its codecs fit in mp4, and when only the audio does not
+    fit, `get_postprocessor_args` limits the conversion to the audio. Extra
+    `outputs` are derived from the downloaded file by the local "DeriveOutputs"
+    postprocessor.
+    """
     if download_type == "audio":
         return [
             {
@@ -244,32 +661,387 @@ def get_postprocessors(download_type, audio_quality):
                 "preferredquality": audio_quality,
             }
         ]
-    elif download_type == "both":
-        return [
+    postprocessors = []
+    if download_type == "both":
+        if is_single_mp4_compatible(plan):
+            postprocessors.append(
+                {
+                    "key": "FFmpegVideoRemuxer",
+                    "preferedformat": "mp4",
+                }
+            )
+        else:
+            postprocessors.append(
+                {
+                    "key": "FFmpegVideoConvertor",
+                    "preferedformat": "mp4",
+                }
+            )
+    if outputs:
+        postprocessors.append(
             {
-                "key": "FFmpegVideoConvertor",
-                "preferedformat": "mp4",
+                "key": "DeriveOutputs",
+                "outputs": list(outputs),
+                "audio_quality": audio_quality,
             }
-        ]
-    return []
+        )
+    return postprocessors
+
+
+def get_postprocessor_args(download_type, audio_quality, plan=None):
+    """Returns yt-dlp `postprocessor_args` for a planned "both" download, if any.
+
+    A single file whose video fits in mp4 but whose audio does not is converted
+    with the video stream copied, so only the audio is re-encoded to AAC.
+    """
+    if download_type != "both" or not plan or plan.get("merge"):
+        return None
+    if is_mp4_compatible(plan["vcodec"], plan["acodec"]):
+        return None
+    if not is_mp4_compatible(plan["vcodec"], "none"):
+        return None
+    args = ["-c:v", "copy", "-c:a", "aac"]
+    if audio_quality:
+        args += ["-b:a", f"{audio_quality}k"]
+    return {"videoconvertor+ffmpeg_o": args}
+
+
+def get_derived_outputs(download_type, thumbnail=False):
+    """Lists the outputs derived from each downloaded video.
+
+    "Both" downloads fetch the streams once and derive the mp3 from the local file.
+    """
+    outputs = ["mp3"] if download_type == "both" else []
+    if thumbnail and download_type in ["video", "both"]:
+        outputs.append("thumbnail")
+    return outputs
+
+
+def split_local_postprocessors(ydl_opts):
+    """Separates the postprocessors run by Eagle Downloader from yt-dlp's own."""
+    postprocessors = ydl_opts.get("postprocessors") or []
+    local = [pp for pp in postprocessors if pp["key"] in LOCAL_POSTPROCESSORS]
+    if not local:
+        return ydl_opts, []
+    ydl_opts = dict(ydl_opts)
+    ydl_opts["postprocessors"] = [
+        pp for pp in postprocessors if pp["key"] not in LOCAL_POSTPROCESSORS
+    ]
+    return ydl_opts, local
+
+
+def build_derive_command(ffmpeg, source, output, audio_quality=None):
+    """Builds the ffmpeg command that derives `output` from the source file."""
+    target = path.splitext(source)[0] + DERIVED_OUTPUTS[output]
+    if output == "mp3":
+        input_args = []
+        output_args = ["-vn", "-c:a", "libmp3lame", "-b:a", f"{audio_quality or 320}k"]
+    else:
+        input_args = ["-ss", "1"]
+        output_args = ["-frames:v", "1"]
+    return [
+        ffmpeg,
+        "-y",
+        "-loglevel",
+        "error",
+        *input_args,
+        "-i",
+        source,
+        *output_args,
+        target,
+    ]
+
+
+async def run_command(command):
+    """Runs a command without blocking the event loop and returns its exit status."""
+    process = await create_subprocess_exec(*command, stdout=DEVNULL, stderr=PIPE)
+    _, stderr = await process.communicate()
+    return process.returncode, stderr.decode(errors="replace").strip()
+
+
+async def derive_outputs(source, outputs, audio_quality=None):
+    """Derives every requested output from the downloaded file in parallel."""
+    ffmpeg = which("ffmpeg")
+    if not ffmpeg:
+        notify(Fore.YELLOW, "ffmpeg not found. Skipping derived outputs.")
+        return []
+    commands = [
+        build_derive_command(ffmpeg, source, output, audio_quality)
+        for output in outputs
+    ]
+    results = await gather(*(run_command(command) for command in commands))
+    derived = []
+    for command, (returncode, error) in zip(commands, results):
+        if returncode:
+            notify(Fore.RED, f"Error deriving {command[-1]}: {error}")
+        else:
+            notify(Fore.GREEN, f"Derived: {command[-1]}")
+            derived.append(command[-1])
+    return derived
+
+
+async def run_local_postprocessors(postprocessors, output_file):
+    """Runs the local postprocessors against a finished download."""
+    for pp in postprocessors:
+        await derive_outputs(output_file, pp["outputs"], pp.get("audio_quality"))
+
+
+def has_video(fmt):
+    """Checks whether a yt-dlp format carries a video stream."""
+    return fmt.get("vcodec") not in (None, "none")
+
+
+def has_audio(fmt):
+    """Checks whether a yt-dlp format carries an audio stream."""
+    return fmt.get("acodec") not in (None, "none")
+
+
+def estimate_format_size(fmt, duration=None):
+    """Estimates the size in bytes of a format from its metadata."""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return int(size)
+    if fmt.get("tbr") and duration:
+        return int(fmt["tbr"] * 1000 / 8 * duration)
+    return None
+
+
+def format_cost(fmt, duration=None):
+    """Returns a sort key that orders formats from cheapest to most expensive."""
+    size = estimate_format_size(fmt, duration)
+    return (size is None, size or 0, fmt.get("tbr") or 0)
+
 
+def pick_audio_format(formats, min_abr=None, duration=None):
+    """Picks the cheapest audio-only format with at least `min_abr` kbps.
 
-async def download_entry(entry, ydl_opts, lock):
+    Without a bitrate constraint the best available bitrate is required, and
+    when no format reaches `min_abr` the highest bitrate one is used instead.
+    """
+    audios = [f for f in formats if has_audio(f) and not has_video(f)]
+    if not audios:
+        return None
+    best_abr = max(f.get("abr") or 0 for f in audios)
+    target = min(int(min_abr), best_abr) if min_abr else best_abr
+    sufficient = [f for f in audios if (f.get("abr") or 0) >= target]
+    return min(sufficient, key=lambda f: format_cost(f, duration))
+
+
+def pick_video_formats(formats, video_quality, duration=None):
+    """Picks the cheapest formats reaching the best height allowed by `video_quality`.
+
+    A combined format is preferred over a video+audio pair, since it needs no merge.
+    """
+    limit = int(video_quality)
+    videos = [f for f in formats if has_video(f) and f.get("height")]
+    videos = [f for f in videos if f["height"] <= limit]
+    if not videos:
+        return None
+    height = max(f["height"] for f in videos)
+    candidates = [f for f in videos if f["height"] == height]
+    combined = [f for f in candidates if has_audio(f)]
+    if combined:
+        return [min(combined, key=lambda f: format_cost(f, duration))]
+    audio = pick_audio_format(formats, duration=duration)
+    if audio is None:
+        return None
+    video = min(candidates, key=lambda f: format_cost(f, duration))
+    return [video, audio]
+
+
+def build_format_plan(selected, duration=None):
+    """Summarizes the selected formats into a plan used by the download stage."""
+    sizes = [estimate_format_size(f, duration) for f in selected]
+    video = next((f for f in selected if has_video(f)), {})
+    audio = next((f for f in selected if has_audio(f)), {})
+    return {
+        "format_id": "+".join(f["format_id"] for f in selected),
+        "vcodec": video.get("vcodec", "none"),
+        "acodec": audio.get("acodec", "none"),
+        "ext": selected[0].get("ext"),
+        "filesize": sum(sizes) if None not in sizes else None,
+        "merge": len(selected) > 1,
+    }
+
+
+def plan_entry_format(
+    entry, download_type, video_quality, audio_quality=None, outputs=None
+):
+    """Resolves the concrete format ids of an entry from its extracted formats."""
+    formats = [f for f in entry.get("formats") or [] if f.get("format_id")]
+    if not formats:
+        return None
+    duration = entry.get("duration")
+    if download_type == "audio":
+        audio = pick_audio_format(formats, audio_quality, duration)
+        selected = [audio] if audio else None
+    elif download_type in ["video", "both"] and video_quality:
+        selected = pick_video_formats(formats, video_quality, duration)
+    else:
+        return None
+    if not selected:
+        return None
+    plan = build_format_plan(selected, duration)
+    plan["postprocessors"] = get_postprocessors(
+        download_type, audio_quality, plan, outputs
+    )
+    postprocessor_args = get_postprocessor_args(download_type, audio_quality, plan)
+    if postprocessor_args:
+        plan["postprocessor_args"] = postprocessor_args
+    return plan
+
+
+def plan_formats(
+    entries, download_type, video_quality, audio_quality=None, outputs=None
+):
+    """Plans the formats of every entry in one pass over the extracted info.
+
+    Planned entries get a `format_plan` key and are downloaded from their cached
+    info; entries that cannot be planned keep the yt-dlp format selector.
+    """
+    planned = 0
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        plan = plan_entry_format(
+            entry, download_type, video_quality, audio_quality, outputs
+        )
+        if plan:
+            entry["format_plan"] = plan
+            planned += 1
+    return planned
+
+
+def apply_format_plan(ydl_opts, plan):
+    """Returns a copy of the options that downloads the planned formats."""
+    ydl_opts = dict(ydl_opts)
+    ydl_opts["format"] = plan["format_id"]
+    ydl_opts["postprocessors"] = plan["postprocessors"]
+    if plan.get("postprocessor_args"):
+        ydl_opts["postprocessor_args"] = plan["postprocessor_args"]
+    return ydl_opts
+
+
+ENTRY_RECORD_KEYS = {
+    "id": "id",
+    "url": "url",
+    "webpage_url": "url",
+    "title": "title",
+    "duration": "duration",
+    "filesize_approx": "size",
+}
+
+
+class EntryRecord:
+    """Compact playlist entry kept in memory for the whole run.
+
+    Info dicts are reduced to a record right after extraction and the full info
+    is fetched again by the worker that downloads the entry, so memory follows
+    the concurrency instead of the playlist length. Records answer the read-only
+    dict lookups (`entry["title"]`, `entry.get("id")`) of the download stages.
+    """
+
+    __slots__ = ("id", "url", "title", "duration", "size")
+
+    def __init__(self, id, url, title, duration=None, size=None):
+        self.id = id
+        self.url = url
+        self.title = title
+        self.duration = duration
+        self.size = size
+
+    @classmethod
+    def from_info(cls, info):
+        return cls(
+            info.get("id"),
+            info.get("webpage_url") or info.get("url"),
+            info.get("title") or info.get("id"),
+            info.get("duration"),
+            info.get("filesize") or info.get("filesize_approx"),
+        )
+
+    def get(self, key, default=None):
+        slot = ENTRY_RECORD_KEYS.get(key)
+        value = getattr(self, slot) if slot else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def as_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+def compact_entries(entries):
+    """Reduces extracted playlist entries to compact records."""
+    return [
+        EntryRecord.from_info(entry)
+        for entry in entries
+        if isinstance(entry, dict) and (entry.get("webpage_url") or entry.get("url"))
+    ]
+
+
+async def download_entry(entry, ydl_opts):
     """Downloads a single entry (video/audio)."""
     if not is_valid_entry(entry):
-        print(Fore.YELLOW + "Invalid entry detected. Skipping.")
-        return
+        notify(Fore.YELLOW, "Invalid entry detected. Skipping.")
+        return None
     sanitized_title = sanitize_filename(entry["title"])
     unique_id = entry.get("id", str(uuid4()))
     output_template = update_output_template(sanitized_title, unique_id)
+    ydl_opts = dict(ydl_opts)
+    planner = ydl_opts.pop("output_planner", None)
+    if planner is not None:
+        stem = planner.assign(unique_id, sanitized_title, entry["webpage_url"], entry)
+        if stem is None:
+            notify(Fore.YELLOW, f"Skipping duplicate entry: {entry['title']}")
+            return entry_result(entry)
+        extensions = get_output_extensions(ydl_opts, entry.get("format_plan"))
+        existing = planner.existing(stem, extensions)
+        if existing and path.isfile(existing):
+            notify(Fore.GREEN, f"Already downloaded: {existing}")
+            return entry_result(entry, existing)
+        ydl_opts["continuedl"] = planner.has_partial(stem)
+        output_template = f"{stem}.%(ext)s"
     ydl_opts["outtmpl"] = output_template
-    progress = create_progress_bar(sanitized_title)
-    ydl_opts["progress_hooks"] = [lambda d: progress_hook(d, progress)]
-    await perform_download(entry["webpage_url"], ydl_opts, progress, lock)
+    events = ydl_opts.pop("events", None)
+    if events is None:
+        progress = create_progress_bar(sanitized_title)
+        counter = progress_board.track(progress)
+    else:
+        progress = EventProgress(events, entry)
+        counter = progress.counter = progress_board.track(progress)
+    hook = tracer.hook("progress_hook", lambda d: progress_hook(d, counter))
+    ydl_opts["progress_hooks"] = [hook]
+    if tracer.enabled:
+        ydl_opts["postprocessor_hooks"] = [tracer.postprocessor_hook]
+    plan = entry.get("format_plan")
+    if plan:
+        ydl_opts = apply_format_plan(ydl_opts, plan)
+        result = await perform_download(
+            entry["webpage_url"], ydl_opts, progress, info=entry
+        )
+    else:
+        result = await perform_download(entry["webpage_url"], ydl_opts, progress)
+    if planner is not None:
+        if result is not None:
+            planner.add(get_result_file(result))
+        planner.release(stem)
+    return result
 
 
 def is_valid_entry(entry):
-    return "webpage_url" in entry and "title" in entry
+    return (
+        isinstance(entry, (dict, EntryRecord))
+        and "webpage_url" in entry
+        and "title" in entry
+    )
 
 
 def update_output_template(sanitized_title, unique_id):
@@ -277,6 +1049,183 @@ def update_output_template(sanitized_title, unique_id):
     return f"{unique_id}_{sanitized_title}.%(ext)s"
 
 
+def get_result_file(result):
+    """Returns the path of the file a download result was saved to, if any."""
+    downloads = result.get("requested_downloads") or [{}]
+    return downloads[-1].get("filepath") or result.get("filepath")
+
+
+def entry_result(entry, filepath=None):
+    """Builds the result of an entry that did not need a download."""
+    result = entry.as_dict() if isinstance(entry, EntryRecord) else dict(entry)
+    if filepath:
+        result["requested_downloads"] = [{"filepath": filepath}]
+    return result
+
+
+OUTPUT_SHARDS = 256
+
+
+def get_output_shard(key):
+    """Names the shard subdirectory of an entry."""
+    return f"{crc32(key.encode()) % OUTPUT_SHARDS:02x}"
+
+
+def is_shard_name(name):
+    return len(name) == 2 and all(c in "0123456789abcdef" for c in name)
+
+
+class OutputPlanner:
+    """Assigns output names from a single index of the output directory.
+
+    The directory and its shard subdirectories are listed once; whether an
+    entry is already downloaded or has partial files is then answered from
+    memory instead of yt-dlp stat'ing candidate paths. Names are reserved as
+    they are handed out, so no two entries of a run write to the same file.
+    With `shard`, new files go to one of OUTPUT_SHARDS subdirectories picked
+    from the entry id.
+    """
+
+    def __init__(self, directory, shard=False):
+        self.directory = directory
+        self.shard = shard
+        self.names = []
+        self.reserved = {}
+
+    def index(self):
+        """Lists the directory and returns how many files it holds."""
+        names = []
+        self.list_names(self.directory, "", names)
+        names.sort()
+        self.names = names
+        return len(names)
+
+    def list_names(self, directory, prefix, names):
+        try:
+            entries = scandir(directory)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    names.append(prefix + entry.name)
+                elif not prefix and is_shard_name(entry.name):
+                    self.list_names(entry.path, entry.name + "/", names)
+
+    def matches(self, stem):
+        """Yields the indexed names made of `stem` and one or more extensions."""
+        prefix = stem + "."
+        for index in range(bisect_left(self.names, prefix), len(self.names)):
+            if not self.names[index].startswith(prefix):
+                return
+            yield self.names[index]
+
+    def existing(self, stem, extensions):
+        """Returns the path of a finished output named `stem`, if there is one.
+
+        Only files with one of `extensions` count, so the other download types,
+        derived outputs and sidecars saved under the same name are not taken
+        for it. Outputs saved before sharding was turned on are found too.
+        """
+        for candidate in dict.fromkeys((stem, stem.rpartition("/")[2])):
+            for name in self.matches(candidate):
+                if name[len(candidate) + 1 :] in extensions:
+                    return path.join(self.directory, name)
+        return None
+
+    def has_partial(self, stem):
+        return any(is_partial_file(name) for name in self.matches(stem))
+
+    def assign(self, key, title, url, owner=None):
+        """Reserves the output stem of an entry for `owner`.
+
+        The owner gets its stem back when it asks again. A different entry
+        with the same name gets a numbered stem; returns None when another
+        owner holds the same URL, i.e. for duplicate entries.
+        """
+        base = f"{key}_{title}"
+        if self.shard:
+            base = f"{get_output_shard(key)}/{base}"
+        stem, count = base, 1
+        while stem in self.reserved:
+            holder_url, holder = self.reserved[stem]
+            if owner is not None and holder is owner:
+                return stem
+            if holder_url == url:
+                return None
+            count += 1
+            stem = f"{base}_{count}"
+        self.reserved[stem] = (url, owner)
+        return stem
+
+    def release(self, stem):
+        """Frees the stem of an entry once its download ended."""
+        self.reserved.pop(stem, None)
+
+    def add(self, filepath):
+        """Indexes a file saved after the directory was listed."""
+        if not filepath:
+            return
+        name = path.relpath(filepath, self.directory).replace(path.sep, "/")
+        if name.startswith(".."):
+            return
+        index = bisect_left(self.names, name)
+        if index == len(self.names) or self.names[index] != name:
+            self.names.insert(index, name)
+
+
+def create_output_planner(ydl_opts, shard=False):
+    """Creates the planner of the output directory, or None when nothing is saved."""
+    home = (ydl_opts.get("paths") or {}).get("home")
+    if not home or "sink" in ydl_opts:
+        return None
+    return OutputPlanner(home, shard)
+
+
+def get_output_extensions(ydl_opts, plan=None):
+    """Lists the extensions the final file of a download has with these options.
+
+    Empty when the options leave it to the format yt-dlp picks; such entries
+    are checked by yt-dlp itself.
+    """
+    for pp in ydl_opts.get("postprocessors") or []:
+        if pp["key"] == "FFmpegExtractAudio":
+            return (pp["preferredcodec"],)
+        if pp["key"] in ("FFmpegVideoRemuxer", "FFmpegVideoConvertor"):
+            return (pp["preferedformat"],)
+    if plan and not plan.get("merge"):
+        return (plan["ext"],) if plan.get("ext") else ()
+    merge_format = ydl_opts.get("merge_output_format")
+    return (merge_format,) if merge_format else ()
+
+
+async def index_outputs(planner):
+    """Indexes the planner's directory without blocking the event loop."""
+    with tracer.async_span("index_outputs", id(planner), directory=planner.directory):
+        await get_running_loop().run_in_executor(context_executor(), planner.index)
+    return planner
+
+
+async def get_output_planner(planners, ydl_opts, shard, refresh=False):
+    """Indexes each output directory once for all the runs that write to it.
+
+    `planners` caches the indexing tasks by directory and planner settings.
+    With `refresh`, a directory indexed before is listed again, so files that
+    other programs added or removed since are seen; the planner and the names
+    it reserved stay shared, and runs refreshing at once share one listing.
+    """
+    planner = create_output_planner(ydl_opts, shard)
+    if planner is None:
+        return None
+    key = (planner.directory, planner.shard)
+    task = planners.get(key)
+    if task is None:
+        planners[key] = create_task(index_outputs(planner))
+    elif refresh and task.done():
+        planners[key] = create_task(index_outputs(task.result()))
+    return await planners[key]
+
+
 def create_progress_bar(title):
     """Creates a progress bar for the download."""
     return tqdm(
@@ -288,22 +1237,88 @@ def create_progress_bar(title):
     )
 
 
-def progress_hook(d, progress):
-    """Updates the progress bar based on yt-dlp's progress hooks."""
+class ProgressCounter:
+    """Byte counters of one download, written from yt-dlp's download thread."""
+
+    __slots__ = ("downloaded", "total", "finished")
+
+    def __init__(self):
+        self.downloaded = 0
+        self.total = 0
+        self.finished = False
+
+
+def progress_hook(d, counter):
+    """Stores yt-dlp's progress in the counter; rendering happens on the event loop."""
     if d["status"] == "downloading":
-        update_progress_bar(d, progress)
+        counter.downloaded = d.get("downloaded_bytes") or 0
+        counter.total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+        counter.finished = False
     elif d["status"] == "finished":
-        complete_progress_bar(progress)
-        d["filename"] = d.get("filename")
+        counter.finished = True
 
 
-def update_progress_bar(d, progress):
-    """Calculates and updates the progress bar percentage."""
-    total_bytes = d.get("total_bytes") or d.get("total_bytes_estimate") or 1
-    downloaded_bytes = d.get("downloaded_bytes", 0)
-    percentage = downloaded_bytes / total_bytes * 100
-    progress.n = percentage
-    progress.refresh()
+def update_progress_bar(counter, progress):
+    """Calculates the percentage of a counter and refreshes the bar if it changed."""
+    if counter.finished:
+        percentage = 100
+    else:
+        percentage = counter.downloaded / (counter.total or 1) * 100
+    if percentage != progress.n:
+        progress.n = percentage
+        progress.refresh()
+
+
+class ProgressBoard:
+    """Renders the progress of every running download at a fixed rate.
+
+    Hooks only update counters from the download threads; the board turns them
+    into tqdm updates from a single task on the event loop, which stops once no
+    download is tracked anymore.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self.bars = {}
+        self.task = None
+
+    def track(self, progress):
+        """Starts rendering a progress bar and returns the counter that feeds it."""
+        counter = ProgressCounter()
+        self.bars[id(progress)] = (progress, counter)
+        if (
+            self.task is None
+            or self.task.done()
+            or self.task.get_loop() is not get_running_loop()
+        ):
+            self.task = create_task(self.run())
+        return counter
+
+    def render(self):
+        for progress, counter in list(self.bars.values()):
+            update_progress_bar(counter, progress)
+
+    async def run(self):
+        while self.bars:
+            await sleep(self.interval)
+            self.render()
+
+    def complete(self, progress):
+        """Marks a download as finished before its last progress update arrives."""
+        _, counter = self.bars.get(id(progress), (None, None))
+        if counter is not None:
+            counter.finished = True
+
+    def finish(self, progress):
+        """Stops rendering a progress bar and closes it."""
+        _, counter = self.bars.pop(id(progress), (None, None))
+        if counter is not None and counter.finished:
+            complete_progress_bar(progress)
+        else:
+            progress.close()
+
+
+progress_board = ProgressBoard()
 
 
 def complete_progress_bar(progress):
@@ -313,53 +1328,1899 @@ def complete_progress_bar(progress):
     progress.close()
 
 
-async def perform_download(url, ydl_opts, progress, lock):
-    loop = get_event_loop()
-    try:
-        with YoutubeDL(ydl_opts) as ydl:
-            func = partial(ydl.extract_info, url, download=True)
-            async with lock:
-                info = await loop.run_in_executor(None, func)
-            output_file = ydl.prepare_filename(info)
-            print(Fore.GREEN + f"\nCompleted: {output_file}")
-    except CancelledError:
-        print(Fore.YELLOW + f"Download cancelled: {ydl_opts['outtmpl']}")
-    except Exception as e:
-        print(Fore.RED + f"Error downloading: {e}")
-    finally:
-        progress.close()
+SEGMENT_COUNT = 4
+SEGMENT_MIN_SIZE = 4 * 1024 * 1024
+SEGMENT_READ_SIZE = 64 * 1024
+SEGMENT_SAVE_INTERVAL = 1.0
 
 
-async def process_entries(entries, ydl_opts, max_concurrent, shutdown_event):
-    """Processes multiple entries (e.g., a playlist)."""
-    if not entries:
-        print(Fore.YELLOW + "No entries found to download.")
-        return
-    lock = Lock()
-    tasks = create_download_tasks(
-        entries, ydl_opts, max_concurrent, shutdown_event, lock
-    )
-    await gather(*tasks, return_exceptions=True)
+def plan_segments(size, count, min_size):
+    """Splits `size` bytes into at most `count` inclusive byte ranges.
 
+    Each range is at least `min_size` bytes, so small files get a single range.
+    """
+    if not size or size <= 0:
+        return []
+    count = max(1, min(count, size // min_size))
+    step = -(-size // count)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
 
-def create_download_tasks(entries, ydl_opts, max_concurrent, shutdown_event, lock):
-    """Creates asynchronous tasks for downloading entries."""
-    semaphore = Semaphore(max_concurrent)
-    tasks = []
+
+def parse_content_range(header):
+    """Returns the total size from a `bytes start-end/total` header, if known."""
+    total = (header or "").rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+class SegmentedHttpFD(HttpFD):
+    """Fetches large progressive files as parallel byte ranges.
+
+    The temporary file is preallocated and every range is written at its own
+    offset, so ranges can complete in any order. How far each range got is kept
+    in the `.ytdl` file next to the download, and an interrupted download
+    resumes its ranges from there when `continuedl` is set. Servers without
+    range support, files of unknown size, files below `SEGMENT_MIN_SIZE` and
+    partial files left by a single-connection download fall back to yt-dlp's
+    single-connection download.
+    """
+
+    def real_download(self, filename, info_dict):
+        size = self.probe_size(info_dict)
+        segments = plan_segments(
+            size, self.params.get("segments", SEGMENT_COUNT), SEGMENT_MIN_SIZE
+        )
+        if len(segments) < 2 or filename == "-":
+            return super().real_download(filename, info_dict)
+
+        tmpfilename = self.temp_name(filename)
+        ranges_file = self.ytdl_filename(filename)
+        ranges = None
+        if self.params.get("continuedl", True) and path.isfile(tmpfilename):
+            if not path.isfile(ranges_file):
+                return super().real_download(filename, info_dict)
+            ranges = read_segment_ranges(ranges_file, size)
+        self.report_destination(filename)
+        if ranges is None:
+            ranges = [[start, end, start] for start, end in segments]
+            with open(tmpfilename, "wb") as f:
+                f.truncate(size)
+            write_segment_ranges(ranges_file, size, ranges)
+
+        lock = ThreadLock()
+        started = time()
+        resumed = sum(offset - start for start, _, offset in ranges)
+        state = {"downloaded": resumed, "saved": started}
+
+        def on_chunk(length):
+            with lock:
+                state["downloaded"] += length
+                now = time()
+                if now - state["saved"] >= SEGMENT_SAVE_INTERVAL:
+                    write_segment_ranges(ranges_file, size, ranges)
+                    state["saved"] = now
+                elapsed = now - started
+                self._hook_progress(
+                    {
+                        "status": "downloading",
+                        "downloaded_bytes": state["downloaded"],
+                        "total_bytes": size,
+                        "tmpfilename": tmpfilename,
+                        "filename": filename,
+                        "elapsed": elapsed,
+                        "speed": (
+                            (state["downloaded"] - resumed) / elapsed
+                            if elapsed
+                            else None
+                        ),
+                    },
+                    info_dict,
+                )
+                downloaded = state["downloaded"] - resumed
+            self.slow_down(started, None, downloaded)
+
+        fetch = partial(self.fetch_segment, info_dict, tmpfilename, on_chunk)
+        pending = [segment for segment in ranges if segment[2] <= segment[1]]
+        try:
+            if pending:
+                with ThreadPoolExecutor(len(pending)) as pool:
+                    list(pool.map(fetch, pending))
+        finally:
+            with lock:
+                write_segment_ranges(ranges_file, size, ranges)
+
+        if path.getsize(tmpfilename) != size or state["downloaded"] != size:
+            raise ContentTooShortError(state["downloaded"], size)
+        self.try_rename(tmpfilename, filename)
+        self.try_remove(ranges_file)
+        self._hook_progress(
+            {
+                "status": "finished",
+                "downloaded_bytes": size,
+                "total_bytes": size,
+                "filename": filename,
+                "elapsed": time() - started,
+            },
+            info_dict,
+        )
+        return True
+
+    def open_range(self, info_dict, start, end):
+        headers = dict(info_dict.get("http_headers") or {})
+        headers["Range"] = f"bytes={start}-{end}"
+        return self.ydl.urlopen(Request(info_dict["url"], headers=headers))
+
+    def probe_size(self, info_dict):
+        """Returns the file size if the server honours range requests."""
+        try:
+            with self.open_range(info_dict, 0, 0) as response:
+                if response.status != 206:
+                    return None
+                return parse_content_range(response.headers.get("Content-Range"))
+        except RequestError:
+            return None
+
+    def fetch_segment(self, info_dict, tmpfilename, on_chunk, segment):
+        """Writes one byte range at its offset, resuming it on transport errors.
+
+        `segment` is a `[start, end, offset]` list whose offset advances as the
+        bytes are written, so the saved ranges never claim unwritten bytes.
+        """
+        first, end, start = segment
+        retries = self.params.get("retries", 10)
+        for attempt in range(retries + 1):
+            try:
+                with self.open_range(info_dict, start, end) as response, open(
+                    tmpfilename, "r+b"
+                ) as f:
+                    if response.status != 206:
+                        raise ContentTooShortError(0, end - start + 1)
+                    f.seek(start)
+                    while start <= end:
+                        chunk = response.read(min(SEGMENT_READ_SIZE, end - start + 1))
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                        start += len(chunk)
+                        segment[2] = start
+                        on_chunk(len(chunk))
+                if start > end:
+                    return
+            except TransportError as e:
+                if attempt == retries:
+                    raise
+                self.report_retry(e, attempt + 1, retries)
+        raise ContentTooShortError(start - first, end - first + 1)
+
+
+def read_segment_ranges(ranges_file, size):
+    """Reads the saved ranges of a segmented download, or None if they do not apply."""
+    try:
+        with open(ranges_file) as handle:
+            state = load(handle)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get("size") != size:
+        return None
+    return state.get("ranges")
+
+
+def write_segment_ranges(ranges_file, size, ranges):
+    """Saves how far each range of a segmented download got."""
+    with open(f"{ranges_file}.tmp", "w") as handle:
+        dump({"size": size, "ranges": ranges}, handle)
+    replace(f"{ranges_file}.tmp", ranges_file)
+
+
+def kernel_copy(source_fd, target_fd, count):
+    """Copies up to `count` bytes between files without passing them through Python.
+
+    Uses copy_file_range, then sendfile, and returns how many bytes were copied;
+    the caller copies the rest when neither works for these files (for example
+    an output opened for appending).
+    """
+    copied = 0
+    for copy in (copy_file_range, sendfile):
+        if copy is None:
+            continue
+        try:
+            while copied < count:
+                if copy is copy_file_range:
+                    written = copy(source_fd, target_fd, count - copied, copied)
+                else:
+                    written = copy(target_fd, source_fd, copied, count - copied)
+                if not written:
+                    break
+                copied += written
+        except OSError:
+            continue
+        break
+    return copied
+
+
+def append_file(source, target):
+    """Appends the file at `source` to the open binary file `target`."""
+    target.flush()
+    with open(source, "rb") as handle:
+        size = fstat(handle.fileno()).st_size
+        copied = kernel_copy(handle.fileno(), target.fileno(), size)
+        if copied < size:
+            handle.seek(copied)
+            target.seek(0, 2)
+            copyfileobj(handle, target)
+    target.seek(0, 2)
+
+
+class FragmentFile:
+    """A downloaded fragment that stays on disk until it is appended."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __bool__(self):
+        return path.getsize(self.filename) > 0
+
+    def read(self):
+        with open(self.filename, "rb") as handle:
+            return handle.read()
+
+
+class KernelAppendMixin:
+    """Appends fragment files to the output with kernel-side copies.
+
+    yt-dlp reads every fragment file into memory and writes it out again. Here
+    the fragment stays a file until `append_file` copies it, so its bytes never
+    pass through Python buffers. Encrypted fragments are still read and
+    decrypted by yt-dlp.
+    """
+
+    def _read_fragment(self, ctx):
+        filename = ctx.get("fragment_filename_sanitized")
+        if not filename or not path.isfile(filename):
+            return super()._read_fragment(ctx)
+        return FragmentFile(filename)
+
+    def decrypter(self, info_dict):
+        decrypt = super().decrypter(info_dict)
+
+        def decrypt_fragment(fragment, frag_content):
+            decrypt_info = fragment.get("decrypt_info") or {}
+            if (
+                isinstance(frag_content, FragmentFile)
+                and decrypt_info.get("METHOD") == "AES-128"
+            ):
+                frag_content = frag_content.read()
+            return decrypt(fragment, frag_content)
+
+        return decrypt_fragment
+
+    def _append_fragment(self, ctx, frag_content):
+        if isinstance(frag_content, FragmentFile):
+            append_file(frag_content.filename, ctx["dest_stream"])
+            frag_content = b""
+        super()._append_fragment(ctx, frag_content)
+
+
+class KernelHlsFD(KernelAppendMixin, HlsFD):
+    pass
+
+
+class KernelDashSegmentsFD(KernelAppendMixin, DashSegmentsFD):
+    pass
+
+
+DOWNLOADERS = {
+    HttpFD: SegmentedHttpFD,
+    HlsFD: KernelHlsFD,
+    DashSegmentsFD: KernelDashSegmentsFD,
+}
+
+
+download_abort = ThreadEvent()
+
+
+def check_download_abort(d):
+    """Progress hook that stops a download once shutdown is forced.
+
+    The partial files stay, so the download resumes on the next run.
+    """
+    if download_abort.is_set():
+        raise DownloadCancelled("Download stopped by shutdown")
+
+
+class SegmentedYoutubeDL(YoutubeDL):
+    """YoutubeDL that swaps in the downloaders of `DOWNLOADERS`.
+
+    Plain HTTP downloads go to `SegmentedHttpFD`, and HLS and DASH fragments
+    are joined with kernel-side copies. Downloads are paced by `bandwidth` and
+    stop at their next progress update once `download_abort` is set.
+    """
+
+    def __init__(self, params=None, auto_init=True):
+        super().__init__(params, auto_init)
+        self.add_progress_hook(check_download_abort)
+        self.add_progress_hook(BandwidthHook())
+
+    def dl(self, name, info, subtitle=False, test=False):
+        downloader = get_suitable_downloader(info, self.params, to_stdout=name == "-")
+        if test or subtitle or name == "-" or downloader not in DOWNLOADERS:
+            return super().dl(name, info, subtitle, test)
+        fd = DOWNLOADERS[downloader](self, self.params)
+        for hook in self._progress_hooks:
+            fd.add_progress_hook(hook)
+        info = self._copy_infodict(info)
+        if info.get("http_headers") is None:
+            info["http_headers"] = self._calc_headers(info)
+        return fd.download(name, info, subtitle)
+
+
+async def perform_download(url, ydl_opts, progress, info=None):
+    """Downloads a URL, reusing already-extracted `info` when it is provided.
+
+    Without `info`, the full info is fetched here and its formats are planned
+    before the download starts. With a "disk_admission" option, the disk space
+    is reserved once the full info tells the size. Returns the final info dict,
+    or None when the download did not complete.
+    """
+    loop = get_event_loop()
+    ydl_opts = dict(ydl_opts)
+    admission = ydl_opts.pop("disk_admission", None)
+    reserved = 0
+    try:
+        plan = None
+        if info is None and ydl_opts.get("format_planning"):
+            with tracer.async_span("extract_entry_info", id(progress), url=url):
+                info = await extract_entry_info(url, ydl_opts)
+            if not info:
+                notify(Fore.RED, f"Error downloading: {url}")
+                return None
+            plan = plan_entry_format(info, **ydl_opts["format_planning"])
+            if plan:
+                ydl_opts = apply_format_plan(ydl_opts, plan)
+        if admission is not None and info:
+            size = estimate_download_size(info, plan)
+            if size and not await admission.reserve(size):
+                notify(
+                    Fore.YELLOW, f"Not enough disk space for: {info.get('title', url)}"
+                )
+                return None
+            reserved = size
+        ydl_opts, local_postprocessors = split_local_postprocessors(ydl_opts)
+        if "sink" in ydl_opts and local_postprocessors:
+            notify(Fore.YELLOW, "Derived outputs are skipped when streaming to a sink.")
+            local_postprocessors = []
+        if info is None:
+            await rate_shaper.acquire(url)
+        with tracer.async_span("perform_download", id(progress), url=url):
+            if download_processes.enabled and "sink" not in ydl_opts:
+                info, output_file = await download_processes.run(
+                    run_download, url, ydl_opts, info, progress_key=id(progress)
+                )
+                if info:
+                    progress_board.complete(progress)
+            elif transfer_engine.enabled and "sink" not in ydl_opts:
+                info, output_file = await transfer_engine.download(url, ydl_opts, info)
+            else:
+                func = partial(run_download, url, ydl_opts, info)
+                func = tracer.traced("yt-dlp.download", func)
+                info, output_file = await loop.run_in_executor(context_executor(), func)
+        if not info:
+            notify(Fore.RED, f"Error downloading: {url}")
+            cleanup_failed_download(ydl_opts)
+            return None
+        notify(Fore.GREEN, f"\nCompleted: {output_file}")
+        with tracer.async_span("derive_outputs", id(progress)):
+            await run_local_postprocessors(local_postprocessors, output_file)
+        return info
+    except (CancelledError, DownloadCancelled):
+        notify(Fore.YELLOW, f"Download cancelled: {ydl_opts['outtmpl']}")
+    except Exception as e:
+        notify(Fore.RED, f"Error downloading: {e}")
+        cleanup_failed_download(ydl_opts)
+    finally:
+        progress_board.finish(progress)
+        if reserved:
+            await admission.release(reserved)
+    return None
+
+
+class RateShaper:
+    """Paces metadata extraction per host with token buckets.
+
+    Every extraction takes a token from the bucket of its host; buckets refill
+    at `rate` tokens per second up to `burst`. Tokens are reserved in arrival
+    order, so callers wait their turn instead of retrying, and the time spent
+    waiting is kept per host in `metrics` and traced as a counter. Media
+    transfers are not paced here; they follow the download rate limit.
+    """
+
+    def __init__(self, rate=METADATA_RATE, burst=METADATA_BURST, limits=None):
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits or {}
+        self.buckets = {}
+        self.metrics = {}
+
+    def configure(self, rate, burst, limits=None):
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits or {}
+        self.buckets.clear()
+
+    @staticmethod
+    def key(url):
+        host = urlparse(url).hostname or ""
+        return host[4:] if host.startswith("www.") else host
+
+    def reserve(self, key, now):
+        """Takes a token from the bucket of `key` and returns how long to wait for it."""
+        rate, burst = self.limits.get(key, (self.rate, self.burst))
+        if not rate:
+            return 0
+        tokens, updated = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate) - 1
+        self.buckets[key] = (tokens, now)
+        return -tokens / rate if tokens < 0 else 0
+
+    async def acquire(self, url):
+        """Waits until an extraction of `url` may start."""
+        key = self.key(url)
+        delay = self.reserve(key, perf_counter())
+        metrics = self.metrics.setdefault(
+            key, {"requests": 0, "delayed": 0, "delay_total": 0.0, "delay_max": 0.0}
+        )
+        metrics["requests"] += 1
+        if delay:
+            metrics["delayed"] += 1
+            metrics["delay_total"] += delay
+            metrics["delay_max"] = max(metrics["delay_max"], delay)
+            with tracer.async_span("rate_wait", id(metrics), host=key):
+                await sleep(delay)
+        if tracer.enabled:
+            tracer.counter("metadata_queue_delay", **{key: round(delay * 1000, 2)})
+
+    def report(self):
+        """Reports the queueing delay of every host whose extractions were paced."""
+        for key, metrics in self.metrics.items():
+            if metrics["delayed"]:
+                notify(
+                    Fore.CYAN,
+                    f"Paced {key}: {metrics['delayed']} of "
+                    f"{metrics['requests']} extractions waited "
+                    f"{metrics['delay_total']:.1f}s (max {metrics['delay_max']:.1f}s).",
+                )
+
+
+rate_shaper = RateShaper()
+
+
+class BandwidthLimiter:
+    """Token bucket for the bytes of all the downloads of this process.
+
+    Like the rate shaper, downloads reserve their bytes and then wait for them,
+    so the aggregate rate holds however many downloads run. In a worker
+    process, `shared` holds the share of the main process's rate that this
+    worker may use, and follows its changes.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.shared = None
+        self.tokens = 0
+        self.updated = None
+        self.lock = ThreadLock()
+
+    def configure(self, rate):
+        with self.lock:
+            self.rate = rate
+            self.updated = None
+
+    def reserve(self, size):
+        """Takes `size` bytes from the bucket and returns how long to wait for them."""
+        rate = self.shared.value if self.shared is not None else self.rate
+        if not rate:
+            return 0
+        burst = rate * BANDWIDTH_BURST
+        with self.lock:
+            now = perf_counter()
+            if self.updated is None:
+                self.tokens, self.updated = burst, now
+            tokens = min(burst, self.tokens + (now - self.updated) * rate) - size
+            self.tokens, self.updated = tokens, now
+        return -tokens / rate if tokens < 0 else 0
+
+    def throttle(self, size):
+        """Blocks the calling download thread until its bytes fit the rate."""
+        delay = self.reserve(size)
+        if delay:
+            sleep_thread(delay)
+
+    async def pace(self, size):
+        delay = self.reserve(size)
+        if delay:
+            await sleep(delay)
+
+
+bandwidth = BandwidthLimiter()
+
+
+class BandwidthHook:
+    """yt-dlp progress hook that paces the downloads of a YoutubeDL with `bandwidth`."""
+
+    __slots__ = ("downloaded",)
+
+    def __init__(self):
+        self.downloaded = {}
+
+    def __call__(self, d):
+        if d["status"] != "downloading":
+            return
+        key = d.get("tmpfilename") or d.get("filename")
+        downloaded = d.get("downloaded_bytes") or 0
+        size = downloaded - self.downloaded.get(key, 0)
+        self.downloaded[key] = downloaded
+        if size > 0:
+            bandwidth.throttle(size)
+
+
+def parse_clock(text):
+    """Parses a local HH:MM time into minutes since midnight."""
+    hours, _, minutes = text.partition(":")
+    if not (hours.isdigit() and minutes.isdigit()):
+        raise ValueError
+    if int(hours) > 23 or int(minutes) > 59:
+        raise ValueError
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_schedule(spec):
+    """Parses schedule windows written as START-END=RATE[/CONCURRENCY].
+
+    Windows are separated by commas. START and END are local HH:MM times and a
+    window may wrap past midnight. RATE is an aggregate limit such as 500K or
+    2M, or "none". Returns (start, end, rate, concurrency) tuples in minutes
+    since midnight, bytes per second and downloads.
+    """
+    windows = []
+    for window in spec.split(","):
+        try:
+            times, _, limits = window.strip().partition("=")
+            start, end = map(parse_clock, times.split("-"))
+            rate_text, _, concurrency = limits.partition("/")
+            rate = None
+            if rate_text.lower() != "none":
+                rate = parse_rate_limit(rate_text) if rate_text else None
+                if rate is None:
+                    raise ValueError
+            concurrency = int(concurrency) if concurrency else None
+            if start == end or (concurrency is not None and concurrency < 1):
+                raise ValueError
+        except ValueError:
+            raise ValueError(
+                f"Invalid schedule window: {window.strip()!r} "
+                "(expected START-END=RATE[/CONCURRENCY], e.g. 08:00-18:00=1M/2)"
+            ) from None
+        windows.append((start, end, rate, concurrency))
+    return windows
+
+
+class DownloadSlots:
+    """Semaphore for download slots whose number can change while in use.
+
+    Lowering the limit lets the downloads holding slots finish; waiting ones
+    start once fewer than `limit` run. `base` keeps the limit the slots were
+    created with. Waiters are woken in arrival order, only as many as there
+    are free slots, so a long playlist is not woken on every release.
+    """
+
+    def __init__(self, limit):
+        self.base = limit
+        self.limit = limit
+        self.active = 0
+        self.waiters = deque()
+
+    def locked(self):
+        return self.active >= self.limit
+
+    async def acquire(self):
+        while self.active >= self.limit:
+            waiter = get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            except CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.wake()
+                raise
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+    def resize(self, limit):
+        self.limit = limit
+        self.wake()
+
+    def wake(self):
+        free = self.limit - self.active
+        while free > 0 and self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+def size_executor(downloads):
+    """Gives the default executor a thread for each of `downloads` plus spares.
+
+    yt-dlp downloads hold an executor thread each, so a concurrency above the
+    stdlib default would otherwise queue behind it.
+    """
+    get_running_loop().set_default_executor(
+        ThreadPoolExecutor(downloads + EXECUTOR_SPARE_THREADS)
+    )
+
+
+class Schedule:
+    """Applies time-of-day windows to the aggregate rate and the download slots.
+
+    While a window is active, all downloads together are paced to its rate and
+    the tracked slots are resized to its concurrency; outside every window the
+    slots go back to their base and only the per-download rate limit applies.
+    The windows are checked every SCHEDULE_INTERVAL seconds while slots are in
+    use, so a long run follows them without a restart; queued entries simply
+    wait for a slot.
+    """
+
+    def __init__(self):
+        self.windows = []
+        self.slots = WeakSet()
+        self.active = None
+        self.task = None
+
+    def configure(self, windows):
+        self.windows = windows
+        self.active = None
+
+    def current(self, now=None):
+        """Returns the window active at `now` (a struct_time), if any."""
+        now = now or localtime()
+        minute = now.tm_hour * 60 + now.tm_min
+        for window in self.windows:
+            start, end = window[:2]
+            if start <= minute < end or (end < start and not end <= minute < start):
+                return window
+        return None
+
+    def peak(self, concurrency):
+        """Returns the most downloads any window allows next to `concurrency`."""
+        return max([concurrency] + [w[3] for w in self.windows if w[3]])
+
+    def track(self, slots):
+        """Keeps `slots` sized to the schedule for as long as they are in use."""
+        if not self.windows:
+            return
+        self.slots.add(slots)
+        self.resize(slots, self.active)
+        if self.task is None or self.task.done():
+            self.task = create_task(self.run())
+
+    @staticmethod
+    def resize(slots, window):
+        slots.resize(window[3] if window and window[3] else slots.base)
+
+    def apply(self, now=None):
+        window = self.current(now)
+        if window == self.active:
+            return
+        self.active = window
+        rate = window[2] if window else None
+        bandwidth.configure(rate)
+        download_processes.set_rate(rate)
+        for slots in self.slots:
+            self.resize(slots, window)
+        if window:
+            start, end = (f"{m // 60:02d}:{m % 60:02d}" for m in window[:2])
+            limit = f"{rate // 1024} KiB/s" if rate else "no rate limit"
+            notify(
+                Fore.CYAN,
+                f"Schedule {start}-{end}: {limit}, "
+                f"{window[3] or 'default'} concurrent downloads.",
+            )
+        else:
+            notify(Fore.CYAN, "Schedule: outside every window, using the defaults.")
+
+    async def run(self):
+        while self.slots:
+            self.apply()
+            await sleep(SCHEDULE_INTERVAL)
+
+
+schedule = Schedule()
+
+
+SINK_CHUNK_SIZE = 256 * 1024
+SINK_DIRECT_PROTOCOLS = ("http", "https")
+
+
+class SharedStreamWriter:
+    """Gives one download at a time exclusive use of a shared stream."""
+
+    def __init__(self, stream, lock):
+        lock.acquire()
+        self.stream = stream
+        self.lock = lock
+
+    def write(self, data):
+        self.stream.write(data)
+
+    def close(self):
+        try:
+            self.stream.flush()
+        finally:
+            self.lock.release()
+
+
+class Sink(ABC):
+    """Destination that downloads are streamed to instead of the output directory.
+
+    `open` returns a binary writer for one entry; bytes are written as they
+    arrive and the writer is closed when the entry is complete. Backends for
+    other stores implement `open` and `describe` and register in `SINK_BACKENDS`.
+    """
+
+    @abstractmethod
+    def open(self, info):
+        """Returns the binary writer an entry is streamed to."""
+
+    @abstractmethod
+    def describe(self, info):
+        """Names the destination of an entry in progress messages."""
+
+    def close(self):
+        pass
+
+
+class StreamSink(Sink):
+    """Writes entries one after the other into a single stream."""
+
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+        self.lock = ThreadLock()
+
+    def open(self, info):
+        return SharedStreamWriter(self.stream, self.lock)
+
+    def describe(self, info):
+        return self.name
+
+    def close(self):
+        self.stream.close()
+
+
+class StdoutSink(StreamSink):
+    """Streams media to stdout; console output moves to stderr meanwhile."""
+
+    def __init__(self):
+        stdout.flush()
+        self.saved_fd = dup(1)
+        super().__init__(fdopen(dup(1), "wb"), "<stdout>")
+        dup2(stderr.fileno(), 1)
+
+    def close(self):
+        super().close()
+        stdout.flush()
+        dup2(self.saved_fd, 1)
+        close(self.saved_fd)
+
+
+class FileSink(StreamSink):
+    """Streams media into a file or named pipe, opened on first use."""
+
+    def __init__(self, target):
+        super().__init__(None, target)
+
+    def open(self, info):
+        with self.lock:
+            if self.stream is None:
+                self.stream = open(self.name, "wb")
+        return super().open(info)
+
+    def close(self):
+        if self.stream is not None:
+            super().close()
+
+
+SINK_BACKENDS = {}
+
+
+def open_sink(target):
+    """Opens '-' as stdout, `BACKEND://LOCATION` as a registered sink, or a path."""
+    if target == "-":
+        return StdoutSink()
+    scheme, separator, location = target.partition("://")
+    if not separator:
+        return FileSink(target)
+    backend = SINK_BACKENDS.get(scheme)
+    if backend is None:
+        raise ValueError(f"Unsupported sink backend: {scheme}")
+    return backend(location)
+
+
+def build_sink_command(ffmpeg, formats, postprocessors):
+    """Builds an ffmpeg command that reads the formats and writes one stream to stdout.
+
+    Streams are copied into fragmented mp4 when their codecs allow it and into
+    Matroska otherwise; audio downloads are encoded to mp3 on the way.
+    """
+    command = [ffmpeg, "-hide_banner", "-loglevel", "error"]
+    for fmt in formats:
+        headers = fmt.get("http_headers") or {}
+        if headers:
+            lines = "".join(f"{key}: {value}\r\n" for key, value in headers.items())
+            command += ["-headers", lines]
+        command += ["-i", fmt["url"]]
+    for index in range(len(formats)):
+        command += ["-map", str(index)]
+    extract = next(
+        (pp for pp in postprocessors if pp["key"] == "FFmpegExtractAudio"), None
+    )
+    if extract:
+        quality = extract.get("preferredquality") or "192"
+        command += ["-vn", "-c:a", "libmp3lame", "-b:a", f"{quality}k", "-f", "mp3"]
+    elif all(is_mp4_compatible(f.get("vcodec"), f.get("acodec")) for f in formats):
+        command += ["-c", "copy", "-f", "mp4", "-movflags", "frag_keyframe+empty_moov"]
+    else:
+        command += ["-c", "copy", "-f", "matroska"]
+    return command + ["pipe:1"]
+
+
+def report_progress(hooks, info, status, downloaded, total=None, filename="-"):
+    """Calls yt-dlp progress hooks for a transfer that yt-dlp does not run."""
+    for hook in hooks or []:
+        hook(
+            {
+                "status": status,
+                "downloaded_bytes": downloaded,
+                "total_bytes": total,
+                "filename": filename,
+                "info_dict": info,
+            }
+        )
+
+
+def stream_http(ydl, fmt, writer, info):
+    """Copies a progressive format from the server into the writer.
+
+    Stops between chunks once shutdown is forced.
+    """
+    hooks = ydl.params.get("progress_hooks")
+    request = Request(fmt["url"], headers=fmt.get("http_headers") or {})
+    downloaded = 0
+    with ydl.urlopen(request) as response:
+        total = int(response.headers.get("Content-Length") or 0) or None
+        while chunk := response.read(SINK_CHUNK_SIZE):
+            check_download_abort(None)
+            writer.write(chunk)
+            downloaded += len(chunk)
+            report_progress(hooks, info, "downloading", downloaded, total)
+    if total and downloaded != total:
+        raise ContentTooShortError(downloaded, total)
+    return downloaded
+
+
+def stream_ffmpeg(ydl, formats, writer, info):
+    """Remuxes (or encodes) the formats with ffmpeg and copies its output to the writer.
+
+    Kills ffmpeg and stops between chunks once shutdown is forced.
+    """
+    hooks = ydl.params.get("progress_hooks")
+    ffmpeg = which("ffmpeg")
+    if not ffmpeg:
+        raise DownloadError(
+            "ffmpeg not found. Only progressive formats can be streamed."
+        )
+    command = build_sink_command(
+        ffmpeg, formats, ydl.params.get("postprocessors") or []
+    )
+    downloaded = 0
+    with Popen(
+        command, stdin=SUBPROCESS_DEVNULL, stdout=SUBPROCESS_PIPE
+    ) as ffmpeg_process:
+        try:
+            while chunk := ffmpeg_process.stdout.read(SINK_CHUNK_SIZE):
+                check_download_abort(None)
+                writer.write(chunk)
+                downloaded += len(chunk)
+                report_progress(hooks, info, "downloading", downloaded)
+        except DownloadCancelled:
+            ffmpeg_process.kill()
+            raise
+    if ffmpeg_process.returncode:
+        raise DownloadError(f"ffmpeg exited with code {ffmpeg_process.returncode}")
+    return downloaded
+
+
+def stream_to_sink(ydl, info, sink):
+    """Streams the selected formats of `info` into the sink while they download."""
+    hooks = ydl.params.get("progress_hooks")
+    formats = info.get("requested_formats") or [info]
+    if any(f.get("protocol") == "http_dash_segments" for f in formats):
+        raise DownloadError("DASH segment downloads cannot be streamed to a sink.")
+    direct = (
+        len(formats) == 1
+        and formats[0].get("protocol") in SINK_DIRECT_PROTOCOLS
+        and not any(
+            pp["key"] == "FFmpegExtractAudio"
+            for pp in ydl.params.get("postprocessors") or []
+        )
+    )
+    writer = sink.open(info)
+    try:
+        if direct:
+            downloaded = stream_http(ydl, formats[0], writer, info)
+        else:
+            downloaded = stream_ffmpeg(ydl, formats, writer, info)
+    finally:
+        writer.close()
+    report_progress(hooks, info, "finished", downloaded, downloaded)
+
+
+def run_download(url, ydl_opts, info=None):
+    """Runs yt-dlp for one entry and returns its final info and output file.
+
+    Reuses already-extracted `info` when it is provided. With a "sink" option
+    the selected formats are streamed to the sink instead of being saved.
+    """
+    with SegmentedYoutubeDL(ydl_opts) as ydl:
+        sink = ydl_opts.get("sink")
+        if sink is not None:
+            if info is not None:
+                info = ydl.process_ie_result(info, download=False)
+            else:
+                info = ydl.extract_info(url, download=False)
+            if info:
+                stream_to_sink(ydl, info, sink)
+            return info, info and sink.describe(info)
+        if info is not None:
+            info = ydl.process_ie_result(info, download=True)
+        else:
+            info = ydl.extract_info(url, download=True)
+        return info, info and get_output_file(ydl, info)
+
+
+TRANSFER_CHUNK_SIZE = 64 * 1024
+TRANSFER_RETRIES = 3
+TRANSFER_REDIRECTS = 5
+TRANSFER_TIMEOUT = 30
+TRANSFER_PROTOCOLS = ("http", "https", "m3u8_native", "http_dash_segments")
+
+
+class TransferYoutubeDL(SegmentedYoutubeDL):
+    """YoutubeDL that leaves fetching the media files to the transfer engine.
+
+    While `staged` is None, downloads are recorded in `transfers` as the file
+    name yt-dlp picked and the format info it would download from, and report
+    no success, so nothing is merged or postprocessed. Once the engine has
+    fetched them, their names go in `staged` and a second run treats those
+    files as downloaded; anything else is downloaded by yt-dlp as usual.
+    """
+
+    def __init__(self, params=None, auto_init=True):
+        super().__init__(params, auto_init)
+        self.transfers = []
+        self.staged = None
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if test or subtitle or name == "-":
+            return super().dl(name, info, subtitle, test)
+        if self.staged is not None:
+            if name in self.staged and path.isfile(name):
+                return True, True
+            return super().dl(name, info, subtitle, test)
+        info = self._copy_infodict(info)
+        headers = dict(info.get("http_headers") or self._calc_headers(info))
+        cookies = self.cookiejar.get_cookie_header(info["url"])
+        if cookies:
+            headers["Cookie"] = cookies
+        info["http_headers"] = headers
+        self.transfers.append((name, info))
+        return False, False
+
+
+def plan_transfers(url, ydl_opts, info=None):
+    """Lets yt-dlp resolve an entry and name its files without downloading them.
+
+    Returns the YoutubeDL, whose `transfers` list the files to fetch, and the
+    resolved info. The caller closes the YoutubeDL.
+    """
+    ydl = TransferYoutubeDL(ydl_opts)
+    try:
+        if info is not None:
+            return ydl, ydl.process_ie_result(info, download=True)
+        return ydl, ydl.extract_info(url, download=True)
+    except BaseException:
+        ydl.close()
+        raise
+
+
+def finish_transfers(ydl, info, staged):
+    """Lets yt-dlp download what was not staged, then merge and postprocess."""
+    ydl.staged = set(staged)
+    info = ydl.process_ie_result(info, download=True)
+    return info, info and get_output_file(ydl, info)
+
+
+def parse_media_playlist(text, base_url):
+    """Lists the segment URLs of an HLS media playlist.
+
+    Returns None for playlists that only yt-dlp can download: live, encrypted
+    or split into byte ranges.
+    """
+    if "#EXT-X-ENDLIST" not in text:
+        return None
+    urls = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-KEY") and "METHOD=NONE" not in line:
+            return None
+        if line.startswith("#EXT-X-BYTERANGE") or (
+            line.startswith("#EXT-X-MAP") and "BYTERANGE" in line
+        ):
+            return None
+        if line.startswith("#EXT-X-MAP"):
+            uri = line.partition('URI="')[2].partition('"')[0]
+            urls.append(urljoin(base_url, uri))
+        elif line and not line.startswith("#"):
+            urls.append(urljoin(base_url, line))
+    return urls
+
+
+class AsyncHttpResponse:
+    """Body of an HTTP/1.1 response read from a non-blocking connection."""
+
+    def __init__(self, status, headers, reader, writer):
+        self.status = status
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+        self.chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        length = headers.get("content-length")
+        self.length = int(length) if length and not self.chunked else None
+        self.remaining = self.length
+        self.chunk_left = 0
+        self.done = False
+
+    async def read(self, size=TRANSFER_CHUNK_SIZE):
+        """Returns the next part of the body, or b"" at its end."""
+        if self.done:
+            return b""
+        if self.chunked:
+            if not self.chunk_left:
+                line = await wait_for(self.reader.readline(), TRANSFER_TIMEOUT)
+                self.chunk_left = int(line.split(b";")[0] or b"0", 16)
+                if not self.chunk_left:
+                    self.done = True
+                    return b""
+            size = min(size, self.chunk_left)
+        elif self.remaining is not None:
+            size = min(size, self.remaining)
+            if not size:
+                self.done = True
+                return b""
+        data = await wait_for(self.reader.read(size), TRANSFER_TIMEOUT)
+        if not data:
+            if self.chunked or self.remaining:
+                raise TransportError("connection closed before the end of the body")
+            self.done = True
+        elif self.chunked:
+            self.chunk_left -= len(data)
+            if not self.chunk_left:
+                await wait_for(self.reader.readline(), TRANSFER_TIMEOUT)
+        elif self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    async def read_all(self):
+        body = bytearray()
+        while chunk := await self.read():
+            body += chunk
+        return bytes(body)
+
+    def close(self):
+        self.writer.close()
+
+
+async def open_http(url, headers, offset=0):
+    """Sends a GET request on a non-blocking connection and returns the response.
+
+    Redirects are followed; error statuses raise TransportError.
+    """
+    for _ in range(TRANSFER_REDIRECTS + 1):
+        parts = urlparse(url)
+        secure = parts.scheme == "https"
+        reader, writer = await wait_for(
+            open_connection(
+                parts.hostname,
+                parts.port or (443 if secure else 80),
+                ssl=secure or None,
+            ),
+            TRANSFER_TIMEOUT,
+        )
+        target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        request_headers = {
+            **headers,
+            "Host": parts.netloc,
+            "Accept-Encoding": "identity",
+            "Connection": "close",
+        }
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+        lines = [f"GET {target} HTTP/1.1"]
+        lines += [f"{name}: {value}" for name, value in request_headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+        try:
+            await writer.drain()
+            status_line = await wait_for(reader.readline(), TRANSFER_TIMEOUT)
+            status = int(status_line.split()[1])
+            response_headers = {}
+            while (line := await wait_for(reader.readline(), TRANSFER_TIMEOUT)).strip():
+                name, _, value = line.decode("latin-1").partition(":")
+                response_headers[name.strip().lower()] = value.strip()
+        except (IndexError, ValueError) as e:
+            writer.close()
+            raise TransportError(f"malformed response from {parts.hostname}") from e
+        except BaseException:
+            writer.close()
+            raise
+        if status in (301, 302, 303, 307, 308) and "location" in response_headers:
+            writer.close()
+            url = urljoin(url, response_headers["location"])
+            continue
+        if status >= 400:
+            writer.close()
+            raise TransportError(f"HTTP Error {status} for {url}")
+        return AsyncHttpResponse(status, response_headers, reader, writer)
+    raise TransportError(f"Too many redirects for {url}")
+
+
+class TransferEngine:
+    """Moves media bytes on the event loop instead of in yt-dlp threads.
+
+    yt-dlp still resolves the entry, picks its formats and names its files, and
+    merges and postprocesses them afterwards; both steps are short and run in
+    the executor. In between, every format is fetched over non-blocking
+    sockets, one connection per stream, so the number of concurrent transfers
+    is not tied to the number of threads. Formats other than progressive HTTP,
+    finished unencrypted HLS and DASH segments are downloaded by yt-dlp in
+    the finishing step.
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+    async def download(self, url, ydl_opts, info=None):
+        """Downloads an entry and returns its final info and output file."""
+        loop = get_running_loop()
+        plan = partial(plan_transfers, url, ydl_opts, info)
+        ydl, info = await loop.run_in_executor(
+            context_executor(), tracer.traced("yt-dlp.plan", plan)
+        )
+        with ydl:
+            if not info:
+                return None, None
+            sources = [await self.resolve(fmt) for _, fmt in ydl.transfers]
+            staged = []
+            if None not in sources:
+                await self.transfer_all(ydl.transfers, sources, ydl_opts)
+                staged = [name for name, _ in ydl.transfers]
+            finish = partial(finish_transfers, ydl, info, staged)
+            return await loop.run_in_executor(
+                context_executor(), tracer.traced("yt-dlp.finish", finish)
+            )
+
+    async def transfer_all(self, transfers, sources, ydl_opts):
+        """Fetches the formats of an entry side by side."""
+        tasks = [
+            create_task(self.transfer(name, urls, fmt, ydl_opts))
+            for (name, fmt), urls in zip(transfers, sources)
+        ]
+        try:
+            await gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await gather(*tasks, return_exceptions=True)
+            raise
+
+    async def resolve(self, fmt):
+        """Lists the URLs a format is fetched from, or returns None to leave it to yt-dlp."""
+        protocol = fmt.get("protocol")
+        if protocol not in TRANSFER_PROTOCOLS or fmt.get("is_live"):
+            return None
+        if protocol in ("http", "https"):
+            return [fmt["url"]]
+        if protocol == "http_dash_segments":
+            fragments = fmt.get("fragments") or []
+            if not fragments or any("range" in f for f in fragments):
+                return None
+            base = fmt.get("fragment_base_url") or fmt["url"]
+            return [f.get("url") or urljoin(base, f["path"]) for f in fragments]
+        response = await open_http(fmt["url"], fmt["http_headers"])
+        try:
+            playlist = (await response.read_all()).decode("utf-8", "replace")
+        finally:
+            response.close()
+        return parse_media_playlist(playlist, fmt["url"])
+
+    async def transfer(self, name, urls, fmt, ydl_opts):
+        """Fetches the URLs one after the other into `name`.
+
+        A single-file transfer continues the partial file a stopped run left.
+        """
+        progress = {
+            "downloaded": 0,
+            "total": fmt.get("filesize") or fmt.get("filesize_approx"),
+            "started": time(),
+            "hooks": ydl_opts.get("progress_hooks"),
+            "rate_limit": ydl_opts.get("ratelimit"),
+        }
+        part = name + ".part"
+        resume = len(urls) == 1 and ydl_opts.get("continuedl", True)
+        with tracer.async_span("transfer", id(progress), file=name):
+            with open(part, "ab" if resume else "wb") as handle:
+                progress["downloaded"] = handle.tell()
+                for fragment_url in urls:
+                    await self.fetch(
+                        fragment_url, fmt, handle, progress, len(urls) == 1
+                    )
+            replace(part, name)
+        downloaded = progress["downloaded"]
+        report_progress(
+            progress["hooks"], fmt, "finished", downloaded, downloaded, name
+        )
+
+    async def fetch(self, url, fmt, handle, progress, whole):
+        """Appends one URL to the open file, resuming with a range request on retries.
+
+        `whole` tells that the URL is the entire file, so its length is the total
+        and what the file already holds is resumed.
+        """
+        start = 0 if whole else handle.tell()
+        for attempt in range(TRANSFER_RETRIES + 1):
+            offset = handle.tell() - start
+            try:
+                response = await open_http(url, fmt["http_headers"], offset)
+                try:
+                    if offset and response.status != 206:
+                        progress["downloaded"] -= offset
+                        handle.seek(start)
+                        handle.truncate()
+                        offset = 0
+                    expected = response.length and offset + response.length
+                    if whole and expected:
+                        progress["total"] = expected
+                    await self.copy_body(response, handle, fmt, progress)
+                finally:
+                    response.close()
+                if expected and handle.tell() - start != expected:
+                    raise ContentTooShortError(handle.tell() - start, expected)
+                return
+            except (OSError, TimeoutError, TransportError, ContentTooShortError):
+                if attempt == TRANSFER_RETRIES:
+                    raise
+
+    async def copy_body(self, response, handle, fmt, progress):
+        """Writes a response body to the file, reporting progress and keeping the rate limit.
+
+        The chunks are written on the event loop. A write of at most
+        TRANSFER_CHUNK_SIZE bytes only copies them into the page cache, which
+        takes far less time than the read that produced them. Handing each one
+        to the executor would cost a thread switch per chunk and queue the
+        transfers behind the yt-dlp work that runs there.
+        """
+        rate_limit = progress["rate_limit"]
+        while chunk := await response.read():
+            handle.write(chunk)
+            await bandwidth.pace(len(chunk))
+            progress["downloaded"] += len(chunk)
+            report_progress(
+                progress["hooks"],
+                fmt,
+                "downloading",
+                progress["downloaded"],
+                progress["total"],
+                handle.name,
+            )
+            if rate_limit:
+                elapsed = time() - progress["started"]
+                ahead = progress["downloaded"] / rate_limit - elapsed
+                if ahead > 0:
+                    await sleep(ahead)
+
+
+transfer_engine = TransferEngine()
+
+
+def fetch_entry_info(url, ydl_opts):
+    with YoutubeDL(ydl_opts) as ydl:
+        return ydl.extract_info(url, download=False, process=False)
+
+
+async def extract_entry_info(url, ydl_opts):
+    """Fetches the info of an entry without selecting or downloading formats."""
+    await rate_shaper.acquire(url)
+    if download_processes.enabled:
+        return await download_processes.run(fetch_entry_info, url, ydl_opts)
+    loop = get_event_loop()
+    func = partial(fetch_entry_info, url, ydl_opts)
+    return await loop.run_in_executor(
+        context_executor(), tracer.traced("yt-dlp.extract", func)
+    )
+
+
+PROCESS_LOCAL_OPTIONS = ("progress_hooks", "postprocessor_hooks")
+progress_updates = None
+
+
+def init_download_process(updates, abort, rate_share):
+    """Runs in each worker process; keeps the queue progress is reported on.
+
+    Interrupts are left to the main process, which drains the workers.
+    """
+    global progress_updates, download_abort
+    progress_updates = updates
+    download_abort = abort
+    bandwidth.shared = rate_share
+    set_signal_handler(SIGINT, SIG_IGN)
+    set_signal_handler(SIGTERM, SIG_IGN)
+
+
+class ProgressForwarder:
+    """yt-dlp progress hook that reports to the main process from a worker.
+
+    Updates are only sent when the whole percentage changes, which keeps the
+    traffic between the processes to about a hundred messages per download.
+    """
+
+    __slots__ = ("key", "percentage")
+
+    def __init__(self, key):
+        self.key = key
+        self.percentage = None
+
+    def __call__(self, d):
+        downloaded = d.get("downloaded_bytes") or 0
+        total = d.get("total_bytes") or d.get("total_bytes_estimate") or 0
+        percentage = downloaded * 100 // total if total else 0
+        if d["status"] == "downloading" and percentage == self.percentage:
+            return
+        self.percentage = percentage
+        progress_updates.put((self.key, d["status"], downloaded, total))
+
+
+def plain_info(value):
+    """Turns an info dict into plain data that can be unpickled in another process.
+
+    yt-dlp keeps objects such as its HTTPHeaderDict in the info, and not every
+    release can rebuild those from a pickle.
+    """
+    return YoutubeDL.sanitize_info(value) if isinstance(value, dict) else value
+
+
+def run_in_process(func, progress_key, url, ydl_opts, *args):
+    """Calls `func` in a worker process, forwarding its progress when keyed.
+
+    The info dicts in the result are sent back to the main process as plain data.
+    """
+    if progress_key is not None:
+        ydl_opts["progress_hooks"] = [ProgressForwarder(progress_key)]
+    result = func(url, ydl_opts, *args)
+    if isinstance(result, tuple):
+        return tuple(map(plain_info, result))
+    return plain_info(result)
+
+
+class DownloadProcesses:
+    """Pool of worker processes that run yt-dlp outside the main interpreter.
+
+    Extraction and downloads run in the workers, each with its own interpreter,
+    while scheduling, disk admission and progress rendering stay on the event
+    loop of the main process. A reader thread applies the progress the workers
+    send back to the counters of the progress board.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.updates = None
+        self.reader = None
+        self.aborting = None
+        self.rate_share = None
+        self.processes = 0
+
+    @property
+    def enabled(self):
+        return self.executor is not None
+
+    def start(self, processes):
+        context = get_context("spawn")
+        self.updates = context.Queue()
+        self.aborting = context.Event()
+        self.rate_share = context.Value("d", 0.0)
+        self.processes = processes
+        self.set_rate(bandwidth.rate)
+        self.executor = ProcessPoolExecutor(
+            processes,
+            mp_context=context,
+            initializer=init_download_process,
+            initargs=(self.updates, self.aborting, self.rate_share),
+        )
+        self.reader = Thread(target=self.read_updates, daemon=True)
+        self.reader.start()
+        # Boot the workers now, while the URL is extracted and the prompts run.
+        for _ in range(processes):
+            self.executor.submit(int)
+
+    def read_updates(self):
+        for key, status, downloaded, total in iter(self.updates.get, None):
+            _, counter = progress_board.bars.get(key, (None, None))
+            if counter is not None:
+                d = {"status": status, "downloaded_bytes": downloaded}
+                progress_hook({**d, "total_bytes": total}, counter)
+
+    async def run(self, func, url, ydl_opts, *args, progress_key=None):
+        """Runs `func(url, ydl_opts, *args)` in a worker process."""
+        ydl_opts = {
+            key: value
+            for key, value in ydl_opts.items()
+            if key not in PROCESS_LOCAL_OPTIONS
+        }
+        loop = get_event_loop()
+        call = partial(run_in_process, func, progress_key, url, ydl_opts, *args)
+        return await loop.run_in_executor(self.executor, call)
+
+    def set_rate(self, rate):
+        """Splits an aggregate rate limit evenly between the workers."""
+        if self.rate_share is not None:
+            self.rate_share.value = (rate or 0) / self.processes
+
+    def abort(self):
+        """Stops the downloads running in the workers at their next progress update."""
+        if self.aborting is not None:
+            self.aborting.set()
+
+    def stop(self):
+        if self.executor is None:
+            return
+        self.executor.shutdown(cancel_futures=True)
+        self.updates.put(None)
+        self.reader.join()
+        self.executor = self.updates = self.reader = self.aborting = None
+        self.rate_share = None
+
+
+download_processes = DownloadProcesses()
+
+
+def is_partial_file(name):
+    """Checks whether a file name belongs to an unfinished yt-dlp download."""
+    return name.endswith(PARTIAL_SUFFIXES) or ".part-Frag" in name
+
+
+def get_download_directories(ydl_opts):
+    """Lists the directories a download can write to."""
+    if "sink" in ydl_opts:
+        return []
+    return sorted(set((ydl_opts.get("paths") or {}).values()))
+
+
+def remove_partial_files(directories, prefix):
+    """Removes the partial and fragment files whose names start with `prefix`."""
+    removed = []
+    for directory in directories:
+        try:
+            names = listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if name.startswith(prefix) and is_partial_file(name):
+                try:
+                    remove(path.join(directory, name))
+                    removed.append(name)
+                except OSError:
+                    pass
+    return removed
+
+
+def cleanup_failed_download(ydl_opts):
+    """Removes the partial files of a download that failed.
+
+    Cancelled downloads keep their partial files so they can be resumed.
+    """
+    outtmpl = ydl_opts.get("outtmpl")
+    if not isinstance(outtmpl, str) or not outtmpl.split("%(")[0]:
+        return []
+    subdirectory, _, prefix = outtmpl.split("%(")[0].rpartition("/")
+    directories = [
+        path.join(directory, subdirectory)
+        for directory in get_download_directories(ydl_opts)
+    ]
+    return remove_partial_files(directories, prefix)
+
+
+def sweep_partial_files(directories, max_age=PARTIAL_MAX_AGE):
+    """Removes orphaned partial files that have not been touched for `max_age` seconds.
+
+    Shard subdirectories are swept too.
+    """
+    removed = []
+    now = time()
+    for directory in directories:
+        try:
+            entries = list(scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if is_shard_name(entry.name) and entry.is_dir(follow_symlinks=False):
+                removed += sweep_partial_files([entry.path], max_age)
+                continue
+            try:
+                if not is_partial_file(entry.name) or not entry.is_file():
+                    continue
+                if now - entry.stat().st_mtime > max_age:
+                    remove(entry.path)
+                    removed.append(entry.name)
+            except OSError:
+                pass
+    return removed
+
+
+class PartialSweep:
+    """Removes the partial files that earlier runs left in the output directories.
+
+    Off until configured: the files may belong to other programs, or to
+    downloads that a later run would resume.
+    """
+
+    __slots__ = ("max_age",)
+
+    def __init__(self):
+        self.max_age = None
+
+    def configure(self, hours):
+        self.max_age = None if hours is None else hours * 3600
+
+    def sweep(self, directories):
+        if self.max_age is None:
+            return []
+        return sweep_partial_files(directories, self.max_age)
+
+
+partial_sweep = PartialSweep()
+
+
+def estimate_download_size(entry, plan=None):
+    """Estimates the disk space an entry needs, including merge headroom."""
+    plan = plan or entry.get("format_plan") or {}
+    requested = entry.get("requested_formats") or []
+    size = plan.get("filesize") or entry.get("filesize") or entry.get("filesize_approx")
+    if not size and requested:
+        sizes = [estimate_format_size(f, entry.get("duration")) for f in requested]
+        size = sum(sizes) if None not in sizes else None
+    if not size:
+        return 0
+    rewrites = plan.get("merge", len(requested) > 1) or any(
+        pp["key"] in ("FFmpegVideoRemuxer", "FFmpegVideoConvertor")
+        for pp in plan.get("postprocessors", [])
+    )
+    return int(size * (2 if rewrites else 1) * MERGE_HEADROOM)
+
+
+class DiskAdmission:
+    """Admits downloads only while their estimated size fits in the free disk space.
+
+    Sizes are reserved before a download starts and released once it ends, so
+    concurrent downloads cannot overcommit the output volumes.
+    """
+
+    def __init__(self, directories, recheck_interval=DISK_RECHECK_INTERVAL):
+        self.directories = list(directories)
+        self.recheck_interval = recheck_interval
+        self.reserved = 0
+        self.condition = Condition()
+
+    def free_space(self):
+        """Returns the free space left on the fullest volume after reservations."""
+        return min(disk_usage(d).free for d in self.directories) - self.reserved
+
+    async def reserve(self, size):
+        """Waits until `size` bytes fit; returns False if they never can."""
+        async with self.condition:
+            while size > self.free_space():
+                if not self.reserved:
+                    return False
+                try:
+                    await wait_for(self.condition.wait(), self.recheck_interval)
+                except TimeoutError:
+                    pass
+            self.reserved += size
+            return True
+
+    async def release(self, size):
+        """Releases a reservation and wakes up the queued downloads."""
+        async with self.condition:
+            self.reserved -= size
+            self.condition.notify_all()
+
+
+def expected_file_size(info, ydl_opts):
+    """Returns the exact size a download must have, when its metadata pins it down.
+
+    Only single formats that yt-dlp does not postprocess keep their size; merged,
+    remuxed and converted files are left to the duration checks.
+    """
+    ydl_opts, _ = split_local_postprocessors(ydl_opts)
+    if info.get("requested_formats") or ydl_opts.get("postprocessors"):
+        return None
+    return info.get("filesize")
+
+
+def find_duration_problems(probe, expected=None):
+    """Compares the probed container and stream durations with the entry duration.
+
+    A merge that stopped early leaves a stream shorter than the container, and a
+    truncated transfer leaves a container shorter than the entry.
+    """
+    container = float((probe.get("format") or {}).get("duration") or 0)
+    if not container:
+        return ["the container has no duration"]
+    problems = []
+    if expected and abs(container - expected) > max(DURATION_TOLERANCE, expected / 50):
+        problems.append(f"lasts {container:.1f}s instead of {expected:.1f}s")
+    for stream in probe.get("streams") or []:
+        if stream.get("codec_type") not in ("video", "audio") or not stream.get(
+            "duration"
+        ):
+            continue
+        if (stream.get("disposition") or {}).get("attached_pic"):
+            continue
+        duration = float(stream["duration"])
+        if container - duration > max(DURATION_TOLERANCE, container / 50):
+            problems.append(
+                f"{stream['codec_type']} stream ends at {duration:.1f}s of {container:.1f}s"
+            )
+    return problems
+
+
+async def probe_media(filepath):
+    """Reads the container and stream durations of a file with ffprobe.
+
+    Returns None when ffprobe is not installed and raises ValueError when the
+    file cannot be read as media.
+    """
+    ffprobe = which("ffprobe")
+    if not ffprobe:
+        return None
+    process = await create_subprocess_exec(
+        ffprobe,
+        "-v",
+        "error",
+        "-show_entries",
+        "format=duration:stream=codec_type,duration:stream_disposition=attached_pic",
+        "-of",
+        "json",
+        filepath,
+        stdout=PIPE,
+        stderr=PIPE,
+    )
+    output, error = await process.communicate()
+    if process.returncode:
+        raise ValueError(error.decode(errors="replace").strip() or "unreadable media")
+    return loads(output)
+
+
+def hash_file(filepath, algorithm):
+    """Hashes a file through a memory map, or in chunks when it cannot be mapped."""
+    digest = new_hash(algorithm)
+    with open(filepath, "rb") as handle:
+        try:
+            with mmap(handle.fileno(), 0, access=ACCESS_READ) as mapped:
+                digest.update(mapped)
+        except (OSError, ValueError):
+            while chunk := handle.read(VERIFY_CHUNK_SIZE):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Verifier:
+    """Checks finished downloads after they have left their download slot.
+
+    A file is compared with the size its metadata promises, probed with ffprobe
+    for a readable container whose streams last as long as the entry, and
+    optionally hashed. Checks run in their own `workers`, so slots are free for
+    the next download meanwhile. A file that fails is removed so the entry can
+    be queued again.
+    """
+
+    def __init__(self, workers=VERIFY_WORKERS):
+        self.workers = workers
+        self.enabled = False
+        self.checksum = None
+        self.slots = None
+        self.executor = None
+        self.probe_missing = False
+
+    def configure(self, enabled, checksum=None):
+        self.enabled = enabled or bool(checksum)
+        self.checksum = checksum
+
+    async def verify(self, info, ydl_opts):
+        """Returns True when the downloaded file passes every check."""
+        filepath = (info.get("requested_downloads") or [{}])[-1].get("filepath")
+        if not filepath:
+            return True
+        if self.slots is None:
+            self.slots = Semaphore(self.workers)
+            self.executor = ThreadPoolExecutor(self.workers, "verify")
+        async with self.slots:
+            with tracer.async_span("verify", id(info), file=filepath):
+                problems = await self.check(info, ydl_opts, filepath)
+        if problems:
+            reason = "; ".join(problems)
+            notify(Fore.RED, f"Verification failed for {filepath}: {reason}")
+            try:
+                remove(filepath)
+            except OSError:
+                pass
+            return False
+        checksum = f" ({info['checksum']})" if info.get("checksum") else ""
+        notify(Fore.GREEN, f"Verified: {filepath}{checksum}")
+        return True
+
+    async def check(self, info, ydl_opts, filepath):
+        """Lists what is wrong with a downloaded file."""
+        try:
+            size = path.getsize(filepath)
+        except OSError:
+            return ["the file is missing"]
+        problems = []
+        expected = expected_file_size(info, ydl_opts)
+        if expected and size != expected:
+            problems.append(f"has {size} bytes instead of {expected}")
+        try:
+            probe = await probe_media(filepath)
+        except ValueError as e:
+            problems.append(f"cannot be read: {e}")
+        else:
+            if probe is not None:
+                problems += find_duration_problems(probe, info.get("duration"))
+            elif not self.probe_missing:
+                self.probe_missing = True
+                notify(Fore.YELLOW, "ffprobe not found. Skipping duration checks.")
+        if self.checksum and not problems:
+            digest = await get_running_loop().run_in_executor(
+                self.executor, hash_file, filepath, self.checksum
+            )
+            info["checksum"] = f"{self.checksum}:{digest}"
+        return problems
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.slots = None
+        self.executor = None
+
+
+verifier = Verifier()
+
+
+def get_output_file(ydl, info):
+    """Returns the final path of a download, after yt-dlp's postprocessing."""
+    downloads = info.get("requested_downloads") or [{}]
+    return downloads[-1].get("filepath") or ydl.prepare_filename(info)
+
+
+async def process_entries(
+    entries, ydl_opts, max_concurrent, shutdown_event, semaphore=None, admission=None
+):
+    """Processes multiple entries (e.g., a playlist).
+
+    Returns one result per entry, in order: the final info dict, None or the
+    raised exception. A `semaphore` shares its download slots with other runs,
+    and an `admission` its disk reservations.
+    """
+    if not entries:
+        notify(Fore.YELLOW, "No entries found to download.")
+        return []
+    if admission is None:
+        admission = create_disk_admission(ydl_opts)
+    tasks = create_download_tasks(
+        entries, ydl_opts, max_concurrent, shutdown_event, admission, semaphore
+    )
+    return await gather(*tasks, return_exceptions=True)
+
+
+def create_disk_admission(ydl_opts):
+    """Returns the admission of the output directories, sweeping them when enabled."""
+    directories = get_download_directories(ydl_opts)
+    if not directories:
+        return None
+    partial_sweep.sweep(directories)
+    return DiskAdmission(directories)
+
+
+def create_download_tasks(
+    entries, ydl_opts, max_concurrent, shutdown_event, admission=None, semaphore=None
+):
+    """Creates asynchronous tasks for downloading entries.
+
+    Without a `semaphore`, their slots follow the schedule, which may allow
+    more downloads than `max_concurrent` at times. With an "events" option,
+    the outcome of every entry is reported to it as its task ends.
+    """
+    if semaphore is None:
+        semaphore = DownloadSlots(max_concurrent)
+        schedule.track(semaphore)
+        size_executor(schedule.peak(max_concurrent))
+    events = ydl_opts.get("events")
+    tasks = []
     for entry in entries:
         task = create_task(
-            download_with_semaphore(entry, ydl_opts, semaphore, shutdown_event, lock)
+            download_with_semaphore(
+                entry, ydl_opts, semaphore, shutdown_event, admission
+            )
         )
+        if events is not None:
+            task.add_done_callback(partial(events.entry_done, entry))
         tasks.append(task)
     return tasks
 
 
-async def download_with_semaphore(entry, ydl_opts, semaphore, shutdown_event, lock):
-    """Downloads an entry while respecting the semaphore limit."""
-    async with semaphore:
+async def download_with_semaphore(
+    entry, ydl_opts, semaphore, shutdown_event, admission=None
+):
+    """Downloads an entry while respecting the semaphore limit and free disk space.
+
+    With verification enabled, the file is checked after the slot is released;
+    when it fails, the entry queues for a slot again, up to MAX_VERIFY_ATTEMPTS
+    downloads. Returns the final info dict, or None when the entry was not
+    downloaded.
+    """
+    for _ in range(MAX_VERIFY_ATTEMPTS):
+        result = await download_in_slot(
+            entry, ydl_opts, semaphore, shutdown_event, admission
+        )
+        if (
+            not verifier.enabled
+            or "sink" in ydl_opts
+            or not isinstance(result, dict)
+            or await verifier.verify(result, ydl_opts)
+        ):
+            return result
+        if shutdown_event.is_set():
+            return None
+        notify(Fore.YELLOW, f"Queued again after failed verification: {entry['title']}")
+    notify(Fore.RED, f"Verification kept failing for: {entry['title']}")
+    return None
+
+
+async def download_in_slot(entry, ydl_opts, semaphore, shutdown_event, admission=None):
+    """Downloads an entry once it holds a download slot.
+
+    The `admission` travels to `perform_download` as the "disk_admission" option,
+    which reserves the disk space once the full info of the entry is known.
+    """
+    with tracer.async_span("queue_wait", id(entry)):
+        await semaphore.acquire()
+    try:
         if shutdown_event.is_set():
-            return
-        await download_entry(entry, ydl_opts, lock)
+            return None
+        if admission is not None:
+            ydl_opts = {**ydl_opts, "disk_admission": admission}
+        return await download_entry(entry, ydl_opts)
+    finally:
+        semaphore.release()
 
 
 def determine_if_playlist(info):
@@ -376,6 +3237,9 @@ async def gather_user_options(is_playlist):
     if download_type in ["video", "both"]:
         video_output_dir = await get_video_output_directory()
     qualities = await get_quality(download_type)
+    thumbnail = False
+    if download_type in ["video", "both"]:
+        thumbnail = await get_save_thumbnail()
     max_concurrent = await get_max_concurrent() if is_playlist else 1
     user_options = {
         "output_dir": output_dir,
@@ -384,6 +3248,7 @@ async def gather_user_options(is_playlist):
         "video_output_dir": video_output_dir,
         "audio_quality": qualities.get("audio"),
         "video_quality": qualities.get("video"),
+        "outputs": get_derived_outputs(download_type, thumbnail),
         "max_concurrent": max_concurrent,
     }
     return user_options
@@ -418,6 +3283,7 @@ def prepare_ydl_options(user_options, cookies_file=None):
         user_options["video_quality"],
         user_options["video_output_dir"],
         cookies_file,
+        user_options.get("outputs"),
     )
     return ydl_opts
 
@@ -425,15 +3291,25 @@ def prepare_ydl_options(user_options, cookies_file=None):
 async def perform_downloads(
     info, ydl_opts, is_playlist, max_concurrent, shutdown_event
 ):
-    """Performs downloads based on whether the input is a playlist or a single video."""
+    """Performs downloads based on whether the input is a playlist or a single video.
+
+    Returns the download results in entry order. A single video still takes a
+    tracked slot, so the rate of the schedule applies to it.
+    """
     if is_playlist:
-        await handle_playlist(info, ydl_opts, max_concurrent, shutdown_event)
-    else:
-        await download_entry(info, ydl_opts, Lock())
+        return await handle_playlist(info, ydl_opts, max_concurrent, shutdown_event)
+    admission = create_disk_admission(ydl_opts)
+    slots = DownloadSlots(1)
+    schedule.track(slots)
+    return [
+        await download_with_semaphore(info, ydl_opts, slots, shutdown_event, admission)
+    ]
 
 
 async def show_spinner(message, stop_event):
-    """Displays a spinner while processing."""
+    """Displays a spinner while processing, except in the jobs of a `Downloader`."""
+    if current_downloader.get() is not None:
+        return
     spinner = cycle(["-", "\\", "|", "/"])
     while not stop_event.is_set():
         stdout.write(next(spinner) + " " + message + "    \r")
@@ -443,15 +3319,113 @@ async def show_spinner(message, stop_event):
     stdout.flush()
 
 
-async def extract_info(url, ydl_opts, shutdown_event):
-    """Extracts video or playlist information using yt-dlp."""
+SYNC_WATERMARK_IDS = 20
+
+
+class SyncState:
+    """Per-source watermarks for incremental channel and playlist syncs.
+
+    A watermark keeps the ids of the newest synced entries and the newest upload
+    date among them. Listings are read newest first and stop at the first entry
+    the watermark covers, so a sync only pages through the uploads made since
+    the previous run.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.sources = {}
+        if path.exists(state_file):
+            with open(state_file) as handle:
+                self.sources = load(handle)
+
+    @staticmethod
+    def entry_key(entry):
+        return entry.get("id") or entry.get("url")
+
+    def is_synced(self, source, entry):
+        watermark = self.sources.get(source)
+        if not watermark:
+            return False
+        if self.entry_key(entry) in watermark["ids"]:
+            return True
+        upload_date = entry.get("upload_date")
+        newest = watermark.get("upload_date")
+        return bool(upload_date and newest and upload_date < newest)
+
+    def take_new(self, source, entries):
+        """Returns the entries listed before the watermark, without paging past it."""
+        new_entries = []
+        for entry in entries:
+            if not entry:
+                continue
+            if self.is_synced(source, entry):
+                break
+            new_entries.append(entry)
+        return new_entries
+
+    def advance(self, source, entries, results):
+        """Moves the watermark over the newly synced entries and saves the state.
+
+        Entries listed before a failed download are left out, so the failure is
+        listed again on the next sync.
+        """
+        synced = []
+        for entry, result in zip(entries, results):
+            if isinstance(result, dict):
+                synced.append((entry, result))
+            else:
+                synced = []
+        if not synced:
+            return
+        watermark = self.sources.get(source, {"ids": []})
+        ids = [self.entry_key(entry) for entry, _ in synced] + watermark["ids"]
+        dates = [result.get("upload_date") for _, result in synced]
+        dates.append(watermark.get("upload_date"))
+        self.sources[source] = {
+            "ids": list(dict.fromkeys(filter(None, ids)))[:SYNC_WATERMARK_IDS],
+            "upload_date": max(filter(None, dates), default=None),
+        }
+        self.save()
+
+    def save(self):
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as handle:
+            dump(self.sources, handle, indent=2)
+        replace(temp_file, self.state_file)
+
+
+def extract_new_entries(ydl, url, sync_state):
+    """Extracts `url`, listing playlist entries only down to its sync watermark."""
+    info = ydl.extract_info(url, download=False, process=False)
+    while info and info.get("_type") in ("url", "url_transparent"):
+        info = ydl.extract_info(
+            info["url"], download=False, process=False, ie_key=info.get("ie_key")
+        )
+    if not info or not determine_if_playlist(info):
+        return info and ydl.process_ie_result(info, download=False)
+    info["entries"] = sync_state.take_new(url, info.get("entries") or [])
+    return info
+
+
+async def extract_info(url, ydl_opts, shutdown_event, sync_state=None):
+    """Extracts video or playlist information using yt-dlp.
+
+    With a `sync_state`, playlists only list the entries newer than the sync
+    watermark of `url`.
+    """
     loop = get_event_loop()
     stop_event = Event()
     spinner_task = create_task(show_spinner("Processing your request...", stop_event))
     try:
+        await rate_shaper.acquire(url)
         with YoutubeDL(ydl_opts) as ydl:
-            func = partial(ydl.extract_info, url, download=False)
-            info = await loop.run_in_executor(None, func)
+            if sync_state is None:
+                func = partial(ydl.extract_info, url, download=False)
+            else:
+                func = partial(extract_new_entries, ydl, url, sync_state)
+            func = tracer.traced("yt-dlp.extract_info", func)
+            with tracer.async_span("extract_info", url, url=url):
+                info = await loop.run_in_executor(context_executor(), func)
         stop_event.set()
         await spinner_task
         return info
@@ -459,7 +3433,7 @@ async def extract_info(url, ydl_opts, shutdown_event):
         stop_event.set()
         await spinner_task
         if not shutdown_event.is_set():
-            print(Fore.RED + f"Error processing the URL: {e}")
+            notify(Fore.RED, f"Error processing the URL: {e}")
         return None
 
 
@@ -468,27 +3442,698 @@ async def handle_playlist(info, ydl_opts, max_concurrent, shutdown_event):
     entries = info.get("entries", [])
     if not entries:
         print(Fore.YELLOW + "The playlist appears to be empty.")
-        return
+        return []
     print(Fore.CYAN + f"Found {len(entries)} items. Starting downloads...")
-    await process_entries(entries, ydl_opts, max_concurrent, shutdown_event)
+    return await process_entries(entries, ydl_opts, max_concurrent, shutdown_event)
+
 
+async def download_media(
+    user_input,
+    shutdown_event,
+    sync_state=None,
+    work_queue=None,
+    sink=None,
+    shard_outputs=False,
+):
+    """Main function to orchestrate the download process.
 
-async def download_media(user_input, shutdown_event):
-    """Main function to orchestrate the download process."""
+    With a `work_queue`, the entries are published for workers instead of being
+    downloaded here. With a `sink`, they are streamed to it instead of being
+    saved.
+    """
     url = user_input["url"]
     cookies_file = user_input.get("cookies_file")
     temp_ydl_opts = initialize_ydl_options(".", cookies_file=cookies_file)
-    info = await extract_info(url, temp_ydl_opts, shutdown_event)
+    temp_ydl_opts["extract_flat"] = "in_playlist"
+    info = await extract_info(url, temp_ydl_opts, shutdown_event, sync_state)
     if not info or shutdown_event.is_set():
         return
     is_playlist = determine_if_playlist(info)
+    if sync_state is not None and (
+        sync_state.is_synced(url, info) or (is_playlist and not info["entries"])
+    ):
+        print(Fore.GREEN + "Nothing new since the last sync.")
+        return
     user_options = await gather_user_options(is_playlist)
     if shutdown_event.is_set():
         return
+    user_options["shard_outputs"] = shard_outputs
     ydl_opts = prepare_ydl_options(user_options, cookies_file)
-    await perform_downloads(
-        info, ydl_opts, is_playlist, user_options["max_concurrent"], shutdown_event
-    )
+    if sink is not None:
+        ydl_opts["sink"] = sink
+    if is_playlist:
+        info["entries"] = compact_entries(info.get("entries") or [])
+    if work_queue is not None:
+        entries = info["entries"] if is_playlist else compact_entries([info])
+        options = {**user_options, "cookies_file": cookies_file}
+        published = await get_event_loop().run_in_executor(
+            None, work_queue.publish, entries, options
+        )
+        print(Fore.GREEN + f"Published {published} of {len(entries)} entries.")
+        if sync_state is not None:
+            sync_state.advance(url, entries, [{} for _ in entries])
+        return
+    planner = create_output_planner(ydl_opts, shard_outputs)
+    if planner is not None:
+        ydl_opts["output_planner"] = await index_outputs(planner)
+    if not is_playlist:
+        plan_formats([info], **ydl_opts["format_planning"])
+    drain.install(shutdown_event)
+    try:
+        results = await perform_downloads(
+            info, ydl_opts, is_playlist, user_options["max_concurrent"], shutdown_event
+        )
+    finally:
+        drain.remove()
+    if sync_state is not None:
+        entries = info["entries"] if is_playlist else [info]
+        sync_state.advance(url, entries, results)
+
+
+LEASE_SECONDS = 300
+LEASE_POLL_INTERVAL = 5
+MAX_JOB_ATTEMPTS = 3
+
+
+class WorkQueue(ABC):
+    """Shared job queue used by the coordinator and worker modes.
+
+    A coordinator publishes entries together with the user options they were
+    chosen with. Workers lease one job at a time, renew the lease while the
+    download runs and report the outcome. A lease that is not renewed expires,
+    so the jobs of a crashed worker are handed to the next worker that asks.
+    Network backends implement these methods and register in `QUEUE_BACKENDS`.
+    """
+
+    @abstractmethod
+    def publish(self, entries, options):
+        """Adds the entries as pending jobs and returns how many were new."""
+
+    @abstractmethod
+    def lease(self, worker, duration):
+        """Leases the next pending or expired job, or returns None."""
+
+    @abstractmethod
+    def renew(self, job_id, worker, duration):
+        """Extends a lease; returns False when the worker no longer holds it."""
+
+    @abstractmethod
+    def complete(self, job_id, worker):
+        """Marks a leased job as done."""
+
+    @abstractmethod
+    def fail(self, job_id, worker, error):
+        """Returns a failed job to the queue until it runs out of attempts."""
+
+    @abstractmethod
+    def release(self, job_id, worker):
+        """Returns a job to the queue without counting the attempt."""
+
+    @abstractmethod
+    def unfinished(self):
+        """Returns the number of jobs that are pending or leased."""
+
+
+class SqliteWorkQueue(WorkQueue):
+    """Work queue stored in a sqlite file shared by the processes of one host."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            entry TEXT NOT NULL,
+            options TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires);
+    """
+
+    def __init__(self, database):
+        self.database = database
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = connect_sqlite(self.database, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def publish(self, entries, options):
+        options = dumps(options)
+        rows = [(entry.url, dumps(entry.as_dict()), options) for entry in entries]
+        with self.transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (url, entry, options) VALUES (?, ?, ?)",
+                rows,
+            )
+            return conn.total_changes - before
+
+    def lease(self, worker, duration):
+        now = time()
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'lease expired' "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, MAX_JOB_ATTEMPTS),
+            )
+            row = conn.execute(
+                "SELECT id, entry, options FROM jobs WHERE status = 'pending' "
+                "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, now + duration, row[0]),
+            )
+        return {"id": row[0], "entry": loads(row[1]), "options": loads(row[2])}
+
+    def update_lease(self, job_id, worker, assignments, params=()):
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (*params, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, job_id, worker, duration):
+        return self.update_lease(
+            job_id, worker, "lease_expires = ?", (time() + duration,)
+        )
+
+    def complete(self, job_id, worker):
+        return self.update_lease(
+            job_id, worker, "status = 'done', lease_expires = NULL, error = NULL"
+        )
+
+    def fail(self, job_id, worker, error):
+        return self.update_lease(
+            job_id,
+            worker,
+            "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_expires = NULL, error = ?",
+            (MAX_JOB_ATTEMPTS, error),
+        )
+
+    def release(self, job_id, worker):
+        return self.update_lease(
+            job_id,
+            worker,
+            "status = 'pending', lease_expires = NULL, attempts = attempts - 1",
+        )
+
+    def unfinished(self):
+        with self.connect() as conn:
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'leased')"
+            ).fetchone()
+        return count
+
+
+QUEUE_BACKENDS = {"sqlite": SqliteWorkQueue}
+
+
+def open_work_queue(location):
+    """Opens `BACKEND://LOCATION`, or a plain path as a sqlite work queue."""
+    scheme, separator, target = location.partition("://")
+    if not separator:
+        return SqliteWorkQueue(location)
+    backend = QUEUE_BACKENDS.get(scheme)
+    if backend is None:
+        raise ValueError(f"Unsupported work queue backend: {scheme}")
+    return backend(target)
+
+
+async def renew_lease(work_queue, job_id, worker, duration=LEASE_SECONDS):
+    """Keeps a job leased while it downloads."""
+    loop = get_event_loop()
+    while True:
+        await sleep(duration / 3)
+        if not await loop.run_in_executor(
+            None, work_queue.renew, job_id, worker, duration
+        ):
+            print(Fore.YELLOW + f"Lost the lease on job {job_id}.")
+            return
+
+
+class QueueWorker:
+    """Downloads jobs leased from a work queue through `concurrency` job slots."""
+
+    def __init__(
+        self, work_queue, shutdown_event, concurrency=DEFAULT_WORKER_CONCURRENCY
+    ):
+        self.work_queue = work_queue
+        self.shutdown_event = shutdown_event
+        self.concurrency = concurrency
+        self.name = f"{gethostname()}:{getpid()}"
+        self.semaphore = DownloadSlots(concurrency)
+        self.admissions = {}
+        self.planners = {}
+
+    async def run(self):
+        print(Fore.CYAN + f"Worker {self.name} started.")
+        schedule.track(self.semaphore)
+        loops = schedule.peak(self.concurrency)
+        size_executor(loops)
+        drain.install(self.shutdown_event)
+        try:
+            await gather(*(self.work(index) for index in range(loops)))
+        finally:
+            drain.remove()
+        if self.shutdown_event.is_set():
+            print(Fore.YELLOW + f"Worker {self.name} stopped.")
+        else:
+            print(Fore.GREEN + f"Worker {self.name} finished: the queue is drained.")
+
+    async def work(self, index=0):
+        """Leases jobs one at a time until the queue has no unfinished jobs left.
+
+        The loop at `index` only leases while the schedule allows more than
+        `index` downloads, so jobs are not held by a worker that cannot start them.
+        """
+        loop = get_event_loop()
+        while not self.shutdown_event.is_set():
+            job = None
+            if index < self.semaphore.limit:
+                job = await loop.run_in_executor(
+                    None, self.work_queue.lease, self.name, LEASE_SECONDS
+                )
+            if job is not None:
+                await self.run_job(job)
+            elif await loop.run_in_executor(None, self.work_queue.unfinished):
+                await sleep(LEASE_POLL_INTERVAL)
+            else:
+                return
+
+    def get_admission(self, ydl_opts):
+        directories = tuple(get_download_directories(ydl_opts))
+        if directories and directories not in self.admissions:
+            self.admissions[directories] = create_disk_admission(ydl_opts)
+        return self.admissions.get(directories)
+
+    async def run_job(self, job):
+        """Downloads a leased job and reports the outcome to the queue."""
+        loop = get_event_loop()
+        options = job["options"]
+        ydl_opts = prepare_ydl_options(options, options.get("cookies_file"))
+        planner = await get_output_planner(
+            self.planners, ydl_opts, options.get("shard_outputs")
+        )
+        if planner is not None:
+            ydl_opts["output_planner"] = planner
+        heartbeat = create_task(renew_lease(self.work_queue, job["id"], self.name))
+        try:
+            result = await download_with_semaphore(
+                EntryRecord(**job["entry"]),
+                ydl_opts,
+                self.semaphore,
+                self.shutdown_event,
+                self.get_admission(ydl_opts),
+            )
+        finally:
+            heartbeat.cancel()
+        if isinstance(result, dict):
+            report = partial(self.work_queue.complete, job["id"], self.name)
+        elif self.shutdown_event.is_set():
+            report = partial(self.work_queue.release, job["id"], self.name)
+        else:
+            report = partial(
+                self.work_queue.fail, job["id"], self.name, "download failed"
+            )
+        await loop.run_in_executor(None, report)
+        return result
+
+
+class DownloadEvent:
+    """Event about one entry of a `Job`; `id`, `title` and `url` name the entry."""
+
+    __slots__ = ("job", "id", "title", "url")
+
+    def __init__(self, job, entry):
+        self.job = job
+        self.id = entry.get("id")
+        self.title = entry.get("title")
+        self.url = entry.get("webpage_url")
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}"
+            for cls in type(self).__mro__[-2::-1]
+            for name in cls.__slots__
+            if name not in ("job", "info")
+        )
+        return f"{type(self).__name__}({fields})"
+
+
+class ProgressEvent(DownloadEvent):
+    """Progress of a running download, sent when its percentage changes."""
+
+    __slots__ = ("percentage", "downloaded", "total")
+
+    def __init__(self, job, entry, percentage, downloaded, total):
+        super().__init__(job, entry)
+        self.percentage = percentage
+        self.downloaded = downloaded
+        self.total = total
+
+
+class CompletedEvent(DownloadEvent):
+    """An entry was downloaded, or found already downloaded, at `filepath`."""
+
+    __slots__ = ("info", "filepath")
+
+    def __init__(self, job, entry, info):
+        super().__init__(job, entry)
+        self.info = info
+        self.filepath = get_result_file(info)
+
+
+class FailedEvent(DownloadEvent):
+    """An entry, or the whole job when its URL could not be extracted, failed."""
+
+    __slots__ = ("error",)
+
+    def __init__(self, job, entry, error):
+        super().__init__(job, entry)
+        self.error = error
+
+
+class EventProgress:
+    """Stands in for the progress bar of a download and sends its updates as events."""
+
+    __slots__ = ("job", "entry", "counter", "n")
+
+    def __init__(self, job, entry):
+        self.job = job
+        self.entry = entry
+        self.counter = None
+        self.n = 0
+
+    def refresh(self):
+        self.job.emit(
+            ProgressEvent(
+                self.job,
+                self.entry,
+                self.n,
+                self.counter.downloaded,
+                self.counter.total,
+            )
+        )
+
+    def close(self):
+        pass
+
+
+class Job:
+    """A URL submitted to a `Downloader`.
+
+    Iterate it with `async for` to receive its events as they happen, or await
+    it for the results of its entries in order: the final info dict, None or
+    the raised exception.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.queue = Queue()
+        self.task = None
+
+    def emit(self, event):
+        self.queue.put_nowait(event)
+
+    def entry_done(self, entry, task):
+        """Reports the outcome of an entry's download task."""
+        if task.cancelled():
+            self.emit(FailedEvent(self, entry, "cancelled"))
+        elif isinstance(task.exception(), Exception):
+            self.emit(FailedEvent(self, entry, str(task.exception())))
+        elif isinstance(task.result(), dict):
+            self.emit(CompletedEvent(self, entry, task.result()))
+        else:
+            self.emit(FailedEvent(self, entry, "not downloaded"))
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+    async def __aiter__(self):
+        while (event := await self.queue.get()) is not None:
+            yield event
+
+    def __await__(self):
+        return self.task.__await__()
+
+    def cancel(self):
+        return self.task.cancel()
+
+
+class Downloader:
+    """Async API for downloading from another program, without prompts.
+
+    Jobs run on the caller's event loop with the options the prompts would
+    ask for. All jobs share the download slots, a private executor or the
+    worker processes, the metadata pacing, and the index and disk admission of
+    each output directory, so a long-lived downloader serves many requests at
+    the cost of one. Each job lists its output directory again, so the index
+    sees what other programs saved meanwhile. Status messages, including
+    those of the schedule, go to the "eagle_downloader" logger.
+
+        async with Downloader(max_concurrent=8) as downloader:
+            job = downloader.submit(url, output_dir="media", download_type="audio")
+            async for event in job:
+                ...
+    """
+
+    def __init__(self, max_concurrent=5, processes=0):
+        self.max_concurrent = max_concurrent
+        self.processes = processes
+        self.semaphore = None
+        self.shutdown_event = None
+        self.executor = None
+        self.planners = {}
+        self.admissions = {}
+        self.jobs = set()
+        self.owns_processes = False
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def start(self):
+        """Sets the downloader up on the running event loop."""
+        if self.semaphore is not None:
+            return
+        self.semaphore = DownloadSlots(self.max_concurrent)
+        self.shutdown_event = Event()
+        self.executor = ThreadPoolExecutor(
+            schedule.peak(self.max_concurrent) + EXECUTOR_SPARE_THREADS, "eagle"
+        )
+        # The schedule task logs its changes like the jobs of this downloader.
+        context = copy_context()
+        context.run(current_downloader.set, self)
+        context.run(schedule.track, self.semaphore)
+        if self.processes and not download_processes.enabled:
+            download_processes.start(self.processes)
+            self.owns_processes = True
+
+    def submit(
+        self,
+        url,
+        output_dir="downloads",
+        download_type="video",
+        audio_quality="320",
+        video_quality="1080",
+        video_output_dir=None,
+        rate_limit=None,
+        cookies_file=None,
+        outputs=(),
+        shard_outputs=False,
+    ):
+        """Starts downloading `url` and returns its `Job`.
+
+        The options match the prompts: `download_type` is "audio", "video" or
+        "both", qualities are kbps and the maximum resolution, `rate_limit` is
+        in bytes per second and `outputs` lists derived outputs ("mp3",
+        "thumbnail").
+        """
+        self.start()
+        if self.shutdown_event.is_set():
+            raise RuntimeError("The downloader is closed.")
+        user_options = {
+            "output_dir": output_dir,
+            "rate_limit": rate_limit,
+            "download_type": download_type,
+            "video_output_dir": video_output_dir,
+            "audio_quality": audio_quality if download_type != "video" else None,
+            "video_quality": video_quality if download_type != "audio" else None,
+            "outputs": list(outputs),
+            "max_concurrent": self.max_concurrent,
+            "shard_outputs": shard_outputs,
+        }
+        job = Job(url)
+        job.task = create_task(self.run(job, user_options, cookies_file))
+        self.jobs.add(job.task)
+        job.task.add_done_callback(self.jobs.discard)
+        return job
+
+    async def run(self, job, user_options, cookies_file):
+        """Extracts the URL of a job and downloads its entries."""
+        current_downloader.set(self)
+        try:
+            ydl_opts = initialize_ydl_options(".", cookies_file=cookies_file)
+            ydl_opts["extract_flat"] = "in_playlist"
+            ydl_opts["logger"] = logger
+            info = await extract_info(job.url, ydl_opts, self.shutdown_event)
+            if not info:
+                job.emit(
+                    FailedEvent(job, {"webpage_url": job.url}, "extraction failed")
+                )
+                return []
+            ydl_opts = prepare_ydl_options(user_options, cookies_file)
+            planner = await get_output_planner(
+                self.planners, ydl_opts, user_options["shard_outputs"], refresh=True
+            )
+            if planner is not None:
+                ydl_opts["output_planner"] = planner
+            ydl_opts["events"] = job
+            ydl_opts["logger"] = logger
+            if determine_if_playlist(info):
+                entries = compact_entries(info.get("entries") or [])
+            else:
+                plan_formats([info], **ydl_opts["format_planning"])
+                entries = [info]
+            return await process_entries(
+                entries,
+                ydl_opts,
+                self.max_concurrent,
+                self.shutdown_event,
+                self.semaphore,
+                await self.get_admission(ydl_opts),
+            )
+        finally:
+            job.close()
+
+    async def get_admission(self, ydl_opts):
+        """Returns the disk admission shared by the jobs that write to the same directories."""
+        directories = tuple(get_download_directories(ydl_opts))
+        if not directories:
+            return None
+        if directories not in self.admissions:
+            self.admissions[directories] = create_task(
+                self.create_admission(directories)
+            )
+        return await self.admissions[directories]
+
+    async def create_admission(self, directories):
+        if partial_sweep.max_age is not None:
+            loop = get_running_loop()
+            await loop.run_in_executor(self.executor, partial_sweep.sweep, directories)
+        return DiskAdmission(directories)
+
+    async def close(self):
+        """Stops starting new entries and waits for the downloads in progress."""
+        if self.semaphore is None:
+            return
+        self.shutdown_event.set()
+        await gather(*self.jobs, return_exceptions=True)
+        if self.owns_processes:
+            await get_running_loop().run_in_executor(
+                self.executor, download_processes.stop
+            )
+            self.owns_processes = False
+        self.executor.shutdown(wait=False)
+
+
+class Drain:
+    """Two-phase shutdown on SIGINT and SIGTERM.
+
+    The first signal sets the shutdown event: no new entries are started and
+    in-flight downloads get `timeout` seconds to finish. A second signal, or
+    the deadline, cancels the downloads that are still running; they keep their
+    partial files and resume on the next run. Another signal after that falls
+    back to the default interrupt.
+    """
+
+    def __init__(self, timeout=DRAIN_TIMEOUT):
+        self.timeout = timeout
+        self.shutdown_event = None
+        self.task = None
+        self.deadline = None
+        self.handlers = {}
+
+    def install(self, shutdown_event):
+        """Drains the current task on the signals that follow."""
+        loop = get_running_loop()
+        self.shutdown_event = shutdown_event
+        self.task = current_task()
+        download_abort.clear()
+        for signum in (SIGINT, SIGTERM):
+            handler = getsignal(signum) or SIG_DFL
+            try:
+                loop.add_signal_handler(signum, self.signal)
+            except (NotImplementedError, RuntimeError):
+                return
+            self.handlers[signum] = handler
+
+    def remove(self):
+        """Gives the signals back to the handlers they had before `install`."""
+        if self.task is None:
+            return
+        loop = self.task.get_loop()
+        for signum, handler in self.handlers.items():
+            loop.remove_signal_handler(signum)
+            set_signal_handler(signum, handler)
+        if self.deadline is not None:
+            self.deadline.cancel()
+        self.task = self.deadline = None
+        self.handlers = {}
+
+    def signal(self):
+        if self.shutdown_event.is_set():
+            self.force()
+            return
+        self.shutdown_event.set()
+        print(
+            Fore.YELLOW + "\nFinishing the downloads in progress for up to "
+            f"{self.timeout:g}s. Interrupt again to stop now."
+        )
+        self.deadline = self.task.get_loop().call_later(self.timeout, self.force)
+
+    def force(self):
+        """Stops the downloads in progress, keeping their partial files."""
+        print(Fore.YELLOW + "\nStopping the downloads in progress...")
+        download_abort.set()
+        download_processes.abort()
+        task = self.task
+        self.remove()
+        task.cancel()
+
+
+drain = Drain()
 
 
 async def shutdown(loop, signal=None):
@@ -502,26 +4147,79 @@ async def shutdown(loop, signal=None):
 
 def handle():
     """Handles the main logic flow, including event loop management and shutdown handling."""
-    parse_arguments()
+    args = parse_arguments()
+    if args.profile:
+        tracer.enable()
+    sync_state = SyncState(args.sync) if args.sync else None
+    rate_shaper.configure(args.metadata_rate, args.metadata_burst)
+    try:
+        schedule.configure(parse_schedule(args.schedule) if args.schedule else [])
+    except ValueError as e:
+        print(Fore.RED + str(e))
+        return
+    verifier.configure(args.verify, args.checksum)
+    partial_sweep.configure(args.sweep_partials)
+    transfer_engine.enabled = args.async_transfers
+    drain.timeout = args.drain_timeout
+    work_queue = None
+    if args.worker or args.coordinator:
+        try:
+            work_queue = open_work_queue(args.worker or args.coordinator)
+        except ValueError as e:
+            print(Fore.RED + str(e))
+            return
+    sink = None
+    if args.sink:
+        try:
+            sink = open_sink(args.sink)
+        except (OSError, ValueError) as e:
+            print(Fore.RED + str(e))
+            return
+    if args.processes > 0:
+        download_processes.start(args.processes)
     loop = get_event_loop()
     shutdown_event = Event()
+    if args.worker:
+        coroutine = QueueWorker(work_queue, shutdown_event, args.concurrency).run()
+    else:
+        coroutine = main_async(
+            shutdown_event, sync_state, work_queue, sink, args.shard_outputs
+        )
     try:
-        run(main_async(shutdown_event))
-    except KeyboardInterrupt:
+        run(coroutine)
+    except (KeyboardInterrupt, CancelledError):
         shutdown_event.set()
         loop.run_until_complete(shutdown(loop))
         print(Fore.RED + "\nDownload interrupted by user.")
     finally:
         loop.close()
+        if sink is not None:
+            sink.close()
+        download_processes.stop()
+        verifier.stop()
+        rate_shaper.report()
+        if args.profile:
+            tracer.save(args.profile)
+            print(Fore.CYAN + f"Trace written to {args.profile}")
         
 def main():
     """Entry point of the script, handles high-level exception management."""
+    freeze_support()
     try:
         handle()
     except Exception:
         print(Fore.RED + "\nInterrupted.")
 
-async def main_async(shutdown_event):
+async def main_async(
+    shutdown_event, sync_state=None, work_queue=None, sink=None, shard_outputs=False
+):
     """Asynchronous main function."""
-    user_input = await get_user_input()
-    await download_media(user_input, shutdown_event)
+    lag_sampler = create_task(sample_event_loop_lag()) if tracer.enabled else None
+    try:
+        user_input = await get_user_input()
+        await download_media(
+            user_input, shutdown_event, sync_state, work_queue, sink, shard_outputs
+        )
+    finally:
+        if lag_sampler:
+            lag_sampler.cancel()
@@ -0,0 +1,745 @@
+"""
+Benchmarks for the download pipeline, driven end to end against a local fake
+media server so they run without network access.
+
+    python -m eagle_downloader.tests.benchmark [--update-baseline]
+
+`make benchmark` runs this comparison against benchmark_baseline.json. The
+pytest entry points that time the pipeline or compare it with the baseline
+only run when EAGLE_BENCHMARK=1 is set, so a plain test run never depends on
+the speed of the machine.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import threading
+import pytest
+from time import perf_counter, sleep
+from argparse import ArgumentParser, BooleanOptionalAction
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from statistics import mean
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, patch
+from tqdm import tqdm
+from eagle_downloader import main
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+BASELINE_FILE = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "benchmark_baseline.json"
+)
+TOLERANCE = 0.3
+CHUNK_SIZE = 16 * 1024
+HOOK_CALLS = 20000
+HOOK_THREADS = 4
+
+SCENARIOS = {
+    "progressive": {
+        "kind": "progressive",
+        "entries": 8,
+        "concurrency": 4,
+        "latency": 0.02,
+        "bandwidth": 4 * 1024 * 1024,
+    },
+    "large": {
+        "kind": "progressive",
+        "entries": 1,
+        "concurrency": 1,
+        "latency": 0.02,
+        "bandwidth": 4 * 1024 * 1024,
+        "media_size": 16 * 1024 * 1024,
+    },
+    "processes": {
+        "kind": "progressive",
+        "entries": 8,
+        "concurrency": 4,
+        "latency": 0.02,
+        "bandwidth": 4 * 1024 * 1024,
+        "processes": 4,
+    },
+    "async-transfers": {
+        "kind": "hls",
+        "entries": 24,
+        "concurrency": 24,
+        "latency": 0.02,
+        "bandwidth": 256 * 1024,
+        "metadata_rate": 0,
+        "async_transfers": True,
+    },
+    "hls": {
+        "kind": "hls",
+        "entries": 6,
+        "concurrency": 3,
+        "latency": 0.02,
+        "bandwidth": 4 * 1024 * 1024,
+    },
+    "dash": {
+        "kind": "dash",
+        "entries": 6,
+        "concurrency": 3,
+        "latency": 0.02,
+        "bandwidth": 4 * 1024 * 1024,
+    },
+    "playlist": {
+        "kind": "playlist",
+        "entries": 6,
+        "concurrency": 3,
+        "latency": 0.02,
+        "bandwidth": 4 * 1024 * 1024,
+    },
+}
+
+
+class FakeMediaHandler(BaseHTTPRequestHandler):
+    """Serves synthetic progressive files, HLS/DASH manifests and RSS playlists."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.route(send_body=False)
+
+    def do_GET(self):
+        self.route(send_body=True)
+
+    def route(self, send_body):
+        server = self.server
+        sleep(server.latency)
+        request_path = self.path.split("?")[0].split("#")[0]
+        name = request_path.rsplit("/", 1)[-1]
+        base = request_path.rsplit("/", 1)[0]
+        if request_path.startswith("/media/"):
+            self.send_media(server.media_size, "video/mp4", send_body)
+        elif name == "master.m3u8":
+            body = server.hls_master(base)
+            self.send_bytes(body, "application/vnd.apple.mpegurl", send_body)
+        elif name == "index.m3u8":
+            body = server.hls_media()
+            self.send_bytes(body, "application/vnd.apple.mpegurl", send_body)
+        elif name == "manifest.mpd":
+            self.send_bytes(server.dash_manifest(), "application/dash+xml", send_body)
+        elif name == "split.mpd":
+            body = server.dash_split_manifest()
+            self.send_bytes(body, "application/dash+xml", send_body)
+        elif name.endswith((".ts", ".m4s", "init.mp4")):
+            self.send_media(server.segment_size, "video/mp2t", send_body)
+        elif name == "feed.xml":
+            body = server.rss_feed(self.headers.get("Host"))
+            self.send_bytes(body, "application/rss+xml", send_body)
+        else:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def send_bytes(self, body, content_type, send_body):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_media(self, size, content_type, send_body):
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if send_body:
+            self.stream(end - start + 1)
+
+    def stream(self, length):
+        """Writes `length` synthetic bytes, throttled to the server bandwidth."""
+        chunk = b"\0" * CHUNK_SIZE
+        bandwidth = self.server.bandwidth
+        while length > 0:
+            data = chunk[: min(length, CHUNK_SIZE)]
+            started = perf_counter()
+            self.wfile.write(data)
+            length -= len(data)
+            if bandwidth:
+                remaining = len(data) / bandwidth - (perf_counter() - started)
+                if remaining > 0:
+                    sleep(remaining)
+
+
+class FakeMediaServer(ThreadingHTTPServer):
+    """Local HTTP server with configurable per-request latency and per-connection bandwidth."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        latency=0.0,
+        bandwidth=None,
+        media_size=512 * 1024,
+        segments=6,
+        segment_size=64 * 1024,
+        playlist_size=6,
+    ):
+        super().__init__(("127.0.0.1", 0), FakeMediaHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.media_size = media_size
+        self.segments = segments
+        self.segment_size = segment_size
+        self.playlist_size = playlist_size
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+    def url(self, request_path):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{request_path}"
+
+    def hls_master(self, base):
+        return (
+            "#EXTM3U\n"
+            "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=1280x720,"
+            'CODECS="avc1.4d401f,mp4a.40.2"\n'
+            f"{base}/index.m3u8\n"
+        ).encode()
+
+    def hls_media(self):
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-TARGETDURATION:2",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for index in range(self.segments):
+            lines += ["#EXTINF:2.0,", f"seg{index}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines).encode()
+
+    def dash_manifest(self):
+        duration = self.segments * 2
+        return (
+            '<?xml version="1.0"?>'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" '
+            f'mediaPresentationDuration="PT{duration}S" minBufferTime="PT2S" '
+            'profiles="urn:mpeg:dash:profile:isoff-on-demand:2011"><Period>'
+            '<AdaptationSet mimeType="video/mp4">'
+            '<Representation id="v1" bandwidth="800000" width="1280" height="720" '
+            'codecs="avc1.4d401f,mp4a.40.2">'
+            '<SegmentTemplate media="seg$Number$.m4s" initialization="init.mp4" '
+            'startNumber="0" duration="2" timescale="1"/>'
+            "</Representation></AdaptationSet></Period></MPD>"
+        ).encode()
+
+    def dash_split_manifest(self):
+        """DASH manifest with separate video and audio streams, which yt-dlp merges."""
+        duration = self.segments * 2
+        sets = (
+            (
+                "video/mp4",
+                'id="video" bandwidth="700000" width="1280" height="720" '
+                'codecs="avc1.4d401f"',
+                "v",
+            ),
+            ("audio/mp4", 'id="audio" bandwidth="128000" codecs="mp4a.40.2"', "a"),
+        )
+        adaptation_sets = "".join(
+            f'<AdaptationSet mimeType="{mime_type}"><Representation {attributes}>'
+            f'<SegmentTemplate media="{prefix}$Number$.m4s" '
+            f'initialization="{prefix}init.mp4" startNumber="0" duration="2" '
+            'timescale="1"/></Representation></AdaptationSet>'
+            for mime_type, attributes, prefix in sets
+        )
+        return (
+            '<?xml version="1.0"?>'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" '
+            f'mediaPresentationDuration="PT{duration}S" minBufferTime="PT2S" '
+            'profiles="urn:mpeg:dash:profile:isoff-on-demand:2011"><Period>'
+            f"{adaptation_sets}</Period></MPD>"
+        ).encode()
+
+    def rss_feed(self, host):
+        items = "".join(
+            f"<item><title>Video {index}</title>"
+            f"<link>http://{host}/hls/{index}/master.m3u8</link>"
+            f"<guid>video{index}</guid></item>"
+            for index in range(self.playlist_size)
+        )
+        return (
+            '<?xml version="1.0"?><rss version="2.0"><channel>'
+            f"<title>Synthetic playlist</title><link>http://{host}/</link>"
+            f"{items}</channel></rss>"
+        ).encode()
+
+
+class StageTimer:
+    """Collects per-stage latencies by wrapping pipeline functions."""
+
+    def __init__(self):
+        self.samples = {"extract": [], "rate_wait": [], "queue": [], "download": []}
+        self.queued_at = {}
+
+    def timed(self, stage, func):
+        async def wrapper(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.samples[stage].append(perf_counter() - started)
+
+        return wrapper
+
+    def queue_start(self, func):
+        async def wrapper(entry, *args, **kwargs):
+            self.queued_at[id(entry)] = perf_counter()
+            return await func(entry, *args, **kwargs)
+
+        return wrapper
+
+    def queue_end(self, func):
+        async def wrapper(entry, *args, **kwargs):
+            started = self.queued_at.pop(id(entry), None)
+            if started is not None:
+                self.samples["queue"].append(perf_counter() - started)
+            return await func(entry, *args, **kwargs)
+
+        return wrapper
+
+    @contextmanager
+    def instrument(self):
+        with patch.object(
+            main, "extract_info", self.timed("extract", main.extract_info)
+        ), patch.object(
+            main, "perform_download", self.timed("download", main.perform_download)
+        ), patch.object(
+            main,
+            "download_with_semaphore",
+            self.queue_start(main.download_with_semaphore),
+        ), patch.object(
+            main, "download_entry", self.queue_end(main.download_entry)
+        ), patch.object(
+            main.rate_shaper,
+            "acquire",
+            self.timed("rate_wait", main.rate_shaper.acquire),
+        ):
+            yield self
+
+    def summary(self):
+        report = {}
+        for stage, samples in self.samples.items():
+            if samples:
+                ordered = sorted(samples)
+                report[stage] = {
+                    "mean_ms": round(mean(ordered) * 1000, 2),
+                    "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))] * 1000, 2),
+                }
+        return report
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / scale, 1)
+
+
+def collect_outputs(output_path):
+    """Returns the completed files written by a run and their total size."""
+    files = []
+    for root, _, names in os.walk(output_path):
+        files += [
+            os.path.join(root, name) for name in names if not main.is_partial_file(name)
+        ]
+    return len(files), sum(os.path.getsize(name) for name in files)
+
+
+def build_entries(server, kind, count):
+    """Builds synthetic playlist entries for the given media kind."""
+    paths = {
+        "progressive": "/media/{index}.mp4",
+        "hls": "/hls/{index}/master.m3u8",
+        "dash": "/dash/{index}/manifest.mpd",
+    }
+    return [
+        {
+            "id": f"{kind}{index}",
+            "title": f"{kind.upper()} {index}",
+            "webpage_url": server.url(paths[kind].format(index=index)),
+        }
+        for index in range(count)
+    ]
+
+
+def build_ydl_options(output_path, kind):
+    """Builds the yt-dlp options used by a benchmark scenario."""
+    if kind == "progressive":
+        ydl_opts = main.get_ydl_options(output_path, None, "other", None, None)
+    else:
+        ydl_opts = main.get_ydl_options(output_path, None, "video", None, "1080")
+    ydl_opts.update({"noprogress": True, "fixup": "never", "quiet": True})
+    return ydl_opts
+
+
+@contextmanager
+def download_processes(count):
+    """Runs the pipeline in `count` worker processes, or in threads when 0."""
+    if not count:
+        yield
+        return
+    processes = main.DownloadProcesses()
+    processes.start(count)
+    try:
+        with patch.object(main, "download_processes", processes):
+            yield
+    finally:
+        processes.stop()
+
+
+@contextmanager
+def transfer_engine(enabled):
+    """Moves media bytes on the event loop while the scenario runs."""
+    engine = main.TransferEngine()
+    engine.enabled = bool(enabled)
+    with patch.object(main, "transfer_engine", engine):
+        yield
+
+
+async def drive_pipeline(server, config, output_path):
+    """Runs one scenario through process_entries or download_media."""
+    kind = config["kind"]
+    if kind != "playlist":
+        entries = build_entries(server, kind, config["entries"])
+        ydl_opts = build_ydl_options(output_path, kind)
+        await main.process_entries(
+            entries, ydl_opts, config["concurrency"], asyncio.Event()
+        )
+        return
+    user_options = {
+        "output_dir": output_path,
+        "rate_limit": None,
+        "download_type": "video",
+        "video_output_dir": None,
+        "audio_quality": None,
+        "video_quality": "1080",
+        "outputs": [],
+        "max_concurrent": config["concurrency"],
+    }
+    original_prepare = main.prepare_ydl_options
+
+    def prepare(options, cookies_file=None):
+        ydl_opts = original_prepare(options, cookies_file)
+        ydl_opts.update({"noprogress": True, "fixup": "never"})
+        return ydl_opts
+
+    with patch.object(
+        main, "gather_user_options", AsyncMock(return_value=user_options)
+    ), patch.object(main, "prepare_ydl_options", prepare):
+        await main.download_media(
+            {"url": server.url("/feed.xml"), "cookies_file": None}, asyncio.Event()
+        )
+
+
+async def run_scenario(name, output_path, overrides=None, verbose=False):
+    """Runs a scenario and returns its throughput, memory and latency metrics."""
+    config = {**SCENARIOS[name], **(overrides or {})}
+    timer = StageTimer()
+    with open(os.devnull, "w") as devnull, FakeMediaServer(
+        latency=config["latency"],
+        bandwidth=config["bandwidth"],
+        media_size=config.get("media_size", 512 * 1024),
+        playlist_size=config["entries"],
+    ) as server, timer.instrument(), download_processes(
+        config.get("processes")
+    ), transfer_engine(
+        config.get("async_transfers")
+    ), patch.object(
+        main.rate_shaper, "rate", config.get("metadata_rate", main.rate_shaper.rate)
+    ):
+        output = sys.stdout if verbose else devnull
+        with redirect_stdout(output), redirect_stderr(output), patch.object(
+            main, "stdout", output
+        ):
+            started = perf_counter()
+            await drive_pipeline(server, config, output_path)
+            elapsed = perf_counter() - started
+    completed, total_bytes = collect_outputs(output_path)
+    return {
+        "entries": completed,
+        "expected_entries": config["entries"],
+        "seconds": round(elapsed, 3),
+        "entries_per_sec": round(completed / elapsed, 3),
+        "bytes_per_sec": round(total_bytes / elapsed),
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": timer.summary(),
+    }
+
+
+def check_regressions(results, baseline, tolerance=TOLERANCE):
+    """Compares results with the baseline and returns a list of regressions."""
+    regressions = []
+    for name, result in results.items():
+        if result["entries"] < result["expected_entries"]:
+            regressions.append(
+                f"{name}: only {result['entries']}/{result['expected_entries']} completed"
+            )
+        expected = baseline.get(name)
+        if not expected:
+            continue
+        for metric in ("entries_per_sec", "bytes_per_sec"):
+            floor = expected[metric] * (1 - tolerance)
+            if result[metric] < floor:
+                regressions.append(
+                    f"{name}: {metric} {result[metric]} is below {floor:.3f}"
+                )
+        if expected.get("peak_rss_mb") and result["peak_rss_mb"]:
+            ceiling = expected["peak_rss_mb"] * (1 + tolerance)
+            if result["peak_rss_mb"] > ceiling:
+                regressions.append(
+                    f"{name}: peak_rss_mb {result['peak_rss_mb']} is above {ceiling:.1f}"
+                )
+    return regressions
+
+
+def load_baseline(baseline_file=BASELINE_FILE):
+    if not os.path.isfile(baseline_file):
+        return {}
+    with open(baseline_file) as handle:
+        return json.load(handle)
+
+
+def save_baseline(results, baseline_file=BASELINE_FILE):
+    baseline = {
+        name: {
+            "entries_per_sec": result["entries_per_sec"],
+            "bytes_per_sec": result["bytes_per_sec"],
+            "peak_rss_mb": result["peak_rss_mb"],
+        }
+        for name, result in results.items()
+    }
+    with open(baseline_file, "w") as handle:
+        json.dump(baseline, handle, indent=2, sort_keys=True)
+        handle.write("\n")
+
+
+def print_report(results):
+    for name, result in results.items():
+        print(
+            f"{name:<12} {result['entries']}/{result['expected_entries']} entries "
+            f"in {result['seconds']}s | {result['entries_per_sec']} entries/s | "
+            f"{result['bytes_per_sec'] / 1024 / 1024:.2f} MiB/s | "
+            f"peak RSS {result['peak_rss_mb']} MiB"
+        )
+        for stage, latency in result["stages"].items():
+            print(
+                f"{'':<12} {stage:<9} mean {latency['mean_ms']} ms, "
+                f"p95 {latency['p95_ms']} ms"
+            )
+
+
+def legacy_progress_hook(d, progress):
+    """The per-chunk hook used before rendering moved to the event loop."""
+    if d["status"] == "downloading":
+        total_bytes = d.get("total_bytes") or d.get("total_bytes_estimate") or 1
+        downloaded_bytes = d.get("downloaded_bytes", 0)
+        progress.n = downloaded_bytes / total_bytes * 100
+        progress.refresh()
+
+
+def time_hook_calls(hook, target, calls):
+    d = {"status": "downloading", "downloaded_bytes": 0, "total_bytes": calls}
+    for index in range(calls):
+        d["downloaded_bytes"] = index
+        hook(d, target)
+
+
+def measure_progress_hooks(calls=HOOK_CALLS, threads=HOOK_THREADS):
+    """Measures the per-chunk cost of the progress hook with `threads` concurrent downloads.
+
+    Returns the wall-clock nanoseconds per hook call for the legacy hook, which
+    renders a tqdm bar on every chunk, and for the current counter-only hook.
+    """
+    report = {}
+    with open(os.devnull, "w") as devnull:
+        candidates = {
+            "legacy_ns": (
+                legacy_progress_hook,
+                lambda: tqdm(total=100, file=devnull, ncols=100),
+            ),
+            "current_ns": (main.progress_hook, main.ProgressCounter),
+        }
+        for name, (hook, make_target) in candidates.items():
+            targets = [make_target() for _ in range(threads)]
+            with ThreadPoolExecutor(threads) as executor:
+                started = perf_counter()
+                list(
+                    executor.map(
+                        lambda target: time_hook_calls(hook, target, calls), targets
+                    )
+                )
+                elapsed = perf_counter() - started
+            report[name] = round(elapsed / (calls * threads) * 1e9)
+            for target in targets:
+                if hasattr(target, "close"):
+                    target.close()
+    return report
+
+
+def run_in_process(name, overrides=None, verbose=False):
+    with TemporaryDirectory() as output_path:
+        return asyncio.run(run_scenario(name, output_path, overrides, verbose))
+
+
+def run_benchmarks(names, overrides=None, verbose=False):
+    """Runs every scenario in a fresh interpreter.
+
+    `ru_maxrss` only grows, so scenarios sharing a process would each report the
+    highest peak of the ones before them.
+    """
+    results = {}
+    for name in names:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            results[name] = pool.submit(
+                run_in_process, name, overrides, verbose
+            ).result()
+    return results
+
+
+def parse_arguments(argv=None):
+    parser = ArgumentParser(description="Eagle Downloader pipeline benchmarks.")
+    parser.add_argument(
+        "scenarios", nargs="*", help=f"Scenarios to run: {', '.join(SCENARIOS)}."
+    )
+    parser.add_argument("--latency", type=float, help="Per-request latency in seconds.")
+    parser.add_argument("--bandwidth", type=int, help="Per-connection bytes/second.")
+    parser.add_argument("--concurrency", type=int, help="Max concurrent downloads.")
+    parser.add_argument(
+        "--processes", type=int, help="Worker processes (0 runs in threads)."
+    )
+    parser.add_argument(
+        "--async-transfers",
+        action=BooleanOptionalAction,
+        help="Move media bytes on the event loop instead of in threads.",
+    )
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the pipeline's own output."
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Record the results as the new baseline instead of comparing.",
+    )
+    args = parser.parse_args(argv)
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def run(argv=None):
+    args = parse_arguments(argv)
+    overrides = {
+        key: value
+        for key, value in (
+            ("latency", args.latency),
+            ("bandwidth", args.bandwidth),
+            ("concurrency", args.concurrency),
+            ("processes", args.processes),
+            ("async_transfers", args.async_transfers),
+        )
+        if value is not None
+    }
+    results = run_benchmarks(args.scenarios or list(SCENARIOS), overrides, args.verbose)
+    print_report(results)
+    hooks = measure_progress_hooks()
+    print(
+        f"{'hooks':<12} progress hook per chunk: legacy {hooks['legacy_ns']} ns, "
+        f"current {hooks['current_ns']} ns ({HOOK_THREADS} threads)"
+    )
+    if args.update_baseline:
+        save_baseline(results)
+        print(f"Baseline written to {BASELINE_FILE}")
+        return 0
+    regressions = check_regressions(results, load_baseline(), args.tolerance)
+    if hooks["current_ns"] >= hooks["legacy_ns"]:
+        regressions.append("hooks: progress hook is not cheaper than the legacy hook")
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+benchmark = pytest.mark.skipif(
+    not os.environ.get("EAGLE_BENCHMARK"), reason="set EAGLE_BENCHMARK=1 to run"
+)
+
+
+def test_check_regressions():
+    result = {
+        "entries": 4,
+        "expected_entries": 4,
+        "entries_per_sec": 5.0,
+        "bytes_per_sec": 500,
+        "peak_rss_mb": 90.0,
+    }
+    baseline = {
+        "hls": {"entries_per_sec": 10.0, "bytes_per_sec": 600, "peak_rss_mb": 50}
+    }
+    regressions = check_regressions({"hls": result}, baseline)
+    assert len(regressions) == 2
+    assert "entries_per_sec" in regressions[0]
+    assert "peak_rss_mb" in regressions[1]
+    assert check_regressions({"dash": result}, baseline) == []
+
+
+def test_fake_media_server_ranges():
+    with FakeMediaServer(media_size=1000) as server:
+        from urllib.request import Request, urlopen
+
+        request = Request(
+            server.url("/media/1.mp4"), headers={"Range": "bytes=100-199"}
+        )
+        with urlopen(request) as response:
+            assert response.status == 206
+            assert len(response.read()) == 100
+
+
+@benchmark
+@pytest.mark.parametrize("name", list(SCENARIOS))
+def test_benchmark(name):
+    results = run_benchmarks([name])
+    print_report(results)
+    assert check_regressions(results, load_baseline()) == []
+
+
+@benchmark
+def test_progress_hook_overhead():
+    hooks = measure_progress_hooks()
+    assert hooks["current_ns"] < hooks["legacy_ns"]
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -1,6 +1,9 @@
 import os
 import re
 import sys
+import json
+import hashlib
+import threading
 from colorama import Fore
 import pytest
 import asyncio
@@ -12,6 +15,7 @@ from eagle_downloader.main import (
     get_audio_quality,
     get_video_quality,
     get_output_directory,
+    get_save_thumbnail,
     get_video_output_directory,
     get_rate_limit,
     parse_rate_limit,
@@ -23,6 +27,20 @@ from eagle_downloader.main import (
     initialize_ydl_options,
     get_format_string,
     get_postprocessors,
+    is_mp4_compatible,
+    get_derived_outputs,
+    split_local_postprocessors,
+    build_derive_command,
+    derive_outputs,
+    get_output_file,
+    estimate_format_size,
+    pick_audio_format,
+    pick_video_formats,
+    plan_entry_format,
+    plan_formats,
+    apply_format_plan,
+    EntryRecord,
+    compact_entries,
     download_entry,
     is_valid_entry,
     update_output_template,
@@ -30,8 +48,49 @@ from eagle_downloader.main import (
     progress_hook,
     update_progress_bar,
     complete_progress_bar,
+    ProgressCounter,
+    ProgressBoard,
+    plan_segments,
+    parse_content_range,
+    SegmentedHttpFD,
+    SegmentedYoutubeDL,
+    append_file,
+    TransferEngine,
+    open_http,
+    Drain,
+    BandwidthLimiter,
+    BandwidthHook,
+    DownloadSlots,
+    Schedule,
+    parse_schedule,
+    download_abort,
+    AsyncHttpResponse,
+    parse_media_playlist,
+    FileSink,
+    Sink,
+    open_sink,
+    build_sink_command,
     perform_download,
+    run_download,
+    RateShaper,
+    ProgressForwarder,
+    run_in_process,
+    DownloadProcesses,
     process_entries,
+    is_partial_file,
+    remove_partial_files,
+    cleanup_failed_download,
+    sweep_partial_files,
+    PartialSweep,
+    get_output_shard,
+    OutputPlanner,
+    get_output_extensions,
+    estimate_download_size,
+    DiskAdmission,
+    expected_file_size,
+    find_duration_problems,
+    hash_file,
+    Verifier,
     create_download_tasks,
     download_with_semaphore,
     determine_if_playlist,
@@ -39,13 +98,28 @@ from eagle_downloader.main import (
     prepare_ydl_options,
     show_spinner,
     extract_info,
+    extract_entry_info,
+    extract_new_entries,
+    SyncState,
+    SqliteWorkQueue,
+    WorkQueue,
+    open_work_queue,
+    QueueWorker,
     handle_playlist,
+    perform_downloads,
     download_media,
     shutdown,
     brand,
     parse_arguments,
+    Tracer,
+    sample_event_loop_lag,
     __version__,
 )
+from eagle_downloader import CompletedEvent, Downloader, FailedEvent, ProgressEvent
+from eagle_downloader.tests.benchmark import FakeMediaServer
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+from yt_dlp.postprocessor import FFmpegMergerPP
 
 
 def test_brand(capsys):
@@ -84,6 +158,109 @@ def test_parse_arguments_with_version(args, expected, capsys):
     assert expected in captured.out
 
 
+def test_parse_arguments_profile():
+    with patch.object(sys, "argv", ["main.py", "--profile"]):
+        assert parse_arguments().profile == "eagle-trace.json"
+    with patch.object(sys, "argv", ["main.py", "--profile", "run.json"]):
+        assert parse_arguments().profile == "run.json"
+    with patch.object(sys, "argv", ["main.py"]):
+        assert parse_arguments().profile is None
+
+
+def test_parse_arguments_queue():
+    with patch.object(sys, "argv", ["main.py", "--worker", "jobs.db"]):
+        args = parse_arguments()
+    assert args.worker == "jobs.db"
+    assert args.coordinator is None
+    assert args.concurrency == 5
+
+
+def test_parse_arguments_processes():
+    with patch.object(sys, "argv", ["main.py", "--processes", "4"]):
+        assert parse_arguments().processes == 4
+    with patch.object(sys, "argv", ["main.py"]):
+        assert parse_arguments().processes == 0
+
+
+def test_parse_arguments_metadata_rate():
+    with patch.object(sys, "argv", ["main.py", "--metadata-rate", "0.5"]):
+        args = parse_arguments()
+    assert args.metadata_rate == 0.5
+    assert args.metadata_burst == 5
+
+
+def test_parse_arguments_schedule():
+    with patch.object(sys, "argv", ["main.py", "--schedule", "08:00-18:00=1M/2"]):
+        assert parse_arguments().schedule == "08:00-18:00=1M/2"
+
+
+def test_parse_arguments_sweep_partials():
+    with patch.object(sys, "argv", ["main.py", "--sweep-partials"]):
+        assert parse_arguments().sweep_partials == 24
+    with patch.object(sys, "argv", ["main.py", "--sweep-partials", "72"]):
+        assert parse_arguments().sweep_partials == 72
+    with patch.object(sys, "argv", ["main.py"]):
+        assert parse_arguments().sweep_partials is None
+
+
+def test_parse_arguments_sync():
+    with patch.object(sys, "argv", ["main.py", "--sync"]):
+        assert parse_arguments().sync == "eagle-sync.json"
+    with patch.object(sys, "argv", ["main.py"]):
+        assert parse_arguments().sync is None
+
+
+def test_tracer_disabled():
+    tracer = Tracer()
+    func = Mock()
+    assert tracer.traced("work", func) is func
+    assert tracer.hook("hook", func) is func
+    with tracer.span("work"), tracer.async_span("work", 1):
+        pass
+    assert tracer.events == []
+
+
+def test_tracer_spans(tmp_path):
+    tracer = Tracer()
+    tracer.enable()
+    with tracer.span("work", url="http://example.com"):
+        pass
+    with tracer.async_span("download", 7):
+        pass
+    assert tracer.traced("yt-dlp.download", lambda: 42)() == 42
+    tracer.hook("progress_hook", lambda d: None)({"status": "downloading"})
+    tracer.postprocessor_hook({"status": "started", "postprocessor": "Merger"})
+    tracer.postprocessor_hook({"status": "finished", "postprocessor": "Merger"})
+    phases = [(e["name"], e["ph"]) for e in tracer.events if e["ph"] != "M"]
+    assert phases == [
+        ("work", "X"),
+        ("download", "b"),
+        ("download", "e"),
+        ("yt-dlp.download:queued", "X"),
+        ("yt-dlp.download", "X"),
+        ("progress_hook", "X"),
+        ("Merger", "X"),
+    ]
+    assert tracer.events[0]["ph"] == "M"
+    assert tracer.events[1]["args"] == {"url": "http://example.com"}
+    trace_file = tmp_path / "trace.json"
+    tracer.save(str(trace_file))
+    assert len(json.loads(trace_file.read_text())["traceEvents"]) == len(tracer.events)
+
+
+@pytest.mark.asyncio
+async def test_sample_event_loop_lag(mocker):
+    tracer = Tracer()
+    tracer.enable()
+    mocker.patch("eagle_downloader.main.tracer", tracer)
+    sampler = asyncio.create_task(sample_event_loop_lag(0.01))
+    await asyncio.sleep(0.05)
+    sampler.cancel()
+    counters = [e for e in tracer.events if e["ph"] == "C"]
+    assert counters
+    assert counters[0]["args"]["lag_ms"] >= 0
+
+
 def test_create_output_directory(tmp_path):
     dir_name = tmp_path / "downloads"
     output_path = create_output_directory(str(dir_name))
@@ -147,6 +324,16 @@ async def test_get_output_directory(mocker):
     assert result == "my_downloads"
 
 
+@pytest.mark.asyncio
+async def test_get_save_thumbnail(mocker):
+    mocker.patch(
+        "questionary.confirm",
+        return_value=AsyncMock(ask_async=AsyncMock(return_value=True)),
+    )
+    result = await get_save_thumbnail()
+    assert result is True
+
+
 @pytest.mark.asyncio
 async def test_get_video_output_directory_yes(mocker):
     mocker.patch(
@@ -285,6 +472,7 @@ def test_get_ydl_options(tmp_path):
     assert ydl_opts["format"] == "bestaudio/best"
     assert ydl_opts["postprocessors"][0]["preferredquality"] == "192"
     assert ydl_opts["ratelimit"] == 1024
+    assert ydl_opts["format_planning"]["download_type"] == "audio"
     assert ydl_opts["cookiefile"] == "cookies.txt"
 
 
@@ -323,11 +511,198 @@ def test_get_postprocessors():
     assert video_pps == []
 
 
+def test_get_postprocessors_remux():
+    plan = {"vcodec": "avc1.64001F", "acodec": "mp4a.40.2"}
+    assert get_postprocessors("both", "256", plan)[0]["key"] == "FFmpegVideoRemuxer"
+    plan = {"vcodec": "vp9", "acodec": "opus"}
+    assert get_postprocessors("both", "256", plan)[0]["key"] == "FFmpegVideoConvertor"
+    plan = {"vcodec": "avc1.64001F", "acodec": "mp4a.40.2", "merge": True}
+    assert get_postprocessors("both", "256", plan)[0]["key"] == "FFmpegVideoConvertor"
+
+
+def test_get_postprocessors_derived_outputs():
+    both_pps = get_postprocessors("both", "192", outputs=["mp3", "thumbnail"])
+    assert both_pps[1] == {
+        "key": "DeriveOutputs",
+        "outputs": ["mp3", "thumbnail"],
+        "audio_quality": "192",
+    }
+    video_pps = get_postprocessors("video", None, outputs=["thumbnail"])
+    assert [pp["key"] for pp in video_pps] == ["DeriveOutputs"]
+
+
+def test_get_derived_outputs():
+    assert get_derived_outputs("both") == ["mp3"]
+    assert get_derived_outputs("both", thumbnail=True) == ["mp3", "thumbnail"]
+    assert get_derived_outputs("video", thumbnail=True) == ["thumbnail"]
+    assert get_derived_outputs("audio", thumbnail=True) == []
+
+
+def test_split_local_postprocessors():
+    ydl_opts = {"postprocessors": get_postprocessors("both", "192", outputs=["mp3"])}
+    yt_dlp_opts, local = split_local_postprocessors(ydl_opts)
+    assert [pp["key"] for pp in yt_dlp_opts["postprocessors"]] == ["FFmpegVideoConvertor"]
+    assert [pp["key"] for pp in local] == ["DeriveOutputs"]
+    assert len(ydl_opts["postprocessors"]) == 2
+    assert split_local_postprocessors({}) == ({}, [])
+
+
+def test_build_derive_command():
+    command = build_derive_command("ffmpeg", "/tmp/video.mp4", "mp3", "192")
+    assert command[-1] == "/tmp/video.mp3"
+    assert "192k" in command
+    command = build_derive_command("ffmpeg", "/tmp/video.mp4", "thumbnail")
+    assert command[-1] == "/tmp/video.jpg"
+    assert command.index("-ss") < command.index("-i")
+
+
+@pytest.mark.asyncio
+async def test_derive_outputs(mocker, capsys):
+    mocker.patch("eagle_downloader.main.which", return_value="ffmpeg")
+    mock_run_command = mocker.patch(
+        "eagle_downloader.main.run_command", AsyncMock(side_effect=[(0, ""), (1, "boom")])
+    )
+    derived = await derive_outputs("/tmp/video.mp4", ["mp3", "thumbnail"], "192")
+    assert derived == ["/tmp/video.mp3"]
+    assert mock_run_command.await_count == 2
+    out, err = capsys.readouterr()
+    assert "Error deriving /tmp/video.jpg: boom" in out
+
+
+@pytest.mark.asyncio
+async def test_derive_outputs_without_ffmpeg(mocker, capsys):
+    mocker.patch("eagle_downloader.main.which", return_value=None)
+    assert await derive_outputs("/tmp/video.mp4", ["mp3"]) == []
+    out, err = capsys.readouterr()
+    assert "ffmpeg not found" in out
+
+
+def test_get_output_file():
+    ydl = Mock()
+    ydl.prepare_filename.return_value = "video.webm"
+    info = {"requested_downloads": [{"filepath": "video.mp4"}]}
+    assert get_output_file(ydl, info) == "video.mp4"
+    assert get_output_file(ydl, {"id": "1"}) == "video.webm"
+
+
+def test_is_mp4_compatible():
+    assert is_mp4_compatible("avc1.4d401e", "mp4a.40.2") is True
+    assert is_mp4_compatible("none", "mp3") is True
+    assert is_mp4_compatible("avc1", "opus") is False
+    assert is_mp4_compatible("vp9", "none") is False
+
+
+FORMATS = [
+    {"format_id": "140", "vcodec": "none", "acodec": "mp4a.40.2", "abr": 128, "filesize": 3000},
+    {"format_id": "251", "vcodec": "none", "acodec": "opus", "abr": 160, "filesize": 3500},
+    {"format_id": "250", "vcodec": "none", "acodec": "opus", "abr": 64, "filesize": 1500},
+    {"format_id": "18", "vcodec": "avc1", "acodec": "mp4a.40.2", "height": 360,
+     "filesize": 9000},
+    {"format_id": "136", "vcodec": "avc1", "acodec": "none", "height": 720, "filesize": 20000},
+    {"format_id": "247", "vcodec": "vp9", "acodec": "none", "height": 720, "filesize": 15000},
+    {"format_id": "137", "vcodec": "avc1", "acodec": "none", "height": 1080, "filesize": 40000},
+]
+
+
+def test_estimate_format_size():
+    assert estimate_format_size({"filesize_approx": 1000}) == 1000
+    assert estimate_format_size({"tbr": 8}, duration=10) == 10000
+    assert estimate_format_size({}) is None
+
+
+def test_pick_audio_format():
+    assert pick_audio_format(FORMATS, "128")["format_id"] == "140"
+    assert pick_audio_format(FORMATS)["format_id"] == "251"
+    assert pick_audio_format(FORMATS, "320")["format_id"] == "251"
+    assert pick_audio_format(FORMATS[3:]) is None
+
+
+def test_pick_video_formats():
+    selected = pick_video_formats(FORMATS, "720")
+    assert [f["format_id"] for f in selected] == ["247", "251"]
+    selected = pick_video_formats(FORMATS, "480")
+    assert [f["format_id"] for f in selected] == ["18"]
+    assert pick_video_formats(FORMATS, "144") is None
+
+
+def test_plan_entry_format():
+    plan = plan_entry_format({"formats": FORMATS}, "both", "1080")
+    assert plan["format_id"] == "137+251"
+    assert plan["vcodec"] == "avc1"
+    assert plan["acodec"] == "opus"
+    assert plan["filesize"] == 43500
+    assert plan["merge"] is True
+    assert plan["postprocessors"][0]["key"] == "FFmpegVideoConvertor"
+    assert "postprocessor_args" not in plan
+    assert plan_entry_format({"formats": FORMATS}, "audio", None, "128")["merge"] is False
+    assert plan_entry_format({"id": "abc"}, "video", "720") is None
+
+
+def test_plan_entry_format_single_file():
+    flv = {"format_id": "5", "vcodec": "h264", "acodec": "aac", "height": 1080, "ext": "flv"}
+    plan = plan_entry_format({"formats": [flv]}, "both", "1080")
+    assert plan["merge"] is False
+    assert plan["postprocessors"][0]["key"] == "FFmpegVideoRemuxer"
+    mkv = {**flv, "acodec": "opus", "ext": "mkv"}
+    plan = plan_entry_format({"formats": [mkv]}, "both", "1080", "192")
+    assert plan["postprocessors"][0]["key"] == "FFmpegVideoConvertor"
+    args = plan["postprocessor_args"]["videoconvertor+ffmpeg_o"]
+    assert args == ["-c:v", "copy", "-c:a", "aac", "-b:a", "192k"]
+    assert apply_format_plan({}, plan)["postprocessor_args"] == plan["postprocessor_args"]
+    webm = {**mkv, "vcodec": "vp8", "acodec": "vorbis", "ext": "webm"}
+    plan = plan_entry_format({"formats": [webm]}, "both", "1080")
+    assert plan["postprocessors"][0]["key"] == "FFmpegVideoConvertor"
+    assert "postprocessor_args" not in plan
+
+
+def test_plan_formats():
+    entries = [{"id": "1", "formats": FORMATS}, {"id": "2"}, None]
+    assert plan_formats(entries, "video", "480") == 1
+    assert entries[0]["format_plan"]["format_id"] == "18"
+    assert "format_plan" not in entries[1]
+
+
 def test_is_valid_entry():
     valid_entry = {"webpage_url": "http://example.com", "title": "Test Video"}
     invalid_entry = {"webpage_url": "http://example.com"}
     assert is_valid_entry(valid_entry) is True
     assert is_valid_entry(invalid_entry) is False
+    assert is_valid_entry(EntryRecord("1", "http://example.com", "Test")) is True
+    assert is_valid_entry(EntryRecord("1", None, "Test")) is False
+
+
+def test_entry_record():
+    record = EntryRecord.from_info(
+        {"id": "1", "url": "http://example.com/1", "duration": 60, "filesize_approx": 5}
+    )
+    assert record["webpage_url"] == "http://example.com/1"
+    assert record["title"] == "1"
+    assert record.get("filesize_approx") == 5
+    assert record.get("format_plan") is None
+    assert "requested_formats" not in record
+    with pytest.raises(KeyError):
+        record["format_plan"]
+    assert not hasattr(record, "__dict__")
+
+
+def test_compact_entries():
+    entries = [
+        {"id": "1", "webpage_url": "http://example.com/1", "title": "One", "formats": []},
+        {"id": "2", "title": "No URL"},
+        None,
+    ]
+    records = compact_entries(entries)
+    assert len(records) == 1
+    assert records[0]["title"] == "One"
+
+
+def test_apply_format_plan():
+    ydl_opts = {"format": "best", "postprocessors": []}
+    plan = {"format_id": "18", "postprocessors": [{"key": "FFmpegVideoRemuxer"}]}
+    planned = apply_format_plan(ydl_opts, plan)
+    assert planned["format"] == "18"
+    assert planned["postprocessors"] == plan["postprocessors"]
+    assert ydl_opts["format"] == "best"
 
 
 def test_update_output_template():
@@ -342,20 +717,19 @@ def test_create_progress_bar():
 
 
 def test_progress_hook_downloading():
-    progress = Mock()
-    d = {"status": "downloading", "downloaded_bytes": 50, "total_bytes": 100}
-    progress_hook(d, progress)
-    assert progress.n == 50.0
-    progress.refresh.assert_called_once()
+    counter = ProgressCounter()
+    d = {"status": "downloading", "downloaded_bytes": 50, "total_bytes_estimate": 100}
+    progress_hook(d, counter)
+    assert counter.downloaded == 50
+    assert counter.total == 100
+    assert counter.finished is False
 
 
 def test_progress_hook_finished():
-    progress = Mock()
+    counter = ProgressCounter()
     d = {"status": "finished"}
-    progress_hook(d, progress)
-    assert progress.n == 100
-    progress.refresh.assert_called_once()
-    progress.close.assert_called_once()
+    progress_hook(d, counter)
+    assert counter.finished is True
 
 
 def test_determine_if_playlist():
@@ -458,15 +832,93 @@ async def test_download_entry_valid(mocker):
     mocker.patch("eagle_downloader.main.update_output_template", return_value="123_Test_Video.%(ext)s")
     mocker.patch("eagle_downloader.main.create_progress_bar", return_value=Mock())
     mock_perform_download = mocker.patch("eagle_downloader.main.perform_download", AsyncMock())
-    await download_entry(entry, {}, asyncio.Lock())
+    await download_entry(entry, {})
     mock_perform_download.assert_awaited_once()
 
 
+@pytest.mark.asyncio
+async def test_download_entry_planned(mocker):
+    entry = {
+        "webpage_url": "http://example.com",
+        "title": "Test Video",
+        "id": "123",
+        "format_plan": {"format_id": "137+140", "postprocessors": []},
+    }
+    ydl_opts = {"format": "best"}
+    mocker.patch("eagle_downloader.main.create_progress_bar", return_value=Mock())
+    mock_perform_download = mocker.patch("eagle_downloader.main.perform_download", AsyncMock())
+    await download_entry(entry, ydl_opts)
+    args, kwargs = mock_perform_download.await_args
+    assert args[1]["format"] == "137+140"
+    assert args[1]["postprocessors"] == []
+    assert kwargs["info"] is entry
+    assert ydl_opts == {"format": "best"}
+
+
+@pytest.mark.asyncio
+async def test_download_entry_already_downloaded(tmp_path, mocker, capsys):
+    (tmp_path / "123_Test Video.mp4").write_bytes(b"x")
+    planner = OutputPlanner(str(tmp_path))
+    planner.index()
+    entry = {"webpage_url": "http://example.com", "title": "Test Video", "id": "123"}
+    mock_perform_download = mocker.patch("eagle_downloader.main.perform_download", AsyncMock())
+    ydl_opts = {"output_planner": planner, "merge_output_format": "mp4"}
+    result = await download_entry(entry, ydl_opts)
+    mock_perform_download.assert_not_awaited()
+    assert result["requested_downloads"] == [{"filepath": str(tmp_path / "123_Test Video.mp4")}]
+    assert "Already downloaded" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "download_type, saved", [("audio", "123_Test Video.mp4"), ("video", "123_Test Video.mp3")]
+)
+async def test_download_entry_other_type_saved(tmp_path, mocker, download_type, saved):
+    (tmp_path / saved).write_bytes(b"x")
+    planner = OutputPlanner(str(tmp_path))
+    planner.index()
+    entry = {"webpage_url": "http://example.com", "title": "Test Video", "id": "123"}
+    mocker.patch("eagle_downloader.main.create_progress_bar", return_value=Mock())
+    mock_perform_download = mocker.patch(
+        "eagle_downloader.main.perform_download", AsyncMock(return_value=None)
+    )
+    ydl_opts = get_ydl_options(str(tmp_path), None, download_type, "192", "720")
+    await download_entry(entry, {**ydl_opts, "output_planner": planner})
+    mock_perform_download.assert_awaited_once()
+
+
+def test_get_output_extensions():
+    assert get_output_extensions(get_ydl_options(".", None, "audio", "192", None)) == ("mp3",)
+    assert get_output_extensions(get_ydl_options(".", None, "both", "192", "720")) == ("mp4",)
+    video_opts = get_ydl_options(".", None, "video", None, "720")
+    assert get_output_extensions(video_opts) == ("mp4",)
+    plan = {"merge": False, "ext": "webm"}
+    assert get_output_extensions({**video_opts, "postprocessors": []}, plan) == ("webm",)
+    assert get_output_extensions({"format": "best"}) == ()
+
+
+@pytest.mark.asyncio
+async def test_download_entry_planned_output(tmp_path, mocker):
+    planner = OutputPlanner(str(tmp_path), shard=True)
+    planner.index()
+    entry = {"webpage_url": "http://example.com", "title": "Test Video", "id": "123"}
+    mocker.patch("eagle_downloader.main.create_progress_bar", return_value=Mock())
+    mock_perform_download = mocker.patch(
+        "eagle_downloader.main.perform_download", AsyncMock(return_value=None)
+    )
+    await download_entry(entry, {"output_planner": planner})
+    ydl_opts = mock_perform_download.await_args.args[1]
+    assert ydl_opts["outtmpl"] == f"{get_output_shard('123')}/123_Test Video.%(ext)s"
+    assert ydl_opts["continuedl"] is False
+    assert "output_planner" not in ydl_opts
+    assert planner.reserved == {}
+
+
 @pytest.mark.asyncio
 async def test_download_entry_invalid(mocker, capfd):
     entry = {"webpage_url": "http://example.com"}
     mocker.patch("eagle_downloader.main.is_valid_entry", return_value=False)
-    await download_entry(entry, {}, asyncio.Lock())
+    await download_entry(entry, {})
     out, err = capfd.readouterr()
     combined_output = out + err
     ansi_escape = re.compile(r"\x1b\[[0-9;]*m")
@@ -476,12 +928,90 @@ async def test_download_entry_invalid(mocker, capfd):
     assert "Invalid entry detected. Skipping." in output_cleaned
 
 
-def test_update_progress_bar():
+def test_progress_board_complete():
+    board = ProgressBoard()
+    board.bars[1] = (Mock(), ProgressCounter())
     progress = Mock()
-    d = {"downloaded_bytes": 50, "total_bytes": 100}
-    update_progress_bar(d, progress)
+    board.bars[id(progress)] = (progress, ProgressCounter())
+    board.complete(progress)
+    assert board.bars[id(progress)][1].finished is True
+    assert board.bars[1][1].finished is False
+
+
+def test_progress_forwarder(mocker):
+    updates = mocker.patch("eagle_downloader.main.progress_updates")
+    forwarder = ProgressForwarder(7)
+    for downloaded in (0, 5, 10, 12, 100):
+        forwarder({"status": "downloading", "downloaded_bytes": downloaded, "total_bytes": 1000})
+    forwarder({"status": "finished", "downloaded_bytes": 1000, "total_bytes": 1000})
+    sent = [call.args[0] for call in updates.put.call_args_list]
+    assert sent == [
+        (7, "downloading", 0, 1000),
+        (7, "downloading", 10, 1000),
+        (7, "downloading", 100, 1000),
+        (7, "finished", 1000, 1000),
+    ]
+
+
+def test_run_in_process_returns_plain_info():
+    class Headers(dict):
+        pass
+
+    def func(url, ydl_opts):
+        info = {"id": "clip", "http_headers": Headers(accept="*/*")}
+        return {**info, "formats": ({"format_id": "18"},)}, "clip.mp4"
+
+    info, output_file = run_in_process(func, None, "https://example.com/clip", {})
+    assert type(info["http_headers"]) is dict
+    assert info["formats"] == [{"format_id": "18"}]
+    assert output_file == "clip.mp4"
+
+
+@pytest.mark.asyncio
+async def test_download_processes(mocker, tmp_path):
+    processes = DownloadProcesses()
+    processes.start(1)
+    mocker.patch("eagle_downloader.main.download_processes", processes)
+    ydl_opts = get_ydl_options(str(tmp_path), None, "other", None, None)
+    ydl_opts["quiet"] = True
+    try:
+        with FakeMediaServer(media_size=4096) as server:
+            entry = EntryRecord("clip", server.url("/media/clip.mp4"), "Clip")
+            info = await download_entry(entry, ydl_opts)
+    finally:
+        processes.stop()
+    assert info["id"] == "clip"
+    assert os.path.getsize(info["requested_downloads"][-1]["filepath"]) == 4096
+    assert not processes.enabled
+
+
+def test_update_progress_bar():
+    progress = Mock(n=0)
+    counter = ProgressCounter()
+    counter.downloaded, counter.total = 50, 100
+    update_progress_bar(counter, progress)
+    update_progress_bar(counter, progress)
     assert progress.n == 50.0
     progress.refresh.assert_called_once()
+    counter.finished = True
+    update_progress_bar(counter, progress)
+    assert progress.n == 100
+
+
+@pytest.mark.asyncio
+async def test_progress_board():
+    board = ProgressBoard(interval=0.01)
+    progress = Mock(n=0)
+    counter = board.track(progress)
+    counter.downloaded, counter.total = 25, 100
+    await asyncio.sleep(0.05)
+    assert progress.n == 25.0
+    counter.finished = True
+    board.finish(progress)
+    await asyncio.sleep(0.05)
+    assert progress.n == 100
+    progress.close.assert_called_once()
+    assert board.task.done()
 
 
 def test_complete_progress_bar():
@@ -492,6 +1022,252 @@ def test_complete_progress_bar():
     progress.close.assert_called_once()
 
 
+def test_plan_segments():
+    assert plan_segments(None, 4, 10) == []
+    assert plan_segments(15, 4, 10) == [(0, 14)]
+    assert plan_segments(100, 4, 10) == [(0, 24), (25, 49), (50, 74), (75, 99)]
+    assert plan_segments(101, 4, 10)[-1] == (78, 100)
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 0-0/1234") == 1234
+    assert parse_content_range("bytes 0-0/*") is None
+    assert parse_content_range(None) is None
+
+
+@pytest.mark.parametrize("min_size, ranges", [(64 * 1024, 4), (1024 * 1024, 0)])
+def test_segmented_download(mocker, tmp_path, min_size, ranges):
+    mocker.patch("eagle_downloader.main.SEGMENT_MIN_SIZE", min_size)
+    fetch_segment = mocker.spy(SegmentedHttpFD, "fetch_segment")
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True, "noprogress": True}
+    with FakeMediaServer(media_size=512 * 1024) as server:
+        with SegmentedYoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(server.url("/media/clip.mp4"), download=True)
+    assert os.path.getsize(info["requested_downloads"][-1]["filepath"]) == 512 * 1024
+    assert fetch_segment.call_count == ranges
+
+
+def test_segmented_download_resumes(mocker, tmp_path):
+    mocker.patch("eagle_downloader.main.SEGMENT_MIN_SIZE", 64 * 1024)
+    mocker.patch("eagle_downloader.main.SEGMENT_SAVE_INTERVAL", 0)
+    size = 512 * 1024
+
+    def stop_halfway(d):
+        if d["status"] == "downloading" and d["downloaded_bytes"] >= size // 2:
+            raise DownloadCancelled()
+
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True, "noprogress": True}
+    with FakeMediaServer(media_size=size) as server:
+        with pytest.raises(DownloadCancelled):
+            with SegmentedYoutubeDL({**ydl_opts, "progress_hooks": [stop_halfway]}) as ydl:
+                ydl.extract_info(server.url("/media/clip.mp4"), download=True)
+        assert sorted(os.listdir(tmp_path)) == ["clip.mp4.part", "clip.mp4.ytdl"]
+        open_range = mocker.spy(SegmentedHttpFD, "open_range")
+        with SegmentedYoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(server.url("/media/clip.mp4"), download=True)
+    assert os.path.getsize(info["requested_downloads"][-1]["filepath"]) == size
+    assert os.listdir(tmp_path) == ["clip.mp4"]
+    fetched = sum(end - start + 1 for (_, _, start, end), _ in open_range.call_args_list[1:])
+    assert fetched <= size // 2
+
+
+def test_parse_media_playlist():
+    playlist = (
+        "#EXTM3U\n#EXT-X-MAP:URI=\"init.mp4\"\n#EXTINF:4,\nseg0.m4s\n"
+        "#EXTINF:4,\nhttp://cdn/seg1.m4s\n#EXT-X-ENDLIST\n"
+    )
+    assert parse_media_playlist(playlist, "http://a/b/index.m3u8") == [
+        "http://a/b/init.mp4",
+        "http://a/b/seg0.m4s",
+        "http://cdn/seg1.m4s",
+    ]
+    assert parse_media_playlist(playlist.replace("#EXT-X-ENDLIST", ""), "http://a/") is None
+    encrypted = playlist.replace("#EXTM3U", '#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="k"')
+    assert parse_media_playlist(encrypted, "http://a/") is None
+
+
+@pytest.mark.asyncio
+async def test_async_http_response_chunked():
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"4\r\nabcd\r\n3;ext=1\r\nefg\r\n0\r\n\r\n")
+    reader.feed_eof()
+    response = AsyncHttpResponse(200, {"transfer-encoding": "chunked"}, reader, Mock())
+    assert await response.read_all() == b"abcdefg"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "request_path, size",
+    [
+        ("/media/clip.mp4", 300_000),
+        ("/hls/master.m3u8", 6 * 65536),
+        ("/dash/manifest.mpd", 7 * 65536),
+    ],
+)
+async def test_transfer_engine_download(mocker, tmp_path, request_path, size):
+    real_download = mocker.spy(SegmentedHttpFD, "real_download")
+    hook = Mock()
+    ydl_opts = {
+        "outtmpl": str(tmp_path / "%(id)s.%(ext)s"),
+        "quiet": True,
+        "fixup": "never",
+        "progress_hooks": [hook],
+    }
+    with FakeMediaServer(media_size=300_000) as server:
+        info, output = await TransferEngine().download(server.url(request_path), ydl_opts)
+    assert os.path.getsize(output) == size
+    assert os.listdir(tmp_path) == [os.path.basename(output)]
+    assert hook.call_args[0][0]["status"] == "finished"
+    real_download.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_transfer_engine_merges_split_formats(mocker, tmp_path):
+    def concatenate(self, input_paths, out_path, opts):
+        with open(out_path, "wb") as output:
+            for input_path in input_paths:
+                with open(input_path, "rb") as handle:
+                    output.write(handle.read())
+
+    mocker.patch.object(FFmpegMergerPP, "available", True)
+    mocker.patch.object(FFmpegMergerPP, "run_ffmpeg_multiple_files", concatenate)
+    real_download = mocker.spy(SegmentedHttpFD, "real_download")
+    ydl_opts = {
+        "outtmpl": str(tmp_path / "%(id)s.%(ext)s"),
+        "quiet": True,
+        "fixup": "never",
+        "format": "bestvideo+bestaudio",
+        "merge_output_format": "mp4",
+    }
+    with FakeMediaServer(segments=3, segment_size=1000) as server:
+        info, output = await TransferEngine().download(server.url("/dash/split.mpd"), ydl_opts)
+    assert [f["acodec"] for f in info["requested_formats"]] == ["none", "mp4a.40.2"]
+    assert output.endswith(".mp4")
+    assert os.path.getsize(output) == 2 * 4 * 1000
+    assert os.listdir(tmp_path) == [os.path.basename(output)]
+    real_download.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_transfer_engine_leaves_unsupported_formats_to_yt_dlp(mocker, tmp_path):
+    mocker.patch.object(TransferEngine, "resolve", AsyncMock(return_value=None))
+    transfer = mocker.patch.object(TransferEngine, "transfer", AsyncMock())
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True}
+    with FakeMediaServer(media_size=1024) as server:
+        info, output = await TransferEngine().download(server.url("/media/clip.mp4"), ydl_opts)
+    assert os.path.getsize(output) == 1024
+    transfer.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_transfer_engine_resumes_partial_file(mocker, tmp_path):
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True, "fixup": "never"}
+    with FakeMediaServer(media_size=300_000) as server:
+        info, output = await TransferEngine().download(server.url("/media/clip.mp4"), ydl_opts)
+        with open(output, "rb") as handle:
+            content = handle.read()
+        os.remove(output)
+        with open(output + ".part", "wb") as handle:
+            handle.write(content[:100_000])
+        opened = mocker.patch("eagle_downloader.main.open_http", wraps=open_http)
+        info, output = await TransferEngine().download(server.url("/media/clip.mp4"), ydl_opts)
+    assert opened.call_args.args[2] == 100_000
+    with open(output, "rb") as handle:
+        assert handle.read() == content
+
+
+def test_open_sink(mocker, tmp_path):
+    assert isinstance(open_sink(str(tmp_path / "out.mp4")), FileSink)
+    backend = mocker.patch.dict("eagle_downloader.main.SINK_BACKENDS", {"s3": Mock()})
+    open_sink("s3://bucket/key")
+    backend["s3"].assert_called_once_with("bucket/key")
+    with pytest.raises(ValueError):
+        open_sink("ftp://host/key")
+
+
+def test_build_sink_command():
+    video = {"url": "http://a/v", "vcodec": "avc1", "acodec": "none", "http_headers": {"X": "1"}}
+    audio = {"url": "http://a/a", "vcodec": "none", "acodec": "mp4a.40.2"}
+    command = build_sink_command("ffmpeg", [video, audio], [])
+    assert command[command.index("-headers") + 1] == "X: 1\r\n"
+    assert command[-5:] == ["-f", "mp4", "-movflags", "frag_keyframe+empty_moov", "pipe:1"]
+    assert command.count("-map") == 2
+    command = build_sink_command("ffmpeg", [{**video, "vcodec": "vp9"}, audio], [])
+    assert command[-3:] == ["-f", "matroska", "pipe:1"]
+    extract = {"key": "FFmpegExtractAudio", "preferredquality": "128"}
+    command = build_sink_command("ffmpeg", [audio], [extract])
+    assert command[-6:] == ["libmp3lame", "-b:a", "128k", "-f", "mp3", "pipe:1"]
+
+
+def test_run_download_streams_to_sink(tmp_path):
+    fifo = tmp_path / "sink"
+    os.mkfifo(fifo)
+    received = []
+    reader = threading.Thread(target=lambda: received.append(fifo.read_bytes()))
+    reader.start()
+    sink = FileSink(str(fifo))
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True, "sink": sink}
+    with FakeMediaServer(media_size=512 * 1024) as server:
+        info, output = run_download(server.url("/media/clip.mp4"), ydl_opts)
+    sink.close()
+    reader.join(5)
+    assert output == str(fifo)
+    assert len(received[0]) == 512 * 1024
+    assert os.listdir(tmp_path) == ["sink"]
+
+
+def test_run_download_sink_stopped_by_abort(tmp_path):
+    sink = FileSink(str(tmp_path / "out.mp4"))
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True, "sink": sink}
+    download_abort.set()
+    try:
+        with FakeMediaServer(media_size=512 * 1024) as server:
+            with pytest.raises(DownloadCancelled):
+                run_download(server.url("/media/clip.mp4"), ydl_opts)
+    finally:
+        download_abort.clear()
+        sink.close()
+    assert os.path.getsize(tmp_path / "out.mp4") == 0
+
+
+def test_sink_backend_must_implement_interface():
+    class PartialSink(Sink):
+        def open(self, info):
+            return open(os.devnull, "wb")
+
+    with pytest.raises(TypeError):
+        PartialSink()
+
+
+@pytest.mark.parametrize("mode", ["wb", "ab"])
+def test_append_file(tmp_path, mode):
+    fragment = tmp_path / "frag"
+    fragment.write_bytes(b"0123456789" * 1000)
+    output = tmp_path / "out"
+    output.write_bytes(b"head")
+    with open(output, mode) as target:
+        if mode == "wb":
+            target.write(b"head")
+        append_file(str(fragment), target)
+        target.write(b"tail")
+    assert output.read_bytes() == b"head" + b"0123456789" * 1000 + b"tail"
+
+
+@pytest.mark.parametrize(
+    "request_path, size", [("/hls/master.m3u8", 6 * 65536), ("/dash/manifest.mpd", 7 * 65536)]
+)
+def test_fragments_appended_by_kernel(mocker, tmp_path, request_path, size):
+    append = mocker.patch("eagle_downloader.main.append_file", wraps=append_file)
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True, "fixup": "never"}
+    with FakeMediaServer() as server:
+        with SegmentedYoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(server.url(request_path), download=True)
+    output = info["requested_downloads"][-1]["filepath"]
+    assert os.path.getsize(output) == size
+    assert append.call_count == size // 65536
+    assert os.listdir(tmp_path) == [os.path.basename(output)]
+
+
 @pytest.mark.asyncio
 async def test_perform_download_success(mocker):
     ytdl_mock = MagicMock()
@@ -503,10 +1279,214 @@ async def test_perform_download_success(mocker):
     ytdl_mock.return_value.__enter__.return_value = ytdl_instance
     mocker.patch("yt_dlp.YoutubeDL", ytdl_mock)
     progress = Mock()
-    await perform_download("http://example.com", {}, progress, asyncio.Lock())
+    await perform_download("http://example.com", {}, progress)
     progress.close.assert_called_once()
 
 
+@pytest.mark.asyncio
+async def test_perform_download_reuses_info(mocker):
+    ytdl_instance = MagicMock()
+    ytdl_instance.process_ie_result = MagicMock(return_value={"id": "123"})
+    ytdl_mock = mocker.patch("eagle_downloader.main.SegmentedYoutubeDL")
+    ytdl_mock.return_value.__enter__.return_value = ytdl_instance
+    info = {"id": "123", "title": "Test Video"}
+    await perform_download("http://example.com", {}, Mock(), info=info)
+    ytdl_instance.process_ie_result.assert_called_once_with(info, download=True)
+    ytdl_instance.extract_info.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_perform_download_derives_outputs(mocker):
+    ytdl_instance = MagicMock()
+    ytdl_instance.extract_info = MagicMock(
+        return_value={"requested_downloads": [{"filepath": "video.mp4"}]}
+    )
+    ytdl_mock = mocker.patch("eagle_downloader.main.SegmentedYoutubeDL")
+    ytdl_mock.return_value.__enter__.return_value = ytdl_instance
+    mock_derive = mocker.patch("eagle_downloader.main.derive_outputs", AsyncMock())
+    ydl_opts = {"postprocessors": get_postprocessors("both", "192", outputs=["mp3"])}
+    await perform_download("http://example.com", ydl_opts, Mock())
+    passed_opts = ytdl_mock.call_args[0][0]
+    assert [pp["key"] for pp in passed_opts["postprocessors"]] == ["FFmpegVideoConvertor"]
+    mock_derive.assert_awaited_once_with("video.mp4", ["mp3"], "192")
+
+
+@pytest.mark.asyncio
+async def test_perform_download_traced(mocker):
+    tracer = Tracer()
+    tracer.enable()
+    mocker.patch("eagle_downloader.main.tracer", tracer)
+    ytdl_instance = MagicMock()
+    ytdl_instance.extract_info = MagicMock(return_value={"id": "123"})
+    ytdl_instance.prepare_filename = MagicMock(return_value="video.mp4")
+    ytdl_mock = mocker.patch("eagle_downloader.main.SegmentedYoutubeDL")
+    ytdl_mock.return_value.__enter__.return_value = ytdl_instance
+    await perform_download("http://example.com", {}, Mock())
+    names = {e["name"] for e in tracer.events}
+    assert {"perform_download", "yt-dlp.download"} <= names
+
+
+def test_rate_shaper_reserve():
+    shaper = RateShaper(rate=1, burst=2, limits={"slow.com": (0.5, 1)})
+    assert [shaper.reserve("a.com", 0) for _ in range(4)] == [0, 0, 1.0, 2.0]
+    assert shaper.reserve("a.com", 10) == 0
+    assert [shaper.reserve("slow.com", 0) for _ in range(2)] == [0, 2.0]
+    shaper.configure(0, 0)
+    assert shaper.reserve("a.com", 0) == 0
+
+
+def test_bandwidth_limiter_reserve(mocker):
+    mocker.patch("eagle_downloader.main.perf_counter", return_value=0)
+    limiter = BandwidthLimiter(rate=1000)
+    assert [limiter.reserve(500) for _ in range(4)] == [0, 0, 0.5, 1.0]
+    limiter.configure(None)
+    assert limiter.reserve(10**9) == 0
+    limiter.shared = Mock(value=2000.0)
+    assert [limiter.reserve(2000), limiter.reserve(1000)] == [0, 0.5]
+
+
+def test_bandwidth_hook(mocker):
+    throttle = mocker.patch("eagle_downloader.main.bandwidth.throttle")
+    hook = BandwidthHook()
+    for downloaded in (100, 250, 250):
+        hook({"status": "downloading", "downloaded_bytes": downloaded, "tmpfilename": "a.part"})
+    hook({"status": "downloading", "downloaded_bytes": 40, "tmpfilename": "b.part"})
+    hook({"status": "finished", "downloaded_bytes": 250, "filename": "a"})
+    assert [c.args[0] for c in throttle.call_args_list] == [100, 150, 40]
+
+
+def test_parse_schedule():
+    assert parse_schedule("08:00-18:30=1M/2, 22:00-06:00=none/10,12:00-13:00=500K") == [
+        (480, 1110, 1024 * 1024, 2),
+        (1320, 360, None, 10),
+        (720, 780, 500 * 1024, None),
+    ]
+    invalid = (
+        "08:00-18:00",
+        "8-18=1M",
+        "08:00-25:00=1M",
+        "08:00-18:00=fast",
+        "08:00-08:00=1M",
+        "08:00-18:00=1M/0",
+    )
+    for spec in invalid:
+        with pytest.raises(ValueError, match="Invalid schedule window"):
+            parse_schedule(spec)
+
+
+def test_schedule_current():
+    schedule = Schedule()
+    schedule.configure(parse_schedule("08:00-18:00=1M/2,22:00-06:00=none/10"))
+    at = lambda hour, minute=0: Mock(tm_hour=hour, tm_min=minute)  # noqa: E731
+    assert schedule.current(at(8))[3] == 2
+    assert schedule.current(at(17, 59))[3] == 2
+    assert schedule.current(at(18)) is None
+    assert schedule.current(at(23))[3] == 10
+    assert schedule.current(at(3))[3] == 10
+    assert schedule.current(at(6)) is None
+    assert schedule.peak(5) == 10
+
+
+@pytest.mark.asyncio
+async def test_schedule_apply(mocker, capsys):
+    configure = mocker.patch("eagle_downloader.main.bandwidth.configure")
+    mocker.patch("eagle_downloader.main.download_processes.set_rate")
+    schedule = Schedule()
+    schedule.configure(parse_schedule("08:00-18:00=1M/2"))
+    slots = DownloadSlots(5)
+    schedule.track(slots)
+    schedule.apply(Mock(tm_hour=9, tm_min=0))
+    assert slots.limit == 2
+    configure.assert_called_with(1024 * 1024)
+    assert "Schedule 08:00-18:00: 1024 KiB/s, 2 concurrent downloads." in capsys.readouterr().out
+    schedule.apply(Mock(tm_hour=20, tm_min=0))
+    assert slots.limit == 5
+    configure.assert_called_with(None)
+    schedule.task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_download_slots_resize():
+    slots = DownloadSlots(1)
+    await slots.acquire()
+    waiters = [asyncio.create_task(slots.acquire()) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert not any(w.done() for w in waiters)
+    slots.resize(3)
+    await asyncio.sleep(0)
+    assert [w.done() for w in waiters] == [True, True, False]
+    assert slots.active == 3 and slots.locked()
+    slots.resize(1)
+    slots.release()
+    slots.release()
+    await asyncio.sleep(0)
+    assert not waiters[2].done()
+    waiters[2].cancel()
+    slots.release()
+    assert slots.active == 0
+
+
+def test_rate_shaper_key():
+    assert RateShaper.key("https://www.youtube.com/watch?v=1") == "youtube.com"
+    assert RateShaper.key("https://youtu.be/1") == "youtu.be"
+
+
+@pytest.mark.asyncio
+async def test_rate_shaper_acquire(capsys):
+    shaper = RateShaper(rate=50, burst=1)
+    await shaper.acquire("https://example.com/1")
+    await shaper.acquire("https://example.com/2")
+    metrics = shaper.metrics["example.com"]
+    assert metrics["requests"] == 2
+    assert metrics["delayed"] == 1
+    assert 0 < metrics["delay_max"] <= 0.02
+    shaper.report()
+    assert "Paced example.com: 1 of 2 extractions waited" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_extract_entry_info_paced(mocker):
+    acquire = mocker.patch("eagle_downloader.main.rate_shaper.acquire", AsyncMock())
+    mocker.patch("eagle_downloader.main.fetch_entry_info", return_value={"id": "1"})
+    assert await extract_entry_info("http://example.com", {}) == {"id": "1"}
+    acquire.assert_awaited_once_with("http://example.com")
+
+
+@pytest.mark.asyncio
+async def test_extract_entry_info(mocker):
+    ytdl_instance = MagicMock()
+    ytdl_instance.extract_info = MagicMock(return_value={"id": "123"})
+    ytdl_mock = mocker.patch("eagle_downloader.main.YoutubeDL")
+    ytdl_mock.return_value.__enter__.return_value = ytdl_instance
+    assert await extract_entry_info("http://example.com", {}) == {"id": "123"}
+    ytdl_instance.extract_info.assert_called_once_with(
+        "http://example.com", download=False, process=False
+    )
+
+
+@pytest.mark.asyncio
+async def test_perform_download_plans_compact_entry(mocker):
+    info = {
+        "id": "123",
+        "duration": 10,
+        "formats": [
+            {"format_id": "18", "vcodec": "avc1", "acodec": "mp4a", "height": 360, "tbr": 500},
+        ],
+    }
+    ytdl_instance = MagicMock()
+    ytdl_instance.extract_info = MagicMock(return_value=info)
+    ytdl_instance.process_ie_result = MagicMock(return_value=info)
+    ytdl_instance.prepare_filename = MagicMock(return_value="video.mp4")
+    ytdl_mock = mocker.patch("eagle_downloader.main.YoutubeDL")
+    mocker.patch("eagle_downloader.main.SegmentedYoutubeDL", ytdl_mock)
+    ytdl_mock.return_value.__enter__.return_value = ytdl_instance
+    ydl_opts = get_ydl_options(".", None, "both", "192", "720")
+    result = await perform_download("http://example.com", ydl_opts, Mock())
+    assert result is info
+    ytdl_instance.process_ie_result.assert_called_once_with(info, download=True)
+    assert ytdl_mock.call_args[0][0]["format"] == "18"
+
+
 @pytest.mark.asyncio
 async def test_perform_download_cancelled(mocker, capsys):
     def mock_extract_info(*args, **kwargs):
@@ -521,12 +1501,83 @@ async def test_perform_download_cancelled(mocker, capsys):
 
     progress = Mock()
     await perform_download(
-        "http://example.com", {"outtmpl": "template"}, progress, asyncio.Lock()
+        "http://example.com", {"outtmpl": "template"}, progress
     )
     out, err = capsys.readouterr()
     assert "Download cancelled" in out or "ERROR: Unsupported URL" in out
 
 
+@pytest.mark.asyncio
+async def test_perform_download_stopped_keeps_partial_files(mocker, capsys):
+    mocker.patch(
+        "eagle_downloader.main.run_download", side_effect=DownloadCancelled("stopped")
+    )
+    cleanup = mocker.patch("eagle_downloader.main.cleanup_failed_download")
+    progress = Mock()
+    result = await perform_download(
+        "http://example.com", {"outtmpl": "template"}, progress
+    )
+    assert result is None
+    cleanup.assert_not_called()
+    assert "Download cancelled" in capsys.readouterr().out
+
+
+def test_download_stopped_by_abort(tmp_path):
+    ydl_opts = {"outtmpl": str(tmp_path / "%(id)s.%(ext)s"), "quiet": True}
+    download_abort.set()
+    try:
+        with FakeMediaServer(media_size=1024) as server, SegmentedYoutubeDL(ydl_opts) as ydl:
+            with pytest.raises(DownloadCancelled):
+                ydl.extract_info(server.url("/media/clip.mp4"), download=True)
+    finally:
+        download_abort.clear()
+
+
+@pytest.mark.asyncio
+async def test_drain_signals(mocker, capsys):
+    abort = mocker.patch("eagle_downloader.main.download_processes.abort")
+    shutdown_event = asyncio.Event()
+    drain = Drain(timeout=30)
+
+    async def downloads():
+        drain.install(shutdown_event)
+        try:
+            await asyncio.sleep(10)
+        finally:
+            drain.remove()
+
+    task = asyncio.create_task(downloads())
+    await asyncio.sleep(0)
+    drain.signal()
+    await asyncio.sleep(0)
+    assert shutdown_event.is_set()
+    assert not task.done()
+    assert "up to 30s" in capsys.readouterr().out
+    drain.signal()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert download_abort.is_set()
+    abort.assert_called_once()
+    download_abort.clear()
+
+
+@pytest.mark.asyncio
+async def test_drain_deadline(mocker):
+    mocker.patch("eagle_downloader.main.download_processes.abort")
+    shutdown_event = asyncio.Event()
+    drain = Drain(timeout=0.01)
+
+    async def downloads():
+        drain.install(shutdown_event)
+        drain.signal()
+        await asyncio.sleep(10)
+
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(downloads(), 5)
+    assert drain.task is None
+    download_abort.clear()
+
+
 @pytest.mark.asyncio
 async def test_perform_download_exception(mocker, capsys):
     def mock_extract_info(*args, **kwargs):
@@ -541,12 +1592,224 @@ async def test_perform_download_exception(mocker, capsys):
 
     progress = Mock()
     await perform_download(
-        "http://example.com", {"outtmpl": "template"}, progress, asyncio.Lock()
+        "http://example.com", {"outtmpl": "template"}, progress
     )
     out, err = capsys.readouterr()
     assert "Error downloading" in out or "Unsupported URL" in out
 
 
+@pytest.mark.asyncio
+async def test_perform_download_no_info(mocker, tmp_path, capsys):
+    ytdl_instance = MagicMock()
+    ytdl_instance.extract_info = MagicMock(return_value=None)
+    ytdl_mock = mocker.patch("eagle_downloader.main.SegmentedYoutubeDL")
+    ytdl_mock.return_value.__enter__.return_value = ytdl_instance
+    (tmp_path / "1_Video.f137.mp4.part").write_bytes(b"x")
+    (tmp_path / "2_Other.mp4.part").write_bytes(b"x")
+    ydl_opts = {"outtmpl": "1_Video.%(ext)s", "paths": {"home": str(tmp_path)}}
+    result = await perform_download("http://example.com", ydl_opts, Mock())
+    out, err = capsys.readouterr()
+    assert result is None
+    assert "Error downloading" in out
+    assert sorted(os.listdir(tmp_path)) == ["2_Other.mp4.part"]
+
+
+def test_is_partial_file():
+    assert is_partial_file("video.mp4.part") is True
+    assert is_partial_file("video.f137.mp4.part-Frag3") is True
+    assert is_partial_file("video.mp4.ytdl") is True
+    assert is_partial_file("video.mp4") is False
+
+
+def test_remove_partial_files(tmp_path):
+    (tmp_path / "1_Video.mp4.part").write_bytes(b"x")
+    (tmp_path / "1_Video.mp4").write_bytes(b"x")
+    removed = remove_partial_files([str(tmp_path), str(tmp_path / "missing")], "1_")
+    assert removed == ["1_Video.mp4.part"]
+    assert os.listdir(tmp_path) == ["1_Video.mp4"]
+
+
+def test_cleanup_failed_download_without_prefix(tmp_path):
+    (tmp_path / "1_Video.mp4.part").write_bytes(b"x")
+    ydl_opts = {"outtmpl": "%(id)s_%(title)s.%(ext)s", "paths": {"home": str(tmp_path)}}
+    assert cleanup_failed_download(ydl_opts) == []
+    assert os.listdir(tmp_path) == ["1_Video.mp4.part"]
+
+
+def test_cleanup_failed_download_sharded(tmp_path):
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "ab" / "1_Video.mp4.part").write_bytes(b"x")
+    ydl_opts = {"outtmpl": "ab/1_Video.%(ext)s", "paths": {"home": str(tmp_path)}}
+    assert cleanup_failed_download(ydl_opts) == ["1_Video.mp4.part"]
+    assert os.listdir(tmp_path / "ab") == []
+
+
+def test_sweep_partial_files_sharded(tmp_path):
+    (tmp_path / "ab").mkdir()
+    stale = tmp_path / "ab" / "old.mp4.part"
+    stale.write_bytes(b"x")
+    os.utime(stale, (0, 0))
+    assert sweep_partial_files([str(tmp_path)]) == ["old.mp4.part"]
+
+
+def test_get_output_shard():
+    assert get_output_shard("123") == get_output_shard("123")
+    assert re.fullmatch(r"[0-9a-f]{2}", get_output_shard("dQw4w9WgXcQ"))
+
+
+def test_output_planner_index(tmp_path):
+    (tmp_path / "1_Video.mp4").write_bytes(b"x")
+    (tmp_path / "1_Video.jpg").write_bytes(b"x")
+    (tmp_path / "2_Other.f137.mp4").write_bytes(b"x")
+    (tmp_path / "3_Part.mp4.part").write_bytes(b"x")
+    (tmp_path / "ab").mkdir()
+    (tmp_path / "ab" / "4_Sharded.webm").write_bytes(b"x")
+    (tmp_path / "notes").mkdir()
+    (tmp_path / "notes" / "5_Hidden.mp4").write_bytes(b"x")
+    planner = OutputPlanner(str(tmp_path), shard=True)
+    assert planner.index() == 5
+    assert planner.existing("1_Video", ["mp4"]) == str(tmp_path / "1_Video.mp4")
+    assert planner.existing("cd/1_Video", ["mp4"]) == str(tmp_path / "1_Video.mp4")
+    assert planner.existing("1_Video", ["mp3"]) is None
+    sharded = str(tmp_path / "ab" / "4_Sharded.webm")
+    assert planner.existing("ab/4_Sharded", ["mp4", "webm"]) == sharded
+    assert planner.existing("2_Other", ["mp4"]) is None
+    assert planner.existing("3_Part", ["mp4"]) is None
+    assert planner.existing("1_Vid", ["mp4"]) is None
+    assert planner.has_partial("3_Part") is True
+    assert planner.has_partial("1_Video") is False
+
+
+def test_output_planner_add(tmp_path):
+    planner = OutputPlanner(str(tmp_path))
+    planner.index()
+    planner.add(str(tmp_path / "ab" / "1_Video.mp4"))
+    planner.add(str(tmp_path / "ab" / "1_Video.mp4"))
+    planner.add(str(tmp_path.parent / "elsewhere.mp4"))
+    planner.add(None)
+    assert planner.names == ["ab/1_Video.mp4"]
+    assert planner.existing("ab/1_Video", ["mp4"]) == str(tmp_path / "ab" / "1_Video.mp4")
+
+
+def test_output_planner_assign():
+    planner = OutputPlanner("downloads")
+    first, second, retry = object(), object(), object()
+    assert planner.assign("1", "Video", "http://a", first) == "1_Video"
+    assert planner.assign("1", "Video", "http://a", first) == "1_Video"
+    assert planner.assign("1", "Video", "http://a", second) is None
+    assert planner.assign("1", "Video", "http://b", second) == "1_Video_2"
+    planner.release("1_Video")
+    assert planner.assign("1", "Video", "http://a", retry) == "1_Video"
+    sharded = OutputPlanner("downloads", shard=True)
+    assert sharded.assign("1", "Video", "http://a") == f"{get_output_shard('1')}/1_Video"
+
+
+def test_sweep_partial_files(tmp_path):
+    stale = tmp_path / "old.mp4.part"
+    stale.write_bytes(b"x")
+    os.utime(stale, (0, 0))
+    (tmp_path / "new.mp4.part").write_bytes(b"x")
+    (tmp_path / "done.mp4").write_bytes(b"x")
+    assert sweep_partial_files([str(tmp_path)]) == ["old.mp4.part"]
+    assert sorted(os.listdir(tmp_path)) == ["done.mp4", "new.mp4.part"]
+
+
+def test_partial_sweep(tmp_path):
+    stale = tmp_path / "old.mp4.part"
+    stale.write_bytes(b"x")
+    os.utime(stale, (0, 0))
+    sweep = PartialSweep()
+    assert sweep.sweep([str(tmp_path)]) == []
+    assert stale.exists()
+    sweep.configure(48)
+    assert sweep.sweep([str(tmp_path)]) == ["old.mp4.part"]
+
+
+def test_estimate_download_size():
+    plan = {"filesize": 1000, "merge": True, "postprocessors": []}
+    assert estimate_download_size({"format_plan": plan}) == 2200
+    assert estimate_download_size({"filesize_approx": 1000}) == 1100
+    requested = [{"filesize": 600}, {"filesize": 400}]
+    assert estimate_download_size({"requested_formats": requested}) == 2200
+    assert estimate_download_size({"id": "1"}) == 0
+
+
+@pytest.mark.asyncio
+async def test_disk_admission_queues_until_released(mocker):
+    mocker.patch("eagle_downloader.main.disk_usage", return_value=Mock(free=1000))
+    admission = DiskAdmission(["/downloads"], recheck_interval=0.01)
+    assert await admission.reserve(600) is True
+    waiter = asyncio.create_task(admission.reserve(600))
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    await admission.release(600)
+    assert await waiter is True
+    assert admission.reserved == 600
+
+
+@pytest.mark.asyncio
+async def test_disk_admission_rejects_oversized(mocker):
+    mocker.patch("eagle_downloader.main.disk_usage", return_value=Mock(free=1000))
+    admission = DiskAdmission(["/downloads"])
+    assert await admission.reserve(5000) is False
+    assert admission.reserved == 0
+
+
+@pytest.mark.asyncio
+async def test_download_with_semaphore_passes_admission(mocker):
+    entry = {"webpage_url": "http://example.com", "title": "Test Video"}
+    mock_download_entry = mocker.patch("eagle_downloader.main.download_entry", AsyncMock())
+    admission = Mock()
+    await download_with_semaphore(
+        entry, {}, asyncio.Semaphore(1), asyncio.Event(), admission
+    )
+    mock_download_entry.assert_awaited_once_with(entry, {"disk_admission": admission})
+
+
+def mock_planned_download(mocker):
+    info = {
+        "id": "123",
+        "title": "Test Video",
+        "formats": [
+            {"format_id": "18", "vcodec": "avc1", "acodec": "mp4a", "height": 360,
+             "filesize": 1000},
+        ],
+    }
+    ytdl_instance = MagicMock()
+    ytdl_instance.extract_info = MagicMock(return_value=info)
+    ytdl_instance.process_ie_result = MagicMock(return_value=info)
+    ytdl_instance.prepare_filename = MagicMock(return_value="video.mp4")
+    ytdl_mock = mocker.patch("eagle_downloader.main.YoutubeDL")
+    mocker.patch("eagle_downloader.main.SegmentedYoutubeDL", ytdl_mock)
+    ytdl_mock.return_value.__enter__.return_value = ytdl_instance
+    return ytdl_mock, ytdl_instance
+
+
+@pytest.mark.asyncio
+async def test_perform_download_reserves_planned_size(mocker):
+    ytdl_mock, ytdl_instance = mock_planned_download(mocker)
+    admission = Mock(reserve=AsyncMock(return_value=True), release=AsyncMock())
+    ydl_opts = get_ydl_options(".", None, "both", "192", "720")
+    ydl_opts["disk_admission"] = admission
+    assert await perform_download("http://example.com", ydl_opts, Mock())
+    admission.reserve.assert_awaited_once_with(2200)
+    admission.release.assert_awaited_once_with(2200)
+    assert "disk_admission" not in ytdl_mock.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_perform_download_no_disk_space(mocker, capsys):
+    _, ytdl_instance = mock_planned_download(mocker)
+    admission = Mock(reserve=AsyncMock(return_value=False), release=AsyncMock())
+    ydl_opts = get_ydl_options(".", None, "video", None, "720")
+    ydl_opts["disk_admission"] = admission
+    assert await perform_download("http://example.com", ydl_opts, Mock()) is None
+    out, err = capsys.readouterr()
+    assert "Not enough disk space for: Test Video" in out
+    ytdl_instance.process_ie_result.assert_not_called()
+    admission.release.assert_not_awaited()
+
+
 @pytest.mark.asyncio
 async def test_process_entries_no_entries(capfd):
     await process_entries([], {}, 5, asyncio.Event())
@@ -559,8 +1822,7 @@ async def test_create_download_tasks(mocker):
     entries = [{"id": "1"}, {"id": "2"}]
     asyncio.Semaphore(2)
     shutdown_event = asyncio.Event()
-    lock = asyncio.Lock()
-    tasks = create_download_tasks(entries, {}, 2, shutdown_event, lock)
+    tasks = create_download_tasks(entries, {}, 2, shutdown_event)
     assert len(tasks) == 2
 
 
@@ -569,11 +1831,77 @@ async def test_download_with_semaphore(mocker):
     entry = {"webpage_url": "http://example.com", "title": "Test Video"}
     mock_download_entry = mocker.patch("eagle_downloader.main.download_entry", AsyncMock())
     await download_with_semaphore(
-        entry, {}, asyncio.Semaphore(1), asyncio.Event(), asyncio.Lock()
+        entry, {}, asyncio.Semaphore(1), asyncio.Event()
     )
     mock_download_entry.assert_awaited_once()
 
 
+def test_expected_file_size():
+    info = {"filesize": 100}
+    assert expected_file_size(info, {}) == 100
+    audio_opts = {"postprocessors": get_postprocessors("audio", "192")}
+    assert expected_file_size(info, audio_opts) is None
+    assert expected_file_size({**info, "requested_formats": [{}, {}]}, {}) is None
+
+
+def test_find_duration_problems():
+    probe = {
+        "format": {"duration": "60.0"},
+        "streams": [
+            {"codec_type": "video", "duration": "60.0"},
+            {"codec_type": "audio", "duration": "31.5"},
+            {"codec_type": "video", "duration": "0.04", "disposition": {"attached_pic": 1}},
+        ],
+    }
+    assert find_duration_problems(probe, 61) == ["audio stream ends at 31.5s of 60.0s"]
+    assert find_duration_problems(probe, 120)[0] == "lasts 60.0s instead of 120.0s"
+    assert find_duration_problems({"format": {}}) == ["the container has no duration"]
+
+
+def test_hash_file(tmp_path):
+    media = tmp_path / "media.mp4"
+    media.write_bytes(b"x" * 5000)
+    assert hash_file(str(media), "sha256") == hashlib.sha256(b"x" * 5000).hexdigest()
+    empty = tmp_path / "empty.mp4"
+    empty.write_bytes(b"")
+    assert hash_file(str(empty), "md5") == hashlib.md5(b"").hexdigest()
+
+
+@pytest.mark.asyncio
+async def test_verifier(mocker, tmp_path, capsys):
+    media = tmp_path / "media.mp4"
+    media.write_bytes(b"x" * 100)
+    probe = {"format": {"duration": "10.0"}, "streams": []}
+    mocker.patch("eagle_downloader.main.probe_media", AsyncMock(return_value=probe))
+    verifier = Verifier()
+    verifier.configure(False, "sha256")
+    info = {"requested_downloads": [{"filepath": str(media)}], "duration": 10, "filesize": 100}
+    assert await verifier.verify(info, {})
+    assert info["checksum"] == "sha256:" + hashlib.sha256(b"x" * 100).hexdigest()
+    info = {**info, "filesize": 200}
+    assert not await verifier.verify(info, {})
+    assert not media.exists()
+    verifier.stop()
+    assert "has 100 bytes instead of 200" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_download_with_semaphore_requeues_failed_verification(mocker):
+    entry = {"webpage_url": "http://example.com", "title": "Test Video"}
+    result = {"requested_downloads": [{"filepath": "video.mp4"}]}
+    mock_download_entry = mocker.patch(
+        "eagle_downloader.main.download_entry", AsyncMock(return_value=result)
+    )
+    verifier = mocker.patch("eagle_downloader.main.verifier")
+    verifier.verify = AsyncMock(side_effect=[False, True])
+    semaphore = asyncio.Semaphore(1)
+    assert await download_with_semaphore(
+        entry, {}, semaphore, asyncio.Event()
+    ) is result
+    assert mock_download_entry.await_count == 2
+    assert not semaphore.locked()
+
+
 @pytest.mark.asyncio
 async def test_show_spinner():
     stop_event = asyncio.Event()
@@ -597,6 +1925,40 @@ async def test_handle_playlist_entries(mocker):
     mock_process_entries.assert_awaited_once()
 
 
+@pytest.mark.asyncio
+async def test_perform_downloads_single_reserves_disk(mocker, tmp_path):
+    mock_download = mocker.patch(
+        "eagle_downloader.main.download_with_semaphore", AsyncMock(return_value={})
+    )
+    ydl_opts = {"paths": {"home": str(tmp_path)}}
+    info = {"id": "1", "title": "Test Video"}
+    assert await perform_downloads(info, ydl_opts, False, 1, asyncio.Event()) == [{}]
+    admission = mock_download.await_args.args[4]
+    assert isinstance(admission, DiskAdmission)
+    assert admission.directories == [str(tmp_path)]
+
+
+@pytest.mark.asyncio
+async def test_perform_downloads_single_follows_schedule(mocker):
+    configure = mocker.patch("eagle_downloader.main.bandwidth.configure")
+    mocker.patch("eagle_downloader.main.download_processes.set_rate")
+    mocker.patch("eagle_downloader.main.localtime", return_value=Mock(tm_hour=9, tm_min=0))
+    scheduled = Schedule()
+    scheduled.configure(parse_schedule("08:00-18:00=1M/2"))
+    mocker.patch("eagle_downloader.main.schedule", scheduled)
+
+    async def download(info, ydl_opts, slots, shutdown_event, admission):
+        await asyncio.sleep(0)
+        return slots
+
+    mocker.patch("eagle_downloader.main.download_with_semaphore", side_effect=download)
+    info = {"id": "1", "title": "Test Video"}
+    [slots] = await perform_downloads(info, {}, False, 1, asyncio.Event())
+    assert slots in scheduled.slots
+    configure.assert_called_with(1024 * 1024)
+    scheduled.task.cancel()
+
+
 @pytest.mark.asyncio
 async def test_download_media_no_info(mocker):
     mocker.patch("eagle_downloader.main.extract_info", AsyncMock(return_value=None))
@@ -606,6 +1968,254 @@ async def test_download_media_no_info(mocker):
     # Ensure that no exception is raised
 
 
+def test_sync_state_take_new_stops_paging(tmp_path):
+    state = SyncState(str(tmp_path / "sync.json"))
+    state.sources["src"] = {"ids": ["c"], "upload_date": None}
+
+    def listing():
+        yield {"id": "a"}
+        yield {"id": "b"}
+        yield {"id": "c"}
+        raise AssertionError("paged past the watermark")
+
+    assert [e["id"] for e in state.take_new("src", listing())] == ["a", "b"]
+    assert state.take_new("other", [{"id": "a"}]) == [{"id": "a"}]
+
+
+def test_sync_state_upload_date(tmp_path):
+    state = SyncState(str(tmp_path / "sync.json"))
+    state.sources["src"] = {"ids": [], "upload_date": "20260110"}
+    assert state.is_synced("src", {"id": "x", "upload_date": "20260109"})
+    assert not state.is_synced("src", {"id": "x", "upload_date": "20260110"})
+    assert not state.is_synced("src", {"id": "x"})
+
+
+def test_sync_state_advance(tmp_path):
+    state_file = str(tmp_path / "sync.json")
+    state = SyncState(state_file)
+    entries = [{"id": "a"}, {"id": "b"}, {"id": "c"}, {"url": "http://example.com/d"}]
+    results = [{"upload_date": "20260104"}, None, {"upload_date": "20260102"}, {}]
+    state.advance("src", entries, results)
+    reloaded = SyncState(state_file)
+    assert reloaded.sources["src"] == {
+        "ids": ["c", "http://example.com/d"],
+        "upload_date": "20260102",
+    }
+    reloaded.advance("src", [{"id": "e"}], [None])
+    assert reloaded.sources["src"]["ids"] == ["c", "http://example.com/d"]
+
+
+def test_extract_new_entries(tmp_path):
+    state = SyncState(str(tmp_path / "sync.json"))
+    with FakeMediaServer(playlist_size=4) as server, YoutubeDL(
+        {"quiet": True, "extract_flat": "in_playlist"}
+    ) as ydl:
+        url = server.url("/feed.xml")
+        info = extract_new_entries(ydl, url, state)
+        assert len(info["entries"]) == 4
+        state.advance(url, info["entries"], [None, {}, {}, {}])
+        info = extract_new_entries(ydl, url, state)
+    assert [entry["title"] for entry in info["entries"]] == ["Video 0"]
+
+
+@pytest.mark.asyncio
+async def test_download_media_sync_nothing_new(mocker, tmp_path, capsys):
+    mocker.patch(
+        "eagle_downloader.main.extract_info", AsyncMock(return_value={"entries": []})
+    )
+    gather_user_options = mocker.patch(
+        "eagle_downloader.main.gather_user_options", AsyncMock()
+    )
+    state = SyncState(str(tmp_path / "sync.json"))
+    await download_media({"url": "http://example.com"}, asyncio.Event(), state)
+    assert "Nothing new since the last sync." in capsys.readouterr().out
+    gather_user_options.assert_not_awaited()
+
+
+def test_sqlite_work_queue_leases(tmp_path):
+    queue = SqliteWorkQueue(str(tmp_path / "jobs.db"))
+    entries = [EntryRecord(str(i), f"http://example.com/{i}", f"Video {i}") for i in range(2)]
+    assert queue.publish(entries, {"download_type": "video"}) == 2
+    assert queue.publish(entries, {"download_type": "video"}) == 0
+    first = queue.lease("w1", 60)
+    second = queue.lease("w2", 60)
+    assert first["entry"]["url"] == "http://example.com/0"
+    assert first["options"] == {"download_type": "video"}
+    assert queue.lease("w3", 60) is None
+    assert not queue.complete(first["id"], "w2")
+    assert queue.complete(first["id"], "w1")
+    assert queue.fail(second["id"], "w2", "boom")
+    assert queue.unfinished() == 1
+    assert queue.lease("w3", 60)["id"] == second["id"]
+
+
+def test_sqlite_work_queue_expired_lease(tmp_path):
+    queue = SqliteWorkQueue(str(tmp_path / "jobs.db"))
+    queue.publish([EntryRecord("1", "http://example.com/1", "One")], {})
+    job = queue.lease("crashed", -1)
+    assert queue.lease("w2", 60)["id"] == job["id"]
+    assert not queue.renew(job["id"], "crashed", 60)
+    assert queue.release(job["id"], "w2")
+    for worker in ("w3", "w4", "w5"):
+        job = queue.lease(worker, -1)
+    assert queue.lease("w6", 60) is None
+    assert queue.unfinished() == 0
+
+
+def test_open_work_queue(tmp_path):
+    assert isinstance(open_work_queue(str(tmp_path / "a.db")), SqliteWorkQueue)
+    assert open_work_queue(f"sqlite://{tmp_path / 'b.db'}").database == str(tmp_path / "b.db")
+    with pytest.raises(ValueError):
+        open_work_queue("redis://localhost")
+
+
+def test_work_queue_backend_must_implement_interface():
+    class PartialQueue(WorkQueue):
+        def publish(self, entries, options):
+            return 0
+
+    with pytest.raises(TypeError):
+        PartialQueue()
+
+
+@pytest.mark.asyncio
+async def test_queue_worker_drains_queue(mocker, tmp_path, capsys):
+    mocker.patch("eagle_downloader.main.LEASE_POLL_INTERVAL", 0.05)
+    queue = SqliteWorkQueue(str(tmp_path / "jobs.db"))
+    options = {
+        "output_dir": str(tmp_path / "out"),
+        "rate_limit": None,
+        "download_type": "other",
+        "video_output_dir": None,
+        "audio_quality": None,
+        "video_quality": None,
+        "outputs": [],
+        "cookies_file": None,
+    }
+    with FakeMediaServer(media_size=1024) as server:
+        entries = [
+            EntryRecord(f"v{i}", server.url(f"/media/{i}.mp4"), f"Video {i}") for i in range(3)
+        ]
+        queue.publish(entries, options)
+        await QueueWorker(queue, asyncio.Event(), concurrency=2).run()
+    assert queue.unfinished() == 0
+    assert len(os.listdir(tmp_path / "out")) == 3
+    assert "the queue is drained" in capsys.readouterr().out
+
+
+@pytest.mark.asyncio
+async def test_download_media_publishes(mocker, tmp_path):
+    info = {"entries": [{"id": "1", "url": "http://example.com/1", "title": "One"}]}
+    mocker.patch("eagle_downloader.main.extract_info", AsyncMock(return_value=info))
+    user_options = {
+        "output_dir": str(tmp_path),
+        "rate_limit": None,
+        "download_type": "audio",
+        "video_output_dir": None,
+        "audio_quality": "192",
+        "video_quality": None,
+        "outputs": [],
+        "max_concurrent": 2,
+    }
+    mocker.patch(
+        "eagle_downloader.main.gather_user_options", AsyncMock(return_value=user_options)
+    )
+    perform_downloads = mocker.patch("eagle_downloader.main.perform_downloads", AsyncMock())
+    queue = SqliteWorkQueue(str(tmp_path / "jobs.db"))
+    await download_media({"url": "http://example.com"}, asyncio.Event(), work_queue=queue)
+    perform_downloads.assert_not_awaited()
+    job = queue.lease("w1", 60)
+    assert job["entry"]["id"] == "1"
+    assert job["options"]["download_type"] == "audio"
+
+
+@pytest.mark.asyncio
+async def test_downloader_streams_events(tmp_path, mocker, capsys, caplog):
+    size_executor = mocker.patch("eagle_downloader.main.size_executor")
+    caplog.set_level("INFO", logger="eagle_downloader")
+    with FakeMediaServer(playlist_size=3) as server:
+        async with Downloader(max_concurrent=2) as downloader:
+            playlist = downloader.submit(
+                server.url("/feed.xml"), output_dir=str(tmp_path), download_type="other"
+            )
+            events = [event async for event in playlist]
+            results = await playlist
+            assert downloader.semaphore.active == 0
+    completed = [e for e in events if isinstance(e, CompletedEvent)]
+    assert len(completed) == len(results) == 3
+    assert sorted(e.title for e in completed) == ["Video 0", "Video 1", "Video 2"]
+    assert all(os.path.isfile(e.filepath) for e in completed)
+    assert any(isinstance(e, ProgressEvent) and e.percentage == 100 for e in events)
+    assert all(e.job is playlist for e in events)
+    size_executor.assert_not_called()
+    assert downloader.executor._shutdown
+    assert capsys.readouterr().out == ""
+    assert any(r.message.startswith("Completed: ") for r in caplog.records)
+
+
+@pytest.mark.asyncio
+async def test_downloader_logs_schedule(mocker, capsys, caplog):
+    mocker.patch("eagle_downloader.main.bandwidth.configure")
+    mocker.patch("eagle_downloader.main.download_processes.set_rate")
+    mocker.patch("eagle_downloader.main.localtime", return_value=Mock(tm_hour=9, tm_min=0))
+    scheduled = Schedule()
+    scheduled.configure(parse_schedule("08:00-18:00=1M/2"))
+    mocker.patch("eagle_downloader.main.schedule", scheduled)
+    caplog.set_level("INFO", logger="eagle_downloader")
+    async with Downloader(max_concurrent=4) as downloader:
+        await asyncio.sleep(0)
+        assert downloader.semaphore.limit == 2
+    scheduled.task.cancel()
+    assert capsys.readouterr().out == ""
+    assert any(r.message.startswith("Schedule 08:00-18:00") for r in caplog.records)
+
+
+@pytest.mark.asyncio
+async def test_downloader_shares_output_index(tmp_path):
+    foreign = tmp_path / "other.mkv.part"
+    foreign.write_bytes(b"x")
+    os.utime(foreign, (0, 0))
+    with FakeMediaServer(media_size=4096) as server:
+        async with Downloader() as downloader:
+            url = server.url("/media/clip.mp4")
+            first = downloader.submit(url, output_dir=str(tmp_path), download_type="other")
+            await first
+            again = downloader.submit(url, output_dir=str(tmp_path), download_type="other")
+            events = [event async for event in again]
+            assert len(downloader.planners) == len(downloader.admissions) == 1
+            planner = next(iter(downloader.planners.values())).result()
+    assert sorted(planner.names) == ["clip_clip.mp4", "other.mkv.part"]
+    assert isinstance(events[-1], CompletedEvent)
+    assert events[-1].filepath == str(tmp_path / "clip_clip.mp4")
+    assert foreign.exists()
+
+
+@pytest.mark.asyncio
+async def test_downloader_reindexes_outputs(tmp_path):
+    with FakeMediaServer(media_size=4096) as server:
+        async with Downloader() as downloader:
+            url = server.url("/media/clip.mp4")
+            await downloader.submit(url, output_dir=str(tmp_path), download_type="other")
+            (tmp_path / "saved_elsewhere.mp4").write_bytes(b"x")
+            await downloader.submit(url, output_dir=str(tmp_path), download_type="other")
+            planner = next(iter(downloader.planners.values())).result()
+    assert planner.names == ["clip_clip.mp4", "saved_elsewhere.mp4"]
+
+
+@pytest.mark.asyncio
+async def test_downloader_extraction_failed(mocker, tmp_path):
+    mocker.patch("eagle_downloader.main.extract_info", AsyncMock(return_value=None))
+    async with Downloader() as downloader:
+        job = downloader.submit("http://example.com", output_dir=str(tmp_path))
+        events = [event async for event in job]
+        assert await job == []
+    assert len(events) == 1
+    assert isinstance(events[0], FailedEvent)
+    assert events[0].url == "http://example.com"
+    with pytest.raises(RuntimeError):
+        downloader.submit("http://example.com")
+
+
 @pytest.mark.asyncio
 async def test_shutdown(mocker):
     loop = asyncio.get_event_loop()